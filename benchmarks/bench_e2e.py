@@ -0,0 +1,134 @@
+#! /usr/bin/env python
+
+''' End-to-end benchmark of the full MCNP_ACAB.py flow with stand-in COLLAPS, ACAB and
+    htape3x executables and a fake ACAB_LB_PATH, on a synthetic outp.
+    Reports throughput (cells/s), scaling with the number of processes and peak RSS.
+    The real apypa and tally modules are used. apypa parses the synthetic fort.6 of the
+    ACAB stand-in, -nuclides of them per cell, or a copy of the genuine ACAB fort.6 -fort6.
+    The synthetic fort.6 follows the layout of the ACAB-2008 output but has never been
+    checked against apypa: if apypa fails on it, or the campaign finishes no cells, rerun
+    with -fort6 before blaming MCNP_ACAB.
+    Usage: python bench_e2e.py [-cells=200] [-materials=10] [-nuclides=n] [-part=n]
+           [-cost=0.1] [-mode=sleep|cpu] [-nproc=1,2,4|all] [-pipeline=p,e,s] [-fort6=file]
+           [-json=file] [-keep]
+    -pipeline runs the staged pipeline of MCNP_ACAB.py with these workers per stage instead
+    of the pool, the same for every -nproc'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+import synthetic
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+SCRIPT = os.path.join(ROOT, 'src', 'mc2acab', 'MCNP_ACAB.py')
+STANDINS = os.path.join(BENCH_DIR, 'standins')
+
+# Files MCNP_ACAB_Map links from ACAB_LB_PATH
+LIBRARY_FILES = ['DHEAT.dat', 'PHOTON.dat', 'MACOEF.dat', 'EBEATA.dat', 'DECAY.dat', 'WD.dat',
+                 'eaf_n_fis_20070', 'eaf_n_asscfy_20070', 'eaf_n_gxs_211_flt_20070',
+                 'eaf_p_gxs_211_flt_20070']
+
+def make_fake_library(path):
+    ''' Fake ACAB_LB_PATH with placeholders of the files linked in every cell folder'''
+    os.makedirs(path, exist_ok=True)
+    for name in LIBRARY_FILES:
+        with open(os.path.join(path, name), 'w', encoding='utf-8') as libfile:
+            libfile.write(f'{name} placeholder for the MC2ACAB benchmarks\n')
+    return path + os.sep
+
+def scaling_points(spec):
+    ''' Process counts to run: a comma separated list, or all for 1, 2, 4... up to all the cores'''
+    ncores = os.cpu_count()
+    if spec != 'all':
+        return [ncores if n == 'all' else int(n) for n in spec.split(',')]
+    points = [1]
+    while points[-1]*2 < ncores:
+        points.append(points[-1]*2)
+    if points[-1] != ncores:
+        points.append(ncores)
+    return points
+
+def run_campaign(workdir, nproc, part, env, pipeline=None):
+    ''' Run MCNP_ACAB.py in workdir. Returns wall time, peak RSS in MB of the process
+    tree and return code'''
+    args = [sys.executable, SCRIPT, f'-{part}', '-outpfile=outp', '-tally_num=4', '-st_units=1',
+            '-source_term=1e15', '-irr_time=100', f'-nproc={nproc}']
+    if pipeline:
+        args.append(f'-pipeline={pipeline}')
+    with open(os.path.join(workdir, 'run.log'), 'w', encoding='utf-8') as log:
+        start = time.perf_counter()
+        proc = subprocess.Popen(args, cwd=workdir, env=env, stdin=subprocess.DEVNULL,
+                                stdout=log, stderr=subprocess.STDOUT)
+        _, status, rusage = os.wait4(proc.pid, 0)
+        wall = time.perf_counter() - start
+    proc.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    return wall, rusage.ru_maxrss/1024, proc.returncode
+
+def completed_cells(workdir):
+    "Number of cells finished in a campaign, from its metrics"
+    metrics_file = os.path.join(workdir, 'metrics.jsonl')
+    if not os.path.isfile(metrics_file):
+        return 0
+    with open(metrics_file, 'r', encoding='utf-8') as infile:
+        return sum(1 for line in infile if line.strip())
+
+def main():
+    ''' Parse the arguments and run the scaling study'''
+    opts = {'cells': 200, 'materials': 10, 'nuclides': None, 'part': 'n', 'cost': '0.1', 'mode': 'sleep',
+            'nproc': 'all', 'fort6': os.environ.get('MC2ACAB_FORT6_TEMPLATE'), 'json': None,
+            'pipeline': None, 'keep': False}
+    for arg in sys.argv[1:]:
+        if arg == '-keep':
+            opts['keep'] = True
+        elif arg.startswith('-') and '=' in arg:
+            key, value = arg[1:].split('=', 1)
+            if key not in opts:
+                print(__doc__)
+                sys.exit(1)
+            opts[key] = value
+    if opts['fort6'] and not os.path.isfile(opts['fort6']):
+        print(f"No fort.6 {opts['fort6']} to copy")
+        sys.exit(1)
+    env = dict(os.environ)
+    env['PATH'] = STANDINS + os.pathsep + env.get('PATH', '')
+    env['PYTHONPATH'] = os.path.join(ROOT, 'src') + os.pathsep + env.get('PYTHONPATH', '')
+    env['MC2ACAB_STANDIN_COST'] = str(opts['cost'])
+    env['MC2ACAB_STANDIN_MODE'] = opts['mode']
+    if opts['fort6']:
+        env['MC2ACAB_FORT6_TEMPLATE'] = os.path.abspath(opts['fort6'])
+    if opts['nuclides']:
+        env['MC2ACAB_STANDIN_NUCLIDES'] = str(opts['nuclides'])
+    basedir = tempfile.mkdtemp(prefix='mc2acab_bench_')
+    env['ACAB_LB_PATH'] = make_fake_library(os.path.join(basedir, 'lib'))
+    outp = os.path.join(basedir, 'outp')
+    synthetic.write_outp(outp, int(opts['cells']), int(opts['materials']))
+    print(f"{opts['cells']} cells, {opts['materials']} materials, -{opts['part']} run,"
+          f" stand-in cost {opts['cost']} s ({opts['mode']}), in {basedir}")
+    print(f"{'nproc':>6}{'wall s':>10}{'cells':>8}{'cells/s':>10}{'speedup':>9}{'peak RSS MB':>13}")
+    results = []
+    for nproc in scaling_points(opts['nproc']):
+        workdir = os.path.join(basedir, f'nproc_{nproc}')
+        os.makedirs(workdir)
+        shutil.copy(outp, workdir)
+        if 'p' in opts['part']:
+            synthetic.write_histp(os.path.join(workdir, 'histp'))
+        wall, rss, code = run_campaign(workdir, nproc, opts['part'], env, opts['pipeline'])
+        ncells = completed_cells(workdir)
+        results.append({'nproc': nproc, 'wall': wall, 'cells': ncells,
+                        'throughput': ncells/wall, 'peak_rss_mb': rss, 'returncode': code})
+        speedup = results[0]['wall']/wall
+        print(f'{nproc:>6}{wall:>10.2f}{ncells:>8}{ncells/wall:>10.2f}{speedup:>9.2f}{rss:>13.1f}'
+              + ('' if code == 0 else f'  (exit {code}, see {workdir}/run.log)'))
+    if opts['json']:
+        with open(opts['json'], 'w', encoding='utf-8') as outfile:
+            json.dump({'options': opts, 'results': results}, outfile, indent=1)
+    if not opts['keep']:
+        shutil.rmtree(basedir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+#! /usr/bin/env python
+
+''' Microbenchmarks of the outp/RES_H parsers and the summary writer at several
+    model sizes, driven by the synthetic files of synthetic.py.
+    Reports time and peak memory of each operation and its scaling exponent with
+    the number of cells. -record stores the times as baseline; otherwise they are
+    compared with the baseline, and the run fails (exit 1) if an operation got slower
+    than baseline*(1+threshold).
+    Usage: python bench_parsers.py [-sizes=1000,10000,100000] [-repeat=3]
+           [-baseline=bench_parsers_baseline.json] [-threshold=0.25] [-record] [-ops=a,b]'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import tracemalloc
+from contextlib import redirect_stdout
+from io import StringIO
+from types import SimpleNamespace
+import numpy as np
+import synthetic
+from mc2acab import MCNP_outparser
+from mc2acab import cell as cel
+from mc2acab import material
+from mc2acab import pyhtape3x
+
+def _summary_data(ncells, ntimes=10, nnuclides=100, seed=0):
+    "Synthetic totaldata and tally for summary_table_gen, as MCNP_ACAB_Map returns them"
+    import pandas as pd
+    rng = np.random.default_rng(seed)
+    times = [1.0] + list(np.geomspace(3600, 1.6E8, ntimes-1))
+    nuclides = [f'N{i}' for i in range(nnuclides)] + ['Total']
+    energies = list(np.geomspace(0.01, 10, 24)) + ['Total']
+    totaldata = []
+    for _ in range(ncells):
+        tables = []
+        for name in ['Decay', 'Gamma', 'Heat', 'Dose', 'mol']:
+            if name == 'Gamma':
+                table = pd.DataFrame(rng.random((len(energies), ntimes)), index=energies, columns=times)
+            else:
+                table = pd.DataFrame(rng.random((ntimes, len(nuclides))), index=times, columns=nuclides)
+            table.columns.name = name
+            tables.append(table)
+        totaldata.append(tuple(tables))
+    tally = SimpleNamespace(cells=list(range(10, 10+ncells)), mass=rng.uniform(1, 1E3, ncells))
+    return totaldata, tally
+
+def operations(files, ncells):
+    ''' Dictionary name: callable of the benchmarked operations for a model of ncells'''
+    outp, res_h = files['outp'], files['res_h']
+    last_cell = 10 + ncells - 1
+    ops = {'input_finder': lambda: MCNP_outparser.input_finder(outp),
+           'cell.oget': lambda: cel.oget(outp, last_cell),
+           'cell.ogetall': lambda: cel.ogetall(outp),
+           'material.oget': lambda: material.oget(outp, files['last_mat']),
+           'get_histpcells': lambda: MCNP_outparser.get_histpcells(outp),
+           'get_atom_feeds': lambda: pyhtape3x.get_atom_feeds(files['res_h_cells'], res_h)}
+    try:
+        from mc2acab import MCNP_ACAB_library as MCNPACAB
+    except ImportError as e:
+        print(f'summary_table_gen skipped, MCNP_ACAB_library cannot be imported: {e}')
+    else:
+        totaldata, tally = _summary_data(min(ncells, files['summary_cells']))
+        ops['summary_table_gen'] = lambda: MCNPACAB.summary_table_gen(totaldata, tally)
+    return ops
+
+def measure(func, repeat):
+    ''' Best wall time of repeat runs, and peak traced memory of an extra run (MB)'''
+    best = float('inf')
+    for _ in range(repeat):
+        with redirect_stdout(StringIO()):
+            start = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    with redirect_stdout(StringIO()):
+        func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak/2**20
+
+def make_files(workdir, ncells):
+    ''' Synthetic outp and RES_H of ncells cells in workdir'''
+    nmaterials = max(10, ncells//100)
+    outp = os.path.join(workdir, 'outp')
+    cells, _, _ = synthetic.write_outp(outp, ncells, nmaterials)
+    res_h = os.path.join(workdir, 'RES_H')
+    synthetic.write_res_h(res_h, cells, nisotopes=20)
+    return {'outp': outp, 'res_h': res_h, 'res_h_cells': list(cells), 'last_mat': nmaterials,
+            'summary_cells': ncells, 'outp_mb': os.path.getsize(outp)/2**20}
+
+def main():
+    ''' Run the operations at all sizes, print the table and check the baseline'''
+    opts = {'sizes': '1000,10000,100000', 'repeat': '3', 'baseline': 'bench_parsers_baseline.json',
+            'threshold': '0.25', 'ops': None}
+    record = False
+    for arg in sys.argv[1:]:
+        if arg == '-record':
+            record = True
+        elif arg.startswith('-') and '=' in arg and arg[1:].split('=')[0] in opts:
+            key, value = arg[1:].split('=', 1)
+            opts[key] = value
+        else:
+            print(__doc__)
+            sys.exit(1)
+    sizes = [int(size) for size in opts['sizes'].split(',')]
+    threshold = float(opts['threshold'])
+    results = {}
+    for ncells in sizes:
+        workdir = tempfile.mkdtemp(prefix='mc2acab_micro_')
+        cwd = os.getcwd()
+        try:
+            files = make_files(workdir, ncells)
+            os.chdir(workdir)  # summary_table_gen writes its files in the working folder
+            print(f'{ncells} cells, outp of {files["outp_mb"]:.1f} MB')
+            for name, func in operations(files, ncells).items():
+                if opts['ops'] and name not in opts['ops'].split(','):
+                    continue
+                wall, peak = measure(func, int(opts['repeat']))
+                results.setdefault(name, {})[str(ncells)] = {'time': wall, 'peak_mb': peak}
+                print(f'  {name:<18}{wall:>10.4f} s{peak:>10.1f} MB')
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(workdir)
+    print(f"\n{'operation':<18}" + ''.join(f'{size:>12}' for size in sizes) + f"{'exponent':>10}")
+    for name, data in results.items():
+        times = [data[str(size)]['time'] for size in sizes if str(size) in data]
+        exponent = np.polyfit(np.log(sizes[:len(times)]), np.log(times), 1)[0] if len(times) > 1 else np.nan
+        print(f'{name:<18}' + ''.join(f'{t:>12.4f}' for t in times) + f'{exponent:>10.2f}')
+    if record:
+        with open(opts['baseline'], 'w', encoding='utf-8') as outfile:
+            json.dump(results, outfile, indent=1)
+        print(f"Baseline recorded in {opts['baseline']}")
+        return
+    if not os.path.isfile(opts['baseline']):
+        print(f"No baseline {opts['baseline']}, use -record to create it")
+        return
+    with open(opts['baseline'], 'r', encoding='utf-8') as infile:
+        baseline = json.load(infile)
+    regressions = []
+    for name, data in results.items():
+        for size, result in data.items():
+            reference = baseline.get(name, {}).get(size)
+            if reference and result['time'] > reference['time']*(1 + threshold):
+                regressions.append(f"{name} at {size} cells: {result['time']:.4f} s"
+                                   f" vs {reference['time']:.4f} s baseline")
+    if regressions:
+        print(f'\033[31m Regressions beyond {threshold:.0%}:\033[0m')
+        print('\n'.join(regressions))
+        sys.exit(1)
+    print(f'No regressions beyond {threshold:.0%}')
+
+if __name__ == '__main__':
+    main()
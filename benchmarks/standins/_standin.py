@@ -0,0 +1,41 @@
+''' Common helpers of the COLLAPS, ACAB and htape3x stand-ins.
+    Environment variables:
+        MC2ACAB_STANDIN_COST: seconds spent by acab_2008 per run (default 0.1),
+                              collaps_2008 and htape3x spend a tenth of it
+        MC2ACAB_STANDIN_MODE: sleep (default) or cpu, to burn the time in a busy loop
+        MC2ACAB_STANDIN_NREAC: reactions written by collaps_2008 (default 20000)
+        MC2ACAB_STANDIN_NUCLIDES: nuclides in the fort.6 written by acab_2008
+                                  (default 300 plus 20 per isotope of the material)
+        MC2ACAB_FORT6_TEMPLATE: real ACAB fort.6 copied by acab_2008 instead of the
+                                synthetic one'''
+
+import os
+import sys
+import time
+import hashlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+COST = float(os.environ.get('MC2ACAB_STANDIN_COST', '0.1'))
+MODE = os.environ.get('MC2ACAB_STANDIN_MODE', 'sleep')
+NREAC = int(os.environ.get('MC2ACAB_STANDIN_NREAC', '20000'))
+NNUC = int(os.environ.get('MC2ACAB_STANDIN_NUCLIDES', '0'))
+FORT6_TEMPLATE = os.environ.get('MC2ACAB_FORT6_TEMPLATE', None)
+
+def spend(seconds):
+    "Spend seconds sleeping or burning CPU, as MC2ACAB_STANDIN_MODE says"
+    if MODE == 'cpu':
+        end = time.process_time() + seconds
+        x = 0
+        while time.process_time() < end:
+            x = (x*1103515245 + 12345) % 2147483648
+    else:
+        time.sleep(seconds)
+
+def seed_of(*filenames):
+    "Deterministic seed from the contents of the input files"
+    digest = hashlib.sha256()
+    for filename in filenames:
+        with open(filename, 'rb') as infile:
+            digest.update(infile.read())
+    return int(digest.hexdigest()[:8], 16)
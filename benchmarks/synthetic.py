@@ -0,0 +1,240 @@
+#! /usr/bin/env python
+
+''' Synthetic MCNP outp, histp, htape3x RES_H and ACAB fort.6 files for the MC2ACAB benchmarks.
+    Everything is deterministic for a given seed, so runs are comparable.
+    Usage: python synthetic.py ncells nmaterials [outp] [-seed=n] [-res_h=file]'''
+
+import os
+import sys
+import numpy as np
+
+# 211 group upper boundaries, lethargy spaced like the VITAMIN-J+ range (MeV).
+# Not the real structure, but same number of groups and range for ACAB stand-ins
+ENERGY_BINS = np.geomspace(1.0E-11, 55.0, 212)[1:]
+
+# Elements with natural abundances known by pyhtape3x.nat_abun, plus explicit isotopes
+ELEMENTS = [6000, 12000, 14000, 16000, 20000, 22000, 24000, 26000, 28000, 29000, 30000,
+            40000, 42000, 50000, 74000, 82000]
+ISOTOPES = [1001, 5010, 5011, 7014, 8016, 11023, 13027, 15031, 25055, 27059, 41093, 73181]
+
+VOID_FRACTION = 0.02  # Fraction of void (material 0) cells
+
+# Element symbols by Z, for the nuclide labels of the fort.6
+SYMBOLS = ('H He Li Be B C N O F Ne Na Mg Al Si P S Cl Ar K Ca Sc Ti V Cr Mn Fe Co Ni Cu Zn Ga Ge As Se '
+           'Br Kr Rb Sr Y Zr Nb Mo Tc Ru Rh Pd Ag Cd In Sn Sb Te I Xe Cs Ba La Ce Pr Nd Pm Sm Eu Gd '
+           'Tb Dy Ho Er Tm Yb Lu Hf Ta W Re Os Ir Pt Au Hg Tl Pb Bi').split()
+# Upper bounds (MeV) of the 24 gamma groups of the ACAB inputs
+GAMMA_BOUNDS = [2.0E+01, 1.4E+01, 1.2E+01, 1.0E+01, 8.0E+00, 6.5E+00, 5.0E+00, 4.0E+00, 3.0E+00, 2.5E+00,
+                2.0E+00, 1.7E+00, 1.4E+00, 1.2E+00, 1.0E+00, 8.0E-01, 6.0E-01, 4.0E-01, 3.0E-01, 2.0E-01,
+                1.0E-01, 5.0E-02, 2.0E-02, 1.0E-02, 0.0]
+
+def _input_line(n, text, offset=11):
+    "Echoed input line n as MCNP6 prints it in the outp"
+    return f'{n:>{offset-1}}-       {text}\n'
+
+def material_cards(nmaterials, rng):
+    ''' List of (number, zaids, fracs, density) of nmaterials synthetic materials'''
+    materials = []
+    for i in range(nmaterials):
+        ncomp = rng.integers(2, 12)
+        zaids = list(rng.choice(ELEMENTS + ISOTOPES, size=ncomp, replace=False))
+        fracs = rng.random(ncomp)
+        fracs = list(-fracs/fracs.sum())  # Weight fractions
+        density = -float(rng.uniform(1.0, 11.3))
+        materials.append((i+1, zaids, fracs, density))
+    return materials
+
+def spectra(ncells, rng):
+    ''' (ncells x 211) flux per source particle, with a fission + thermal shape
+    and a magnitude falling over several decades across the cells'''
+    energies = ENERGY_BINS
+    shape = np.exp(-energies/1.3)*np.sqrt(energies) + 0.05*np.exp(-energies/2.5E-8)
+    shape /= shape.sum()
+    magnitude = np.logspace(-3, -9, ncells)
+    noise = rng.uniform(0.8, 1.2, size=(ncells, len(energies)))
+    return magnitude[:, None]*shape[None, :]*noise
+
+def write_outp(filename, ncells, nmaterials, **kwargs):
+    ''' Write an MCNP6-like outp with ncells cells filled with nmaterials materials and an
+    F4 neutron tally over all the cells with the 211 groups. kwargs can be:
+        tally_num: tally number (default 4)
+        seed: random seed (default 0)
+        histp: add a HISTP card for all the cells (default True)
+        ndumps: number of times the tally is printed, as successive dumps (default 1)
+        first_cell: number of the first cell (default 10)'''
+    tally_num = kwargs.get('tally_num', 4)
+    rng = np.random.default_rng(kwargs.get('seed', 0))
+    histp = kwargs.get('histp', True)
+    ndumps = kwargs.get('ndumps', 1)
+    first_cell = kwargs.get('first_cell', 10)
+    cells = np.arange(first_cell, first_cell + ncells)
+    materials = material_cards(nmaterials, rng)
+    cell_mat = rng.integers(0, nmaterials, size=ncells)
+    void = rng.random(ncells) < VOID_FRACTION
+    volumes = rng.uniform(1.0, 1.0E3, size=ncells)
+    flux = spectra(ncells, rng)
+    flux[void] = 0.0
+    errors = np.clip(0.01/np.sqrt(flux/flux.max() + 1E-12), 0, 1)
+    errors[flux == 0] = 0.0
+    nline = 1
+    with open(filename, 'w', encoding='utf-8') as outp:
+        outp.write('          Code Name & Version = MCNP6, 2.0\n')
+        outp.write(_input_line(nline, 'Synthetic MC2ACAB benchmark model'))
+        nline += 1
+        for i, ncell in enumerate(cells):
+            if void[i]:
+                card = f'{ncell} 0 -{i+1} imp:n=1'
+            else:
+                mat = materials[cell_mat[i]]
+                card = f'{ncell} {mat[0]} {mat[3]:.4f} -{i+1} imp:n=1'
+            outp.write(_input_line(nline, card))
+            nline += 1
+        outp.write(_input_line(nline, ''))
+        nline += 1
+        for i in range(ncells):
+            outp.write(_input_line(nline, f'{i+1} so {i+1.0:.1f}'))
+            nline += 1
+        outp.write(_input_line(nline, ''))
+        nline += 1
+        outp.write(_input_line(nline, 'mode n h'))
+        nline += 1
+        for number, zaids, fracs, _ in materials:
+            outp.write(_input_line(nline, f'm{number} {zaids[0]}.70c {fracs[0]:.6e}'))
+            nline += 1
+            for zaid, frac in zip(zaids[1:], fracs[1:]):
+                outp.write(_input_line(nline, f'      {zaid}.70c {frac:.6e}'))
+                nline += 1
+        if histp:
+            outp.write(_input_line(nline, f'histp -100000000 {cells[0]} {ncells-2}i {cells[-1]}'))
+            nline += 1
+        outp.write(_input_line(nline, f'f{tally_num}:n {cells[0]} {ncells-2}i {cells[-1]}'))
+        nline += 1
+        outp.write(_input_line(nline, f'e{tally_num} ' + ' '.join(f'{e:.4e}' for e in ENERGY_BINS[:4])))
+        nline += 1
+        outp.write(_input_line(nline, f'      {len(ENERGY_BINS)-5}ilog {ENERGY_BINS[-1]:.4e}'))
+        nline += 1
+        outp.write(_input_line(nline, 'nps 1000000'))
+        outp.write('\n')
+        for dump in range(ndumps):
+            nps = 1000000*(dump+1)//ndumps
+            outp.write(f'1tally       {tally_num:>2}        nps =     {nps}\n')
+            outp.write('           tally type 4    track length estimate of particle flux.'
+                       '      units   1/cm**2\n')
+            outp.write('           particle(s): neutrons\n\n')
+            outp.write('           volumes\n')
+            for i in range(0, ncells, 6):
+                outp.write('                   cell:  ' +
+                           ''.join(f'{c:>13d}' for c in cells[i:i+6]) + '\n')
+                outp.write('                          ' +
+                           ''.join(f'{v:>13.5E}' for v in volumes[i:i+6]) + '\n')
+            outp.write('\n')
+            for i, ncell in enumerate(cells):
+                outp.write(f' cell  {ncell}\n      energy\n')
+                lines = [f'    {e:.4E}   {f:.5E} {r:.4f}\n'
+                         for e, f, r in zip(ENERGY_BINS, flux[i], errors[i])]
+                outp.write(''.join(lines))
+                total = flux[i].sum()
+                outp.write(f'      total      {total:.5E} {0.001 if total else 0.0:.4f}\n\n')
+            outp.write(f'  dump no.    {dump+1} on file runtpe     nps =     {nps}'
+                       f'     coll =        {nps*100}     ctm =        1.00   nrn =    {nps*300}\n')
+    return cells, volumes, flux
+
+def write_histp(filename='histp'):
+    ''' Placeholder histp file, the htape3x stand-in does not read it'''
+    with open(filename, 'wb') as histp:
+        histp.write(b'\0'*1024)
+
+def res_h_text(cells, nisotopes=150, seed=0):
+    ''' Text of a htape3x RES_H output with the residual nuclei of cells,
+    in the layout read by pyhtape3x.get_atom_feeds'''
+    rng = np.random.default_rng(seed)
+    lines = [' Entrada de residuos para HTAPE3X\n']
+    for ncell in cells:
+        lines.append(f'1 distribution of residual nuclei in cell {ncell:>10}\n\n')
+        nleft = nisotopes
+        z = 1
+        while nleft > 0 and z < 100:
+            niso = int(min(nleft, rng.integers(1, 8)))
+            n0 = int(z*1.2) + 1
+            for j in range(niso):
+                frac = f'{rng.uniform(1.0E-6, 1.0E-3):.4E}'.replace('E', 'D')
+                if j == 0:
+                    lines.append(f'  z = {z:>3}  n = {n0:>3}   {frac}   0.0000D+00\n')
+                else:
+                    lines.append(f'         n = {n0+j:>3}   {frac}   0.0000D+00\n')
+            nleft -= niso
+            z += 1
+        lines.append('  all z   total   1.0000D+00\n\n')
+    lines.append(' metastable state production\n')
+    lines.append('  z    a    l    ttt    e    fraction\n')
+    lines.append('  26   53    1    0.0   3.04   1.0000D-01\n')
+    lines.append('  27   60    1    0.0   0.06   4.0000D-01\n')
+    lines.append(' htape3x run completed\n')
+    return ''.join(lines)
+
+def write_res_h(filename, cells, nisotopes=150, seed=0):
+    ''' Write a RES_H file for cells, see res_h_text'''
+    with open(filename, 'w', encoding='UTF-8') as res_h:
+        res_h.write(res_h_text(cells, nisotopes, seed))
+
+def fort6_text(times, nnuclides=300, seed=0, cooling=None):
+    ''' Text of an ACAB fort.6 with an inventory of nnuclides at every output time (s),
+    with the atoms, moles, activity, decay heat and contact dose of every nuclide and
+    the gamma source by group. The inventory decays with the cooling time of every
+    output (the times themselves if None), so the tables are consistent. The layout is that
+    of the ACAB-2008 output, not checked against apypa'''
+    rng = np.random.default_rng(seed)
+    zs = rng.integers(1, len(SYMBOLS) + 1, nnuclides)
+    names = sorted({f'{SYMBOLS[z-1].upper():<2} {int(2.2*z) + int(a):>3}'
+                    for z, a in zip(zs, rng.integers(0, 9, nnuclides))})
+    atoms0 = rng.lognormal(30, 6, len(names))
+    lam = rng.lognormal(-15, 5, len(names))
+    energy = rng.uniform(0.01, 3.0, len(names))  # MeV per decay
+    emean = 0.5*(np.array(GAMMA_BOUNDS[:-1]) + np.array(GAMMA_BOUNDS[1:]))
+    share = rng.dirichlet(np.ones(len(emean)), len(names))  # Gamma spectrum of each nuclide
+    lines = []
+    for step, (time, cool) in enumerate(zip(times, times if cooling is None else cooling)):
+        atoms = atoms0*np.exp(-lam*cool)
+        activity = atoms*lam
+        heat = activity*energy*1.602E-13
+        dose = heat*1.0E-6
+        lines.append('1\n')
+        lines.append(' ' + '*'*100 + '\n')
+        lines.append(f'   ACAB-2008   TIME STEP {step+1:>4d}   TIME = {time:12.4E} SEC\n')
+        lines.append(' ' + '*'*100 + '\n\n')
+        lines.append('   NUCLIDE      ATOMS         MOLES         ACTIVITY(BQ)  DECAY HEAT(W) CONTACT DOSE(SV/H)\n')
+        lines.extend(f'   {n}   {a:13.5E} {a/6.022E23:13.5E} {b:13.5E} {h:13.5E} {d:13.5E}\n'
+                     for n, a, b, h, d in zip(names, atoms, activity, heat, dose))
+        lines.append(f'   TOTAL    {atoms.sum():13.5E} {atoms.sum()/6.022E23:13.5E} {activity.sum():13.5E}'
+                     f' {heat.sum():13.5E} {dose.sum():13.5E}\n\n')
+        gammas = activity @ share
+        lines.append('   GAMMA SOURCE (PHOTONS/S)\n')
+        lines.append('   GROUP  EMEAN(MEV)    PHOTONS/S\n')
+        lines.extend(f'   {g+1:>5d} {e:11.4E} {p:13.5E}\n' for g, (e, p) in enumerate(zip(emean, gammas)))
+        lines.append(f'   TOTAL             {gammas.sum():13.5E}\n\n')
+    return ''.join(lines)
+
+def write_fort6(filename, times, nnuclides=300, seed=0, cooling=None):
+    ''' Write an ACAB fort.6 file, see fort6_text'''
+    with open(filename, 'w', encoding='UTF-8') as fort6:
+        fort6.write(fort6_text(times, nnuclides, seed, cooling))
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+    seed = 0
+    res_h = None
+    args = []
+    for arg in sys.argv[1:]:
+        if arg.startswith('-seed='):
+            seed = int(arg.split('=')[1])
+        elif arg.startswith('-res_h='):
+            res_h = arg.split('=')[1]
+        else:
+            args.append(arg)
+    outname = args[2] if len(args) > 2 else 'outp'
+    cells0, _, _ = write_outp(outname, int(args[0]), int(args[1]), seed=seed)
+    print(f'{outname}: {len(cells0)} cells, {os.path.getsize(outname)/2**20:.1f} MB')
+    if res_h:
+        write_res_h(res_h, cells0, seed=seed)
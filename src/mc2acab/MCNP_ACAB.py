@@ -8,90 +8,33 @@
 
 import sys
 import os
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
 import MCNP_ACAB_library as MCNPACAB
 import material
-from multiprocessing import Pool
+import multiprocessing
 import cell as cel
-import numpy as np
 import tally as tal
+import MCNP_outparser
+import taskqueue
+import metrics
+import scheduler
+import sharedflux
+import resultcube
+import cycles
+import adaptive
+import bateman
+import response
+import clustering
+import voxel
+import rebin
+import cellcache
+import pruning
+import query
+import waste
+import pipeline
 
-def MCNP_ACAB_Mapstar(n):
-    outputs = MCNPACAB.MCNP_ACAB_Map(tally0 = tally0, mater = mat[n], n_id = n,
-                                     irr_cell = irr_cell[n], irr_time = reqs['-irr_time'],
-                                     irr_type = reqs['-part'], source = reqs['-st'],
-                                     save = options['-save'], esc_file = options['-sce_file'],
-                                     passive_sector = options['-passive_sector'],
-                                     id_lib =options['-nuc_lib'],
-                                     id_ILIB = options['-id_Egroup'],
-                                     corte = options['-apypa_verge'])
-    # Outputs:
-    #     0 Timesets (arrays of times)
-    #     1 Decay= Bq as ACAB
-    #     2 Gamma= PHOTONS/CCM/SEC (as ACAB)
-    #     3 Heat= W/cm3
-    #     4 Dose= mSv/h (ACAB is Sv/h)
-    #     5 mol = mol
-    return outputs
-
-print('''
-      ***************************************************************************
-      *  \033[36m SPALLATION PRODUCT ACTIVATION \033[0m                                        *
-      *  This subroutine reads the outp file generated by MCNPX,                *
-      *  and the spallation products recorded in the histp file.                *
-      *  It generates an input for COLLAPS and then for ACAB, including the     *
-      *  spallation products.                                                   *
-      *  It executes and post-processes the output of ACAB.                     *
-      *  MIGUEL MAGAN ROMERO,Dr. OCTAVIO GONZALEZ                               *
-      * \033[36m Targets and Neutronic Applications Group \033[0m                              *
-      *                                             \033[31m ESS-BILBAO \033[0m                *
-      ***************************************************************************''')
-
-if len(sys.argv) <= 1:
-    print ('MCNP2ACAB Arguments [Opcions]')
-    print ('\033[31m Mandatory: \033[0m')
-    print ('-n    Neutron activation (just n, no histp module required)')
-    print ('-p    Calculo de activacion (Modulos histp y flujo protonico)')
-    print ('-np   Calculo de activacion (Flujo neutronico y modulo histp)')
-    print ('\033[36m Requirements \033[0m')
-    print ('-outpfile=filename outp file name defatult outp')
-    print ('-tally_num = number for specific tallies')
-    print ('-st_units=number Indicates the how indicates source term: 1 particles/s or 2 mA')
-    print ('-source_term=number Indicates source term value ')
-    print ('-irr_time=number Indicates irradiation time in hours ')
-    print ('\033[36m Options \033[0m')
-    print('-normal_flux Use normalized flux with FM card')
-    print('-sce_file=File Use external irradiation scenario file')
-    print('-source Request SDEF file generation')
-    print('-save=[All,True,False] Modify ACAB_writer output files'
-          ' and delete folders after execution')
-    print('-threshold=[0 to 1] Indicates cutoff for Apipa')
-    print('-decay_times=Set decay times list for ACAB (no spaces)')
-    print('-Rotate=n Use cell composition with passive cells'
-          ' terminated in n. Does not work for rotary elements')
-    print ('')
-    sys.exit(1)
-
-# '''Para hacer una ejecucion automatizable'''
-reqs ={
-    '-part': None,
-    '-outpfile': None,
-    '-tally_num': None,
-    '-st_units': None,
-    '-st': None,
-    '-irr_time': None,
-       }
-options = {
-    '-normal_flux': False, # useless??
-    '-save': True,
-    '-sce_file': None,
-    '-apypa_verge' : 0.9,
-    '-decay_times' : None,
-    '-decay_outs' : None,
-    '-sdef' : None,
-    '-passive_sector' : None, # so far useless
-    '-nuc_lib': 'EAF',
-    '-id_Egroup': 'vitJ+',
-}
 def __parse_args(reqs, options, args):
     if os.path.isfile('logfile.txt'):
         with open('logfile.txt',"r", encoding='utf-8') as infile:
@@ -150,11 +93,101 @@ def __parse_args(reqs, options, args):
         elif arg.startswith('-source'):
             options['-sdef'] = True
         elif arg.startswith('-rotate='):
-            options['-passive_sector='] = int(arg.split('=')[1])
+            options['-passive_sector'] = arg.split('=')[1]
         elif arg.startswith('-nuc_lib='):
             options['-nuc_lib'] = arg.split('=')[1]
         elif arg.startswith('-id_Egroup='):
             options['-id_Egroup'] = arg.split('=')[1]
+        elif arg in ['-resume', '--resume']:
+            options['-resume'] = True
+        elif arg == '-plan':
+            options['-plan'] = True
+        elif arg == '-dry_run':
+            options['-dry_run'] = True
+        elif arg.startswith('-nproc='):
+            options['-nproc'] = int(arg.split('=')[1])
+        elif arg.startswith('-start_method='):
+            options['-start_method'] = arg.split('=')[1]
+        elif arg.startswith('-history='):
+            options['-history'] = arg.split('=')[1]
+            while not os.path.exists(options['-history']):
+                options['-history'] = input('Warning!!! No history file!!!'
+                                            f" {options['-history']} is not here"
+                                            '\nEnter history file name: ')
+        elif arg.startswith('-history_error='):
+            options['-history_error'] = float(arg.split('=')[1])
+        elif arg.startswith('-history_halflife='):
+            options['-history_halflife'] = float(arg.split('=')[1])
+        elif arg == '-adaptive':
+            options['-resolution'] = options['-resolution'] or adaptive.DEFAULT_RESOLUTION
+        elif arg.startswith('-resolution='):
+            options['-resolution'] = float(arg.split('=')[1])
+        elif arg.startswith('-adaptive_check='):
+            options['-adaptive_check'] = int(arg.split('=')[1])
+        elif arg.startswith('-adaptive_tol='):
+            options['-adaptive_tol'] = float(arg.split('=')[1])
+        elif arg == '-decks_only':
+            options['-decks_only'] = True
+        elif arg.startswith('-collapse='):
+            options['-collapse'] = arg.split('=')[1]
+        elif arg.startswith('-collapse_check='):
+            options['-collapse_check'] = int(arg.split('=')[1])
+        elif arg.startswith('-collapse_tol='):
+            options['-collapse_tol'] = float(arg.split('=')[1])
+        elif arg == '-response':
+            options['-response'] = True
+        elif arg == '-cluster':
+            options['-cluster'] = True
+        elif arg.startswith('-cluster_tol='):
+            options['-cluster_tol'] = float(arg.split('=')[1])
+        elif arg.startswith('-cluster_check='):
+            options['-cluster_check'] = int(arg.split('=')[1])
+        elif arg == '-screen':
+            options['-screen'] = True
+        elif arg.startswith('-screen_activity='):
+            options['-screen_activity'] = float(arg.split('=')[1])
+        elif arg.startswith('-screen_heat='):
+            options['-screen_heat'] = float(arg.split('=')[1])
+        elif arg.startswith('-screen_gamma='):
+            options['-screen_gamma'] = float(arg.split('=')[1])
+        elif arg.startswith('-screen_margin='):
+            options['-screen_margin'] = float(arg.split('=')[1])
+        elif arg.startswith('-screen_halflife='):
+            options['-screen_halflife'] = float(arg.split('=')[1])
+        elif arg == '-cube':
+            options['-cube'] = True
+        elif arg.startswith('-cube_slots='):
+            options['-cube_slots'] = int(arg.split('=')[1])
+        elif arg.startswith('-cube_times='):
+            options['-cube_times'] = int(arg.split('=')[1])
+        elif arg.startswith('-rebin='):
+            options['-rebin'] = arg.split('=')[1]
+        elif arg.startswith('-group_bounds='):
+            options['-group_bounds'] = arg.split('=')[1]
+        elif arg == '-cache':
+            options['-cache'] = cellcache.DEFAULT_DIR
+        elif arg.startswith('-cache='):
+            options['-cache'] = os.path.abspath(arg.split('=')[1])
+        elif arg.startswith('-cache_size='):
+            options['-cache_size'] = float(arg.split('=')[1])
+        elif arg.startswith('-prune='):
+            options['-prune'] = float(arg.split('=')[1])
+        elif arg.startswith('-prune_check='):
+            options['-prune_check'] = int(arg.split('=')[1])
+        elif arg.startswith('-prune_tol='):
+            options['-prune_tol'] = float(arg.split('=')[1])
+        elif arg.startswith('-meshtal='):
+            options['-meshtal'] = arg.split('=')[1]
+        elif arg.startswith('-voxel_mat='):
+            options['-voxel_mat'] = arg.split('=')[1]
+        elif arg.startswith('-waste_limits='):
+            options['-waste_limits'] = arg.split('=')[1]
+        elif arg == '-pipeline':
+            options['-pipeline'] = ''
+        elif arg.startswith('-pipeline='):
+            options['-pipeline'] = arg.split('=')[1]
+        elif arg.startswith('-pipeline_depth='):
+            options['-pipeline_depth'] = int(arg.split('=')[1])
     # print(reqs)
     # print(options)
     while reqs['-part'] not in ['n','np','p']:
@@ -172,65 +205,497 @@ def __parse_args(reqs, options, args):
     if options['-sce_file']:
         print('There are a neutron activacion scenario, irradiation_time not required, just enter 1')
         reqs['-irr_time'] = 1
+    elif options['-history']:
+        print('There are an operating history, irradiation_time taken from it')
+        reqs['-irr_time'] = sum(phase[0] for phase in cycles.read_history(options['-history']))
     if None in reqs.values():
         raise ValueError('Warning!!! input incomplete, further information required:')
-    if not options['-sce_file'] and options['-decay_times']:
+    if options['-plan'] and (options['-cluster'] or options['-cube'] or options['-decks_only']
+                             or options['-meshtal'] is not None):
+        print('\033[31m -plan does not work with -cluster, -cube, -meshtal or -decks_only \033[0m')
+        sys.exit(1)
+    if options['-meshtal'] is not None and (options['-voxel_mat'] is None or 'p' in reqs['-part']):
+        print('\033[31m -meshtal needs -voxel_mat and only works with -n \033[0m')
+        sys.exit(1)
+    if options['-response']:
+        if options['-sce_file'] or options['-history']:
+            raise ValueError('-response needs a single irradiation, without -sce_file or -history')
+        options['-decay_times'] = list(response.RESPONSE_TIMES)
+        options['-decay_outs'] = [1]*(len(response.RESPONSE_TIMES) + 1)
+    if not options['-sce_file'] and not options['-history'] and options['-decay_times']:
         print('Generating automatic scenario file')
-        MCNPACAB.Escenary_generator(reqs['-irr_time'], options['-decay_times'],
-                                    options['-decay_outs'], Sce_name ='Auto_Sce_file')
+        MCNPACAB.scenary_generator(reqs['-irr_time'], options['-decay_times'],
+                                   options['-decay_outs'], Sce_name ='Auto_Sce_file')
         options['-sce_file'] = 'Auto_Sce_file'
     return reqs, options
 
-try:
-    reqs, options = __parse_args(reqs, options, sys.argv[1:])
-    print(f'source_term = {reqs["-st"]:.3e} n/s')
-    input_complete = True
-    tally0 = tal.oget(reqs['-outpfile'],reqs['-tally_num'])
-except Exception as e:
-    print(e)
-    tally0, reqs['-irr_time'], reqs['-st'], options['-nuc_lib'], options['-id_Egroup'] = MCNPACAB.get_user_input(reqs['-outpfile'])
-
-#TODO
-# tally = MCNPACAB.tally_compose(tally0, Passive_sector)
-# cmatrix = MCNPACAB.comp_matrix(tally0, Passive_sector)
-if MCNPACAB.check_utility('summary_apypas.npy'):
-    MCNPACAB.backup_previous('logfile.txt')
-    ncel = [int(cell0) for cell0 in (tally0.cells)]
-    print('Obtained cell numbers')
-    vol0 = tally0.mass
-    irr_cell = [cel.oget(reqs['-outpfile'],ncell_i) for ncell_i in ncel]
-    print('Obtained cell properties')
-    # Because there can be quite a lot of cells with the same material, it is interesting to cache them
-    mat = []
-    matnumbers = np.zeros(0)
-    for ncell0 in irr_cell:
-        try:
-            Mindex = list(matnumbers).index(ncell0.mat)
-            mat0 = material.mat(mat[Mindex].number)
-            mat0.N = list(mat[Mindex].N)
-            mat0.M = list(mat[Mindex].M)
-            mat.append(mat0)
-        except:
-            mat.append(material.oget(reqs['-outpfile'],ncell0.mat))
-            matnumbers=np.append(matnumbers,mat[-1].number)
-    print('Obtained materials')
-    with open('logfile.txt','w', encoding='utf-8') as logfile:
-        logfile.write(' '.join([f'{str(item)}:{reqs[item]}' for item in reqs]))
-        logfile.write(f" -sce_file:{options['-sce_file']}")
-        logfile.write('\n')
-        logfile.close()
-    with Pool() as pool:
-        totaldata = pool.map(MCNP_ACAB_Mapstar, range(tally0.ncells))
-    if not options['-decay_times']:
-        t_times = list(totaldata[0][0].index)
+
+def __deck_run(n, resolution, tally0, mat, irr_cell, reqs, options):
+    ''' Outputs of the n-th cell with the decks of resolution (None for the fixed decks),
+    run in its own folder, which is removed afterwards'''
+    mater = material.Mat(mat[n].number)
+    mater.zaid, mater.frac = list(mat[n].zaid), list(mat[n].frac)
+    kwargs = MCNPACAB.map_kwargs(reqs, dict(options, **{'-resolution': resolution}))
+    kwargs.update(save=False, metrics_dir=None, decks_only=False,
+                  wdir_suffix=f"_deck_{'ref' if resolution is None else f'{resolution:.0e}'}")
+    return MCNPACAB.MCNP_ACAB_Map(tally0=tally0, mater=mater, n_id=n, irr_cell=irr_cell[n], **kwargs)
+
+def __prune_run(n, pruned, tally0, mat, irr_cell, reqs, options):
+    ''' Outputs of the n-th cell pruned as -prune or not, run in its own folder, which
+    is removed afterwards'''
+    mater = material.Mat(mat[n].number)
+    mater.zaid, mater.frac = list(mat[n].zaid), list(mat[n].frac)
+    kwargs = MCNPACAB.map_kwargs(reqs, dict(options, **{'-prune': options['-prune'] if pruned else None,
+                                                        '-cache': None}))
+    kwargs.update(save=False, metrics_dir=None, decks_only=False,
+                  wdir_suffix=f"_{'pruned' if pruned else 'unpruned'}")
+    return MCNPACAB.MCNP_ACAB_Map(tally0=tally0, mater=mater, n_id=n, irr_cell=irr_cell[n], **kwargs)
+
+def __recover(pending, totaldata, cube, irr_cell, campaign, resume):
+    ''' Cells of pending still to run, in order. With resume, the cells done in the cube or
+    journaled under the campaign key are left out, their journaled outputs go to totaldata'''
+    remaining = []
+    for n in pending:
+        if resume and cube is not None:
+            if cube.status[n] != resultcube.PENDING:
+                continue
+        elif resume:
+            journaled, totaldata[n] = MCNPACAB.journal_read('journal', irr_cell[n].ncell, campaign)
+            if journaled:
+                continue
+        remaining.append(n)
+    print(f'{len(pending) - len(remaining)} cells recovered from journal, {len(remaining)} to go')
+    return remaining
+
+def __screen(pending, tally0, mat, irr_cell, reqs, options):
+    ''' Split pending in the cells over the -screen thresholds, kept in order, and those
+    under them. The estimates of all the cells are written in screening.csv'''
+    thresholds = [options['-screen_activity'], options['-screen_heat'], options['-screen_gamma']]
+    if all(threshold is None for threshold in thresholds):
+        print('No -screen_activity, -screen_heat or -screen_gamma given, all the cells go to ACAB')
+        return pending, []
+    if 'p' in reqs['-part']:
+        print('The screening does not include the isotopical feeds, all the cells go to ACAB')
+        return pending, []
+    if options['-history']:
+        phases = cycles.compress_history(cycles.read_history(options['-history']),
+                                         options['-history_error'], options['-history_halflife'])[0]
+        phases = [phase[:2] for phase in phases]
     else:
-        o_times = [1.0]
-        for time in options['-decay_times']:
-            if time in list(totaldata[0][0].index) and time not in o_times:
-                o_times.append(time)
-        t_times = o_times
-    MCNPACAB.summary_table_gen(totaldata, tally0, t_times=t_times)
+        phases = [(reqs['-irr_time'], 1.0)]
+    cooling_times = options['-decay_times'] or list(MCNPACAB.AUTO_COOLING_TIMES)
+    if options['-sce_file']:
+        print(f"Screening with the irradiation time and default cooling times, not {options['-sce_file']}")
+    inventories = [bateman.cell_inventory(mat[n], irr_cell[n].density) for n in pending]
+    estimates = MCNPACAB.screen_cells(tally0.value[pending, 0, 0, 0, :], reqs['-st'], reqs['-part'],
+                                      inventories, phases, cooling_times,
+                                      min_half_life=options['-screen_halflife'])
+    over = np.zeros(len(pending), dtype=bool)
+    for threshold, estimate in zip(thresholds, estimates):
+        if threshold is not None:
+            over |= estimate.max(axis=1)*options['-screen_margin'] >= threshold
+    pd.DataFrame({'cell': [irr_cell[n].ncell for n in pending],
+                  'activity': estimates[0].max(axis=1), 'heat': estimates[1].max(axis=1),
+                  'gamma': estimates[2].max(axis=1), 'acab': over}).to_csv('screening.csv', index=False)
+    print(f'Screening: {over.sum()} of {len(pending)} cells over the thresholds go to ACAB,'
+          ' see screening.csv')
+    return ([n for n, flag in zip(pending, over) if flag],
+            [n for n, flag in zip(pending, over) if not flag])
+
+def __cluster(pending, tally0, mat, irr_cell, options):
+    ''' Split pending in the cells to run, kept in order, the members mapped from their
+    representative and the members also run to check the mapping, both {member: representative}'''
+    decay = bateman.read_decay(os.environ['ACAB_LB_PATH'] + 'DECAY.dat')
+    inventories = [{} if mat[n] is None else bateman.cell_inventory(mat[n], irr_cell[n].density) for n in pending]
+    # Radioactive materials are run one by one, their own activity does not scale
+    keys = [None if bateman.radioactive(inventory, decay) else (irr_cell[n].mat, irr_cell[n].density)
+            for n, inventory in zip(pending, inventories)]
+    leader, distance = clustering.cluster(tally0.value[pending, 0, 0, 0, :], keys, options['-cluster_tol'])
+    sampled = set(clustering.sample(leader, distance, options['-cluster_check']))
+    members, check = {}, {}
+    for i, n in enumerate(pending):
+        if leader[i] != i:
+            (check if i in sampled else members)[n] = pending[leader[i]]
+    print(f'{len(pending)} cells in {int(np.sum(leader == np.arange(len(pending))))} clusters,'
+          f' {len(check)} members run to check the mapping')
+    return [n for n in pending if n not in members], members, check
+
+def __map_members(members, check, totaldata, cube, tally0, mat, irr_cell, campaign):
+    ''' Scale the results of the representatives to their members, and report the error
+    on the checked ones'''
+    def mapped(member, leader):
+        outputs = totaldata[leader] if cube is None else cube.cell_tables(leader)
+        if outputs is None:
+            return None
+        factor = tally0.value[member, 0, 0, 0, -1]/tally0.value[leader, 0, 0, 0, -1]
+        inventory = bateman.cell_inventory(mat[leader], irr_cell[leader].density)
+        initial = clustering.initial_mol(outputs[4].columns, inventory, float(tally0.mass[leader, 0]))
+        return clustering.scale_outputs(outputs, factor, tally0.mass[member, 0]/tally0.mass[leader, 0], initial)
+    for member, leader in members.items():
+        outputs = mapped(member, leader)
+        if cube is not None:
+            cube.write_cell(member, outputs)
+        else:
+            totaldata[member] = outputs
+            MCNPACAB.journal_write('journal', irr_cell[member].ncell, campaign, outputs)
+    exact = {irr_cell[n].ncell: totaldata[n] if cube is None else cube.cell_tables(n) for n in check}
+    print(clustering.report({irr_cell[n].ncell: mapped(n, leader) for n, leader in check.items()}, exact))
+
+def main():
+    ''' Run a MCNP_ACAB campaign as given by the command line'''
+    print('''
+      ***************************************************************************
+      *  \033[36m SPALLATION PRODUCT ACTIVATION \033[0m                                        *
+      *  This subroutine reads the outp file generated by MCNPX,                *
+      *  and the spallation products recorded in the histp file.                *
+      *  It generates an input for COLLAPS and then for ACAB, including the     *
+      *  spallation products.                                                   *
+      *  It executes and post-processes the output of ACAB.                     *
+      *  MIGUEL MAGAN ROMERO,Dr. OCTAVIO GONZALEZ                               *
+      * \033[36m Targets and Neutronic Applications Group \033[0m                              *
+      *                                             \033[31m ESS-BILBAO \033[0m                *
+      ***************************************************************************''')
+
+    if len(sys.argv) <= 1:
+        print ('MCNP2ACAB Arguments [Opcions]')
+        print ('\033[31m Mandatory: \033[0m')
+        print ('-n    Neutron activation (just n, no histp module required)')
+        print ('-p    Calculo de activacion (Modulos histp y flujo protonico)')
+        print ('-np   Calculo de activacion (Flujo neutronico y modulo histp)')
+        print ('\033[36m Requirements \033[0m')
+        print ('-outpfile=filename outp file name defatult outp')
+        print ('-tally_num = number for specific tallies')
+        print ('-st_units=number Indicates the how indicates source term: 1 particles/s or 2 mA')
+        print ('-source_term=number Indicates source term value ')
+        print ('-irr_time=number Indicates irradiation time in hours ')
+        print ('\033[36m Options \033[0m')
+        print('-normal_flux Use normalized flux with FM card')
+        print('-sce_file=File Use external irradiation scenario file')
+        print('-source Request SDEF file generation')
+        print('-save=[All,True,False] Modify ACAB_writer output files'
+              ' and delete folders after execution')
+        print('-threshold=[0 to 1] Indicates cutoff for Apipa')
+        print('-decay_times=Set decay times list for ACAB (no spaces)')
+        print('-rotate=n Rotating element: cells ending in n are the passive sector, averaged in time'
+              ' with the active cells of the same number before that ending')
+        print('-resume Skip the cells already journaled by a previous run with the same inputs')
+        print('-nproc=n Number of worker processes (default: all the cores)')
+        print('-dry_run Print the predicted makespan and disk usage and stop')
+        print('-start_method=[fork,spawn,forkserver] Start method of the worker processes')
+        print('-history=File Operating history (duration power [output] per line) with many beam cycles')
+        print('-history_error=x Relative error allowed merging history cycles (default 0.01)')
+        print('-history_halflife=s Shortest half-life the merging error is checked for (default 60 s)')
+        print('-adaptive Choose the ACAB sub-steps and ITMAX from the output times and flux')
+        print('-resolution=s Time resolution of the adaptive sub-steps (default 1000 s)')
+        print('-adaptive_check=n Compare the adaptive decks with the fixed ones on the n longest cells'
+              ' and use the fastest within -adaptive_tol')
+        print('-adaptive_tol=x Relative tolerance of -adaptive_check (default 0.02)')
+        print('-decks_only Write COLL.inp and inp.5 of every cell for auditing, run neither COLLAPS nor ACAB')
+        print('-collapse=[collaps,numpy] Group collapse by COLLAPS (default) or by NumPy from a COLLAPS template')
+        print('-collapse_check=n Cells validated against COLLAPS before using the NumPy collapse (default 2)')
+        print('-collapse_tol=x Largest relative difference accepted by -collapse_check (default 1e-3)')
+        print('-response Output on a dense cooling grid, to derive other source terms and irradiation'
+              ' times with mc2acab-response')
+        print('-cluster Run ACAB once per cluster of cells of the same material, density and spectrum,'
+              ' scaling its results to the others. Materials radioactive at start are not clustered')
+        print('-cluster_tol=x L1 distance between normalized spectra of a cluster (default 0.05)')
+        print('-cluster_check=n Members also run exactly to report the clustering error (default 5)')
+        print('-screen Estimate every cell with a Bateman solver and run ACAB only for those over a threshold')
+        print('-screen_activity=x Activity threshold of -screen (Bq/cm3)')
+        print('-screen_heat=x Decay heat threshold of -screen (W/cm3)')
+        print('-screen_gamma=x Gamma power threshold of -screen (W/cm3), a proxy of the dose')
+        print('-screen_margin=x Cells within this factor of a threshold go to ACAB too (default 10)')
+        print('-screen_halflife=s Shorter lived nuclides are in quasi steady state in -screen (default 3600)')
+        print('-cube Workers write the results in the memory-mapped cube/ instead of returning them')
+        print('-cube_slots=n Nuclides kept per cell and quantity in the cube (default 256)')
+        print('-cube_times=n Maximum number of output times in the cube (default 64)')
+        print('-rebin=[lethargy,flat] Weighting of the rebinning of tallies not in VITAMIN-J+ groups'
+              ' (default lethargy)')
+        print('-group_bounds=File VITAMIN-J+ boundaries in MeV, if they are not in the group cross sections')
+        print(f'-cache[=Folder] Take the cells with the same ACAB inputs as a previous run from a result'
+              f' store (default {cellcache.DEFAULT_DIR})')
+        print(f'-cache_size=GB Least recently used results are evicted beyond it (default {cellcache.DEFAULT_SIZE})')
+        print('-prune=x Drop the initial nuclides under this share of the activation potential of the cell'
+              ' (removed ones in pruned.txt)')
+        print('-prune_check=n Compare pruned and unpruned runs of the n longest cells first')
+        print('-prune_tol=x Largest deviation of -prune_check, pruning is disabled beyond it (default 0.01)')
+        print('-meshtal=File Activate the voxels of the FMESH -tally_num of this meshtal, implies -cube')
+        print('-voxel_mat=File Materials of the voxels, i j k mat density fraction [...] per line'
+              ' (materials from -outpfile)')
+        print('-waste_limits=File Nuclide and limits (Bq/g) of every waste class per line, index sums'
+              ' and classes of the cells in summary_waste.csv')
+        print('-pipeline[=p,e,s] Run the cells through prepare, execute (COLLAPS and ACAB) and parse stages'
+              ' with p, e and s workers (default: an eighth of -nproc, the rest and an eighth)')
+        print('-pipeline_depth=n Cells waiting between stages of -pipeline (default: the execute workers)')
+        print('-plan Write one task per cell in queue/ for mc2acab-worker and stop')
+        print('-gather Build the summary from the tasks finished in queue/')
+        print ('')
+        sys.exit(1)
+
+    # '''Para hacer una ejecucion automatizable'''
+    reqs ={
+        '-part': None,
+        '-outpfile': None,
+        '-tally_num': None,
+        '-st_units': None,
+        '-st': None,
+        '-irr_time': None,
+           }
+    options = {
+        '-normal_flux': False, # useless??
+        '-save': True,
+        '-sce_file': None,
+        '-apypa_verge' : 0.9,
+        '-decay_times' : None,
+        '-decay_outs' : None,
+        '-sdef' : None,
+        '-passive_sector' : None,
+        '-compose': None,
+        '-nuc_lib': 'EAF',
+        '-id_Egroup': 'vitJ+',
+        '-resume': False,
+        '-plan': False,
+        '-nproc': None,
+        '-dry_run': False,
+        '-start_method': None,
+        '-history': None,
+        '-history_error': 0.01,
+        '-history_halflife': 60.0,
+        '-resolution': None,
+        '-adaptive_check': 0,
+        '-adaptive_tol': 0.02,
+        '-decks_only': False,
+        '-collapse': 'collaps',
+        '-collapse_check': 2,
+        '-collapse_tol': 1E-3,
+        '-collapse_templates': None,
+        '-response': False,
+        '-cluster': False,
+        '-cluster_tol': 0.05,
+        '-cluster_check': 5,
+        '-screen': False,
+        '-screen_activity': None,
+        '-screen_heat': None,
+        '-screen_gamma': None,
+        '-screen_margin': 10.0,
+        '-screen_halflife': bateman.MIN_HALF_LIFE,
+        '-cube': False,
+        '-cube_slots': 256,
+        '-cube_times': 64,
+        '-rebin': 'lethargy',
+        '-group_bounds': None,
+        '-rebinned': False,
+        '-cache': None,
+        '-cache_size': cellcache.DEFAULT_SIZE,
+        '-prune': None,
+        '-prune_check': 0,
+        '-prune_tol': 0.01,
+        '-meshtal': None,
+        '-voxel_mat': None,
+        '-waste_limits': None,
+        '-pipeline': None,
+        '-pipeline_depth': None,
+    }
+    if '-gather' in sys.argv[1:]:
+        campaign, totaldata = taskqueue.gather('queue')
+        print(f"{metrics.merge('metrics', 'metrics.jsonl')} cell metrics added to metrics.jsonl")
+        t_times = MCNPACAB.summary_times(totaldata, campaign['options']['-decay_times'])
+        tally0 = SimpleNamespace(cells=campaign['cells'], mass=campaign['mass'])
+        MCNPACAB.summary_table_gen(totaldata, tally0, t_times=t_times)
+        if campaign['options']['-sdef'] == True:
+            MCNPACAB.apypa2sdef()
+        sys.exit(0)
+
+    try:
+        reqs, options = __parse_args(reqs, options, sys.argv[1:])
+        print(f'source_term = {reqs["-st"]:.3e} n/s')
+        input_complete = True
+        if options['-meshtal'] is None:
+            try:
+                tally0 = MCNP_outparser.f4_tally(reqs['-outpfile'], reqs['-tally_num'])
+            except ValueError as e:  # Tallies with other layouts
+                print(f'{e}, reading it with the tally module')
+                tally0 = tal.oget(reqs['-outpfile'],reqs['-tally_num'])
+    except Exception as e:
+        print(e)
+        tally0, reqs['-irr_time'], reqs['-st'], options['-nuc_lib'], options['-id_Egroup'] = MCNPACAB.get_user_input(reqs['-outpfile'])
+    if options['-meshtal'] is not None:  # Validated in __parse_args, errors of the mesh stop the run
+        options['-cube'] = True  # The results are mesh-shaped from the cube
+        tally0, voxel_cells, voxel_mat = voxel.voxel_campaign(
+            options['-meshtal'], reqs['-tally_num'], options['-voxel_mat'], reqs['-outpfile'])
+
+    try:  # Any group structure, ACAB only takes VITAMIN-J+
+        options['-rebinned'] = rebin.rebin_tally(tally0, MCNPACAB.gxs_file(reqs['-part']),
+                                                 options['-rebin'], options['-group_bounds'])
+        options['-id_Egroup'] = 'vitJ+'
+    except (ValueError, OSError, KeyError, TypeError) as e:
+        print(f'\033[31m Tally not rebinned: {e} \033[0m')
+    if options['-passive_sector'] is not None:  # One time-averaged case per rotating group
+        tally0, options['-compose'] = MCNPACAB.tally_compose(
+            tally0, options['-passive_sector'], reqs['-outpfile'] if options['-meshtal'] is None else None)
+    if options['-resume'] or options['-dry_run'] or MCNPACAB.check_utility('summary_apypas.npy'):
+        if not options['-resume'] and not options['-dry_run']:
+            MCNPACAB.backup_previous('logfile.txt')
+            MCNPACAB.backup_previous('journal')
+        ncel = [int(cell0) for cell0 in (tally0.cells)]
+        print('Obtained cell numbers')
+        vol0 = tally0.mass
+        if options['-meshtal'] is not None:  # Voxels and their materials come with the mesh
+            irr_cell, mat = voxel_cells, voxel_mat
+        else:
+            irr_cell = [cel.oget(reqs['-outpfile'],ncell_i) for ncell_i in ncel]
+            print('Obtained cell properties')
+            # Because there can be quite a lot of cells with the same material, it is interesting to cache them
+            mat = []
+            mat_cache = {}
+            for ncell0 in irr_cell:
+                if ncell0.mat not in mat_cache:
+                    mat_cache[ncell0.mat] = material.oget(reqs['-outpfile'],ncell0.mat)
+                mat0 = mat_cache[ncell0.mat]
+                if mat0 is not None:
+                    mat0, zaid0, frac0 = material.Mat(mat0.number), mat0.zaid, mat0.frac
+                    mat0.zaid, mat0.frac = list(zaid0), list(frac0)
+                mat.append(mat0)
+        print('Obtained materials')
+        totaldata = [None] * tally0.ncells
+        # Longest cells first, and no worker wasted in cells without material or flux
+        history = scheduler.load_history('metrics.jsonl')
+        features = scheduler.cell_features(tally0, mat, irr_cell, reqs['-st'], reqs['-part'],
+                                           reqs['-outpfile'], history)
+        costs = scheduler.predict_costs(features, ncel, scheduler.fit_cost_model(history), history)
+        pending, skipped = scheduler.schedule(list(range(tally0.ncells)), costs, features)
+        if options['-dry_run']:  # Nothing is checked, the cells recovered are those of the options as given
+            campaign = MCNPACAB.campaign_key(reqs, options)
+            cube = resultcube.open_cube('cube', campaign) if options['-cube'] and options['-resume'] else None
+            pending = __recover(pending, totaldata, cube, irr_cell, campaign, options['-resume'])
+            print(scheduler.dry_run_report(pending, skipped, costs, ncel,
+                                           options['-nproc'] or os.cpu_count(), history))
+            sys.exit(0)
+        options['-max_flux'] = float(max(tally0.value[:, 0, 0, 0, -1]))*reqs['-st']
+        if options['-screen'] and not options['-decks_only'] and pending:
+            pending, screened = __screen(pending, tally0, mat, irr_cell, reqs, options)
+            skipped += screened
+        members, check = {}, {}
+        if options['-cluster'] and not options['-decks_only'] and pending:
+            pending, members, check = __cluster(pending, tally0, mat, irr_cell, options)
+        if options['-decks_only']:
+            skipped = []  # Nothing is journaled, the decks are not results
+        if not os.path.isfile('logfile.txt'):
+            with open('logfile.txt','w', encoding='utf-8') as logfile:
+                logfile.write(' '.join([f'{str(item)}:{reqs[item]}' for item in reqs]))
+                logfile.write(f" -sce_file:{options['-sce_file']}")
+                logfile.write('\n')
+                logfile.close()
+        # The checks run on the longest cells, the benchmark, and may change the decks
+        if options['-adaptive_check'] and not options['-decks_only']:
+            options['-resolution'], report = adaptive.select_resolution(
+                lambda n, resolution: __deck_run(n, resolution, tally0, mat, irr_cell, reqs, options),
+                pending[:options['-adaptive_check']], options['-adaptive_tol'])
+            print(report)
+        if options['-prune'] is not None and options['-prune_check'] and not options['-decks_only']:
+            # As -adaptive_check, the longest cells are the sample
+            passed, report = pruning.verify(
+                lambda n, pruned: __prune_run(n, pruned, tally0, mat, irr_cell, reqs, options),
+                pending[:options['-prune_check']], options['-prune_tol'])
+            print(report)
+            if not passed:
+                options['-prune'] = None
+        if options['-collapse'] == 'numpy' and not options['-decks_only'] and pending:
+            # One COLLAPS run gives the template of its outputs, NumPy writes them for the rest
+            options['-collapse_templates'] = MCNPACAB.native_collapse(
+                tally0.value[:, 0, 0, 0, :], reqs['-st'], reqs['-part'], pending,
+                check=options['-collapse_check'], tol=options['-collapse_tol'],
+                id_lib=options['-nuc_lib'], id_ilib=options['-id_Egroup'])
+        # The decks, pruning and collapse are settled, the key tags the journal and the cube
+        campaign = MCNPACAB.campaign_key(reqs, options)
+        if options['-plan']:  # With the decks, pruning and collapse checked here
+            taskqueue.plan('queue', tally0, mat, irr_cell, reqs, options, campaign, pending, skipped)
+            print('Run mc2acab-worker queue on as many nodes as wanted, then MCNP_ACAB.py -gather')
+            sys.exit(0)
+        cube = resultcube.open_cube('cube', campaign) if options['-cube'] and options['-resume'] else None
+        pending = __recover(pending, totaldata, cube, irr_cell, campaign, options['-resume'])
+        if options['-cube'] and cube is None and not options['-decks_only']:
+            MCNPACAB.backup_previous('cube')
+            cube = resultcube.create('cube', campaign, tally0, irr_cell,
+                                     options['-cube_slots'], options['-cube_times'])
+        for n in skipped:
+            if cube is not None:
+                cube.write_cell(n, None)
+            else:
+                MCNPACAB.journal_write('journal', irr_cell[n].ncell, campaign, None)
+        failed = []
+        # Workers only get the cell index, spectra and materials are read from shared memory
+        layout, blocks = sharedflux.share_campaign(tally0, mat, irr_cell)
+        map_kwargs = dict(MCNPACAB.map_kwargs(reqs, options), ebins=tally0.ebins)
+        context = multiprocessing.get_context(options['-start_method'])
+        init_args = (layout, map_kwargs, campaign, 'journal', 'cube' if cube is not None else None)
+        staged = options['-pipeline'] is not None
+        try:
+            with (pipeline.Pipeline(pipeline.stage_workers(options['-pipeline'], options['-nproc']),
+                                    options['-pipeline_depth'], context, init_args) if staged
+                  else context.Pool(options['-nproc'], initializer=sharedflux.init_worker,
+                                    initargs=init_args)) as pool:
+                cells = (pool.run(pending) if staged
+                         else pool.imap_unordered(sharedflux.run_cell, pending, chunksize=1))
+                # Cells are collected as they finish, each one already journaled by its worker
+                for n, outputs, done in cells:
+                    totaldata[n] = outputs
+                    if not done:
+                        failed.append(irr_cell[n].ncell)
+                if staged:
+                    print(pool.report())
+        finally:
+            sharedflux.release(blocks)
+        if options['-decks_only']:
+            print(f'Decks of {len(pending) - len(failed)} cells written in their folders')
+            sys.exit(1 if failed else 0)
+        print(f"{metrics.merge('metrics', 'metrics.jsonl')} cell metrics added to metrics.jsonl,"
+              " see them with mc2acab-stats")
+        if options['-cache'] is not None:
+            removed, size = cellcache.evict(options['-cache'], options['-cache_size'])
+            print(f"Result cache {options['-cache']}: {size/2**30:.2f} GB, {removed} entries evicted")
+        if failed:
+            print(f'\033[31m Cells {failed} failed. Fix them and use -resume to complete the run \033[0m')
+            sys.exit(1)
+        if members or check:
+            __map_members(members, check, totaldata, cube, tally0, mat, irr_cell, campaign)
+        if cube is not None:
+            first = cube.first_done()
+            t_times = 'All' if first is None else MCNPACAB.select_times(cube.cell_times(first),
+                                                                          options['-decay_times'])
+            MCNPACAB.summary_table_cube(cube, t_times=t_times)
+            if cube.mesh is not None:
+                print(f'Mesh-shaped totals written in {cube.write_mesh("mesh_results")}/')
+            if options['-sdef'] == True:
+                print('-source needs summary_apypas.npy, which is not written with -cube')
+                options['-sdef'] = False
+        else:
+            t_times = MCNPACAB.summary_times(totaldata, options['-decay_times'])
+            apypas = MCNPACAB.summary_table_gen(totaldata, tally0, t_times=t_times)
+        if options['-waste_limits'] is not None:
+            if cube is not None:
+                results, done = query.Campaign.from_cube(cube), cube.status == resultcube.DONE
+            else:
+                results = query.Campaign.from_apypas(apypas, [float(cell.density) for cell in irr_cell],
+                                                     [int(cell.mat) for cell in irr_cell])
+                done = [data is not None for data in totaldata]
+            try:
+                masses = [waste.mass_density(mat[n], irr_cell[n].density)*float(tally0.mass[n, 0])
+                          for n in range(tally0.ncells)]
+                waste.classify(results, masses, options['-waste_limits'], t_times, done)
+                print('Waste index sums and classes written in summary_waste.csv')
+            except ValueError as e:
+                print(f'\033[31m Cells not classified: {e} \033[0m')
+        if options['-response']:
+            inventories = [bateman.cell_inventory(mat[n], irr_cell[n].density) if mat[n] is not None
+                           else {} for n in range(tally0.ncells)]
+            removal, radioactive = response.burnup_rates(tally0.value[:, 0, 0, 0, :], reqs['-st'],
+                                                         reqs['-part'], inventories)
+            response.store('response.npz', reqs, tally0.cells, removal, radioactive)
+            print('Unit responses stored in response.npz, derive other cases with mc2acab-response')
 
-if options['-sdef'] == True:
-    MCNPACAB.apypa2sdef()
+    if options['-sdef'] == True:
+        MCNPACAB.apypa2sdef()
 
+if __name__ == '__main__':
+    main()
@@ -14,12 +14,27 @@ from io import StringIO
 import shutil
 import re
 import datetime
+import copy
+import hashlib
+import pickle
+import fcntl
+from types import SimpleNamespace
 import numpy as np
+from scipy import sparse
 import pandas as pd
 from tqdm import tqdm
 import apypa
 import tally as tal
 from mc2acab import pyhtape3x
+from mc2acab import metrics
+from mc2acab import resultcube
+from mc2acab import cycles
+from mc2acab import adaptive
+from mc2acab import groupxs
+from mc2acab import bateman
+from mc2acab import cellcache
+from mc2acab import pruning
+from mc2acab import cell as cel
 
 
 def __is_number(s):
@@ -63,6 +78,199 @@ def backup_previous(item):
         os.replace(item,f'{item}_bk_{name_id}')
         print(f"\nBacking up existing {item} as {item}_bk_{name_id}")
 
+def folder_size(folder):
+    ''' Size in bytes of the files in folder and its subfolders, 0 if it does not exist'''
+    size = 0
+    for root, _, files in os.walk(folder):
+        size += sum(os.path.getsize(os.path.join(root, name)) for name in files
+                    if not os.path.islink(os.path.join(root, name)))
+    return size
+
+def atomic_dump(obj, filename):
+    ''' Pickle obj into filename so that readers only ever see a complete file.
+    The data goes to a temporary file in the same folder and is renamed over filename'''
+    folder = os.path.dirname(os.path.abspath(filename))
+    tmpname = os.path.join(folder, f'.{os.path.basename(filename)}.{os.getpid()}.tmp')
+    with open(tmpname, 'wb') as outfile:
+        pickle.dump(obj, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.replace(tmpname, filename)
+
+def campaign_key(reqs, options):
+    ''' Hash of the inputs defining a campaign. Journaled cells are only reused
+    when this key matches, i.e. same outp file, tally, source and scenario'''
+    digest = hashlib.sha256()
+    outp = reqs['-outpfile']
+    stat = os.stat(outp)
+    digest.update(f'{os.path.abspath(outp)} {stat.st_size} {stat.st_mtime_ns}'.encode())
+    for item in ['-part', '-tally_num', '-st', '-irr_time']:
+        digest.update(f'{item}:{reqs[item]}'.encode())
+    for item in ['-decay_times', '-apypa_verge', '-nuc_lib', '-id_Egroup']:
+        digest.update(f'{item}:{options[item]}'.encode())
+    if options['-sce_file'] is not None and os.path.isfile(options['-sce_file']):
+        with open(options['-sce_file'], 'rb') as infile:
+            digest.update(infile.read())
+    if options.get('-passive_sector') is not None:
+        digest.update(f"-rotate:{options['-passive_sector']}".encode())
+    if options.get('-resolution') is not None:  # Adaptive decks, from -adaptive or -adaptive_check
+        digest.update(f"-resolution:{options['-resolution']}".encode())
+    if options.get('-prune') is not None:
+        digest.update(f"-prune:{options['-prune']}".encode())
+    if options.get('-collapse_templates') is not None:  # NumPy collapse, COLLAPS if it was refused
+        digest.update(f"-collapse:numpy {options.get('-collapse_tol')}".encode())
+    if options.get('-rebinned'):
+        digest.update(f"-rebin:{options['-rebin']}".encode())
+    for item in ['-meshtal', '-voxel_mat']:  # Voxel campaigns
+        if options.get(item) is not None:
+            stat = os.stat(options[item])
+            digest.update(f'{item}:{os.path.abspath(options[item])} {stat.st_size} {stat.st_mtime_ns}'.encode())
+    if options.get('-history') is not None:
+        digest.update(f"{options.get('-history_error')}:{options.get('-history_halflife')}".encode())
+        with open(options['-history'], 'rb') as infile:
+            digest.update(infile.read())
+    return digest.hexdigest()
+
+def journal_write(journal_dir, ncell, key, outputs):
+    ''' Journal the outputs of MCNP_ACAB_Map for cell ncell, tagged with the campaign key'''
+    os.makedirs(journal_dir, exist_ok=True)
+    atomic_dump({'key': key, 'cell': ncell, 'outputs': outputs},
+                os.path.join(journal_dir, f'cell_{ncell}.pkl'))
+
+def journal_read(journal_dir, ncell, key):
+    ''' Get the journaled outputs of cell ncell. Returns (found, outputs), where found is
+    False if the cell is not journaled or was journaled for another campaign key'''
+    filename = os.path.join(journal_dir, f'cell_{ncell}.pkl')
+    if not os.path.isfile(filename):
+        return False, None
+    try:
+        with open(filename, 'rb') as infile:
+            entry = pickle.load(infile)
+    except (pickle.UnpicklingError, EOFError):
+        print(f'Warning!!! Corrupted journal entry {filename}, cell {ncell} will be repeated')
+        return False, None
+    if entry['key'] != key or entry['cell'] != ncell:
+        return False, None
+    return True, entry['outputs']
+
+def map_kwargs(reqs, options):
+    ''' Keyword arguments of MCNP_ACAB_Map shared by all the cells of a campaign'''
+    return {'irr_time': reqs['-irr_time'], 'irr_type': reqs['-part'], 'source': reqs['-st'],
+            'save': options['-save'], 'esc_file': options['-sce_file'],
+            'passive_sector': options['-passive_sector'], 'id_lib': options['-nuc_lib'],
+            'id_ILIB': options['-id_Egroup'], 'corte': options['-apypa_verge'],
+            'metrics_dir': 'metrics', 'decks_only': options.get('-decks_only', False),
+            'collapse_templates': options.get('-collapse_templates'),
+            'gxs_cache': os.path.abspath('gxs_cache'),
+            'result_cache': options.get('-cache'),
+            'prune': options.get('-prune'),
+            'compose': options.get('-compose'),
+            'template': inp_template(compile_scenario(
+                reqs['-irr_time'], options['-sce_file'], history=options.get('-history'),
+                cooling_times=options['-decay_times'], outputs=options['-decay_outs'],
+                max_error=options.get('-history_error', 0.01),
+                min_half_life=options.get('-history_halflife', 60.0),
+                resolution=options.get('-resolution'), flux=options.get('-max_flux', 0.0)),
+                adaptive_itmax=options.get('-resolution') is not None)}
+
+def cell_tally(tally0, n):
+    ''' Copy of tally0 restricted to its n-th cell, so a single cell can be shipped
+    to a worker without the rest of the tally. Use it with n_id = 0'''
+    tally1 = copy.copy(tally0)
+    for key, value in vars(tally0).items():
+        if isinstance(value, np.ndarray) and value.shape[:1] == (tally0.ncells,):
+            setattr(tally1, key, value[n:n+1].copy())
+    tally1.cells = list(tally0.cells[n:n+1])
+    tally1.ncells = 1
+    return tally1
+
+def comp_matrix(tally0, passive_sector, properties=None):
+    ''' Composition of the cells of a rotating element. The cells whose number ends in
+    passive_sector are the passive sector, out of the beam; they are grouped with the
+    active cells of the same number before that ending, and the material of a group goes
+    through all of them as it rotates. Cells of other groups are left alone.
+    properties gives the (material, density) of a cell number; a group whose cells differ
+    in them is not one rotating material, and raises ValueError.
+    Returns the sparse (groups x cells) matrix of volume fractions, whose product with the
+    cell fluxes gives the time-averaged flux of every group, and the cell indexes of each
+    group, the first active one being its representative'''
+    suffix = str(passive_sector)
+    groups = {}
+    for n, ncell in enumerate(tally0.cells):
+        ncell = str(int(ncell))
+        key = ncell[:-len(suffix)] if len(ncell) > len(suffix) else ncell
+        groups.setdefault(key, []).append(n)
+    members = []
+    for key, indexes in groups.items():
+        passive = [n for n in indexes if str(int(tally0.cells[n])).endswith(suffix)]
+        if not passive:  # Not rotating, every cell on its own
+            members.extend([n] for n in indexes)
+        else:
+            members.append([n for n in indexes if n not in passive] + passive)
+    members.sort()
+    for indexes in members:
+        if len(indexes) > 1 and properties is not None:
+            cells = [int(tally0.cells[n]) for n in indexes]
+            if len({properties(ncell) for ncell in cells}) > 1:
+                raise ValueError(f'-rotate={passive_sector} groups cells {cells}, of different materials'
+                                 ' or densities')
+    vol = np.asarray(tally0.mass[:, 0], dtype=float)
+    rows, cols, data = [], [], []
+    for group, indexes in enumerate(members):
+        total = vol[indexes].sum()
+        for n in indexes:
+            rows.append(group)
+            cols.append(n)
+            data.append(vol[n]/total if total > 0 else 1/len(indexes))
+    return sparse.csr_matrix((data, (rows, cols)), shape=(len(members), tally0.ncells)), members
+
+def tally_compose(tally0, passive_sector, outpfile=None):
+    ''' Tally with one time-averaged cell per group of comp_matrix: the flux of its cells
+    averaged by volume, their total volume, and the number of the representative. The
+    cells of every group must have the same material and density in outpfile, if given.
+    Returns it and {representative: cell numbers of the group} for the proton feeds, which
+    add up over the group'''
+    def properties(ncell):
+        irr_cell = cel.oget(outpfile, ncell)
+        return irr_cell.mat, irr_cell.density
+    matrix, members = comp_matrix(tally0, passive_sector, None if outpfile is None else properties)
+    spectra = np.asarray(tally0.value[:, 0, 0, 0, :], dtype=float)
+    volumes = (matrix > 0).astype(float) @ np.asarray(tally0.mass[:, 0], dtype=float)
+    cells = [int(tally0.cells[indexes[0]]) for indexes in members]
+    compose = {cells[group]: [int(tally0.cells[n]) for n in indexes]
+               for group, indexes in enumerate(members) if len(indexes) > 1}
+    print(f'{tally0.ncells} cells composed into {len(members)}, {len(compose)} of them rotating')
+    return SimpleNamespace(n=getattr(tally0, 'n', ''), cells=cells, ncells=len(cells),
+                           ebins=tally0.ebins, mass=volumes[:, None],
+                           value=(matrix @ spectra)[:, None, None, None, :]), compose
+
+def composed_feeds(cells, resfile):
+    ''' Proton feeds of a composed cell, the sum of the htape3x residuals of its cells,
+    the representative first'''
+    feeds = {}
+    for residuals in pyhtape3x.get_atom_feeds(cells, resfile) or []:
+        for isotope, amount in zip(residuals[1], residuals[2]):
+            feeds[isotope] = feeds.get(isotope, 0.0) + amount
+    return [cells[0], list(feeds), list(feeds.values())]
+
+def summary_times(totaldata, decay_times=None):
+    ''' Times to be written by summary_table_gen: all of them, or shutdown plus the
+    requested decay times if they are present in the ACAB outputs'''
+    for data in totaldata:
+        if data is not None:
+            return select_times(list(data[0].index), decay_times)
+    return 'All'
+
+def select_times(times, decay_times=None):
+    ''' times, or shutdown plus those of decay_times present in times'''
+    if not decay_times:
+        return times
+    o_times = [1.0]
+    for time_i in decay_times:
+        if time_i in times and time_i not in o_times:
+            o_times.append(time_i)
+    return o_times
+
 def get_user_source():
     print('Calculation of source intensity:')
     print('1: Source term units in particles per second (part/s):')
@@ -160,18 +368,43 @@ def collapse(tally, source, **kwargs):
         t_time: tiempo de irradiación
     """
 
-    id_lib = kwargs.get('id_lib','EAF')
-    id_ilib = kwargs.get('id_ilib','vitJ+')
     cell = kwargs.get('cell',0)
     surface = kwargs.get('surface',0)
     cos = kwargs.get('cos',0)
     t_time = kwargs.get('t_time',0)
+    collapse_spectrum(tally.value[cell, surface, cos, t_time, :], source,
+                      id_lib=kwargs.get('id_lib','EAF'), id_ilib=kwargs.get('id_ilib','vitJ+'),
+                      vol=tally.mass[cell][surface], tally_n=tally.n, ebins=tally.ebins)
+
+
+def collapse_spectrum(spectrum, source, **kwargs):
+    """
+    Escribe COLL.inp a partir de un espectro (flujo por grupo y total al final) y ejecuta COLLAPS.
+    Args:
+        spectrum: flujo por partícula fuente, grupos en energía creciente y total como último valor
+        source: fuente de partículas
+        id_lib: identificador de la librería de secciones transversales
+        id_ilib: identificador de la librería de grupos de energía
+        vol: volumen de la celda, sólo informativo
+        tally_n: número de tally, sólo informativo
+        ebins: límites de los grupos, necesarios si id_ilib no es vitJ+
+        run: ejecutar COLLAPS tras escribir COLL.inp (por defecto True)
+        folder: carpeta de COLL.inp y de la ejecución (por defecto la actual)
+    """
+
+    id_lib = kwargs.get('id_lib','EAF')
+    id_ilib = kwargs.get('id_ilib','vitJ+')
+    vol = kwargs.get('vol', 0.0)
+    tally_n = kwargs.get('tally_n', '')
+    ebins = kwargs.get('ebins', None)
+    run = kwargs.get('run', True)
+    folder = kwargs.get('folder', '.')
 
     print("*********** RUNNING ESPECTRO-4-ACAB **********")
-    print(f"Using tally {tally.n} with total flux {tally.value[cell, surface, cos, t_time, -1]}")
-    print(f"Total N1: {tally.value[cell, surface, cos, t_time, -1]:.3e} parts/cm2 per source particle ")
-    print(f"Total N2: {tally.value[cell, surface, cos, t_time, -1] * source:.3e} parts/cm2 s")
-    print(f"Volume: {tally.mass[cell][surface]:.3f}")
+    print(f"Using tally {tally_n} with total flux {spectrum[-1]}")
+    print(f"Total N1: {spectrum[-1]:.3e} parts/cm2 per source particle ")
+    print(f"Total N2: {spectrum[-1] * source:.3e} parts/cm2 s")
+    print(f"Volume: {vol:.3f}")
     print("*********************************************\n")
 
     num_lines = 16 if id_lib == 'EAF' else 32
@@ -188,14 +421,14 @@ def collapse(tally, source, **kwargs):
                 break
             print('Please, Y/N')
         if user_input in ['Y','Yes','y']:
-            print(f'Using non-standard energy groups, getting them from tally {tally.n}')
+            print(f'Using non-standard energy groups, getting them from tally {tally_n}')
             ilib = 5 # 5 do not exits in ACAB, so it do not work
             iesf = 5
-            ngroup = tally.eints - 1
+            ngroup = len(spectrum) - 1
         else:
             return
 
-    with open('COLL.inp', 'w', encoding='utf-8') as outfile:
+    with open(os.path.join(folder, 'COLL.inp'), 'w', encoding='utf-8') as outfile:
         outfile.write(f'{ilib} {iesf}\n')  # card 1 ILIB IESF
         outfile.write(f'{num_lines:d}\n')  # card 2  IHEAD
         outfile.write('0 0 0 0\n')  # card 3 ISFIS IGEN ISOCA IBEST if ISFIS = 0 Other values are ignored
@@ -203,26 +436,116 @@ def collapse(tally, source, **kwargs):
         outfile.write(f'-{ngroup} 0\n')  # card 5 NGROUP decreasing energy, FF = 0 units n/cm2-s
         # card 6 not present if IESF != 5
         if iesf == 5:
-            ebins_st = ['{:.5e}'.format(float(ebin)) for ebin in tally.ebins[:-1]]
+            ebins_st = ['{:.5e}'.format(float(ebin)) for ebin in ebins[:-1]]
             ebins_st.reverse()
-            outfile.write('\n'.join([' '.join(ebins_st[i:i+6]) for i in range(0,tally.eints, 6)]))
+            outfile.write('\n'.join([' '.join(ebins_st[i:i+6]) for i in range(0,len(spectrum), 6)]))
             outfile.write('\n')
         # card 7 Flux levels by decreasing energy groups Normalize by n/cm2 s
-        str_flux = ['{:.5e}'.format(flux_i*source) for flux_i in tally.value[cell,surface,cos,t_time,:ngroup]]
+        str_flux = ['{:.5e}'.format(flux_i*source) for flux_i in spectrum[:ngroup]]
         str_flux.reverse()
-        outfile.write('\n'.join([' '.join(str_flux[i:i+6]) for i in range(0,tally.eints, 6)]))
+        outfile.write('\n'.join([' '.join(str_flux[i:i+6]) for i in range(0,len(spectrum), 6)]))
         outfile.write('\n0\n')  # card 8 IUNC3G
         outfile.write('0\n')  # card 9 ISTOP
 
+    if not run:
+        return
+    run_collaps(folder)
+
+def run_collaps(folder='.'):
+    ''' Run COLLAPS on the COLL.inp of folder'''
     print("*********** RUNNING COLLAPS **********")
-    subprocess.run(['collaps_2008'], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    subprocess.run(['collaps_2008'], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT,
+                   cwd=folder)
+
+
+def gxs_file(irr_type):
+    ''' EAF group cross section file of ACAB_LB_PATH for the particles of irr_type'''
+    if 'n' in irr_type:
+        return f"{os.environ['ACAB_LB_PATH']}eaf_n_gxs_211_flt_20070"
+    return f"{os.environ['ACAB_LB_PATH']}eaf_p_gxs_211_flt_20070"
+
+
+def native_collapse(spectra, source, irr_type, cells, **kwargs):
+    ''' Prepare the NumPy group collapse (see groupxs) of a campaign: COLLAPS runs for
+    the first of cells (indexes of spectra) to give the templates of its outputs, and for
+    the next check ones to validate them. kwargs can be:
+        check: cells validated against COLLAPS (default 2)
+        tol: largest relative difference accepted (default 1e-3)
+        workdir: folder of the COLLAPS runs (default collapse_template)
+        cache_dir: folder of the parsed cross sections (default gxs_cache)
+        id_lib, id_ilib: as collapse_spectrum
+    Returns the file of the templates for MCNP_ACAB_Map, None if the validation failed'''
+    check = kwargs.get('check', 2)
+    tol = kwargs.get('tol', 1E-3)
+    workdir = os.path.abspath(kwargs.get('workdir', 'collapse_template'))
+    cache_dir = os.path.abspath(kwargs.get('cache_dir', 'gxs_cache'))
+    xsfile = gxs_file(irr_type)
+    xs = groupxs.load_gxs(xsfile, cache_dir)[1]
+    backup_previous(workdir)
+    os.mkdir(workdir)
+    cwd = os.getcwd()
+    folders = []
+    try:
+        for n in cells[:check+1]:
+            folders.append(os.path.join(workdir, str(n)))
+            os.mkdir(folders[-1])
+            os.chdir(folders[-1])
+            os.symlink(xsfile, 'XSBL.dat')
+            collapse_spectrum(spectra[n], source, id_lib=kwargs.get('id_lib', 'EAF'),
+                              id_ilib=kwargs.get('id_ilib', 'vitJ+'))
+    finally:
+        os.chdir(cwd)
+    n = cells[0]
+    sigma = groupxs.one_group(xs, groupxs.group_spectra(spectra[n]))[:, 0]
+    possible = np.asarray(xs).any(axis=1)  # Reactions with a cross section in some group
+    try:
+        templates = {name: groupxs.learn_template(os.path.join(folders[0], name), sigma, spectra[n][-1]*source,
+                                                  possible=possible)
+                     for name in groupxs.COLLAPS_OUTPUTS if os.path.isfile(os.path.join(folders[0], name))}
+    except ValueError as e:
+        print(f'\033[31m {e}, using COLLAPS \033[0m')
+        return None
+    worst = 0.0
+    for n, folder in zip(cells[1:check+1], folders[1:]):
+        for name, (error, ndiff) in groupxs.validate(templates, xs, spectra[n], source, folder).items():
+            print(f'NumPy collapse of tally cell {n}, {name}: max difference {error:.2e},'
+                  f' {ndiff} numbers over the printed precision')
+            worst = max(worst, error)
+    if worst > tol:
+        print(f'\033[31m NumPy collapse differs from COLLAPS by {worst:.2e}, using COLLAPS \033[0m')
+        return None
+    filename = os.path.join(workdir, 'templates.pkl')
+    with open(filename, 'wb') as outfile:
+        pickle.dump(templates, outfile)
+    return filename
+
+
+def screen_cells(spectra, source, irr_type, inventories, phases, cooling_times, **kwargs):
+    ''' Bateman estimates of the activity (Bq/cm3), decay heat and gamma power (W/cm3) of
+    cells, see bateman.estimate, from the decay and group cross section data of ACAB.
+    Returns three (cells x times) arrays, the first time being the end of phases. kwargs can be:
+        min_half_life: nuclides shorter lived are in quasi steady state (default 3600 s)
+        cache_dir: folder of the parsed cross sections (default gxs_cache)
+        chunk: cells evolved at once (default 64)'''
+    reactions, xs = groupxs.load_gxs(gxs_file(irr_type), kwargs.get('cache_dir', 'gxs_cache'))
+    products, tritium = bateman.reaction_products(reactions, 'n' if 'n' in irr_type else 'p')
+    decay = bateman.read_decay(os.environ['ACAB_LB_PATH'] + 'DECAY.dat')
+    initial = {zai for inventory in inventories for zai in inventory}
+    screening = bateman.Screening(decay, reactions, products, tritium, initial,
+                                  kwargs.get('min_half_life', bateman.MIN_HALF_LIFE))
+    print(f'Screening system of {len(screening.zai)} nuclides ({len(screening.short)} in quasi'
+          f' steady state) and {len(screening.kept)} reactions')
+    return bateman.estimate(screening, xs, spectra, source, inventories, phases, cooling_times,
+                            kwargs.get('chunk', 64))
 
 
 def scenary_generator(irr_time, cooling_times, outputs, **kwargs):
-    ''' Generates an automatic ACAB Scenario file '''
-    # TODO Think how to improve generator for more complex scenarios... i.e. multiple irradiation cycles
+    ''' Generates an automatic ACAB Scenario file. See cycles.cycle_scenario for multiple
+    irradiation cycles and for the resolution and flux kwargs of adaptive sub-steps'''
     Sce_name = kwargs.get('Sce_name', None)
     feeds = kwargs.get('feeds', None)
+    resolution = kwargs.get('resolution', None)
+    flux = kwargs.get('flux', 0.0)
     if not isinstance(cooling_times,list) or not any(__is_number(time) for time in cooling_times):
         raise ValueError('Cooling times must we a list of times (integers in secons)')
     if not isinstance(outputs,list) or any(output not in [0,1] for output in outputs):
@@ -231,141 +554,121 @@ def scenary_generator(irr_time, cooling_times, outputs, **kwargs):
     if len(outputs) != len(cooling_times) + 1:
         raise ValueError('Outputs times must we a list of 0 (NO output) or 1 (output) '
               'plus an initial 0 correspoding to the irradiation')
-    isfed = 1 if feeds else 0
-    inputfile = ''
-    inputfile +="< Blocks #7 & #8 irradiation set 0\n"
-    inputfile += f"10  10  1  10  1  {isfed:d}  0  0\n"
-    irr_times = ['{:.3e}'.format(irr_time * pow(2,-10+1+i)) for i in range(10)]
-    inputfile += '\n'.join([', '.join(irr_times)])
-    prev_nsteps = 10
-    prev_time = 0 # To keep tracks of previous cooling time
-    for i, ctime in enumerate(cooling_times):
-        inputfile += f"\n< Blocks #7 & #8 post-irradiation set {i+1}\n"
-        if ctime < 1000:
-            isend = 0 if ctime == cooling_times[-1] else 1
-            inputfile += f"0  1  {isend}  {prev_nsteps}  1  0  0  0\n"
-            inputfile += f"{ctime:.3E}"
-            prev_nsteps = 1
-        else:
-            isend = 0 if ctime == cooling_times[-1] else 1
-            inputfile += f"0  10  {isend}  {prev_nsteps}  1  0  0  0\n"
-            dec_times = ['{:.3e}'.format(((ctime - prev_time)*pow(2,i)/pow(2,9))+prev_time) for i in range(10)]
-            inputfile += '\n'.join([', '.join(dec_times)])
-            prev_nsteps = 10
-        prev_time = ctime
-    inputfile +="\n< Block #9 Card #1\n"
-    inputfile += "1.0E-25 1.0E+00\n"
-    inputfile +="< Block #10 Card #1\n"
-    inputfile += "0 0 0 \n"
-    inputfile +="< Block #11 card #1\n"
-    # Card 1 IWP IMTX IWDR       IDOSE IPHCUT IDHEAT     IOFFSD ICEDE INEMISS IDAMAGE
-    inputfile += "1 0 1  1 1 0  0 0 0 0 \n"
-    inputfile +="< Block #11 card #2\n"
-    inputfile += "0 0 1 0 \n" # Card 2
-    # Block #11 cards #3 #4 not appear because IOFFSD = 0
-    # Block #11 card #5 not appear because IOFFSD = 0 and ILIFR = 0
-    inputfile +="< Block #11 card #6\n"
-    j_total = len(cooling_times) + 1
-    # Block #11 Card #6  NOPUL NTSEQ NOTTS NVFL
-    inputfile += f"0 0 {j_total:d} 1 \n"
-    inputfile +="< Block #11 card #7\n"
-    # Block #11 Card #7 FVAR for each set in the unit plus aditional sets
-    inputfile += ' '.join(['1'] * j_total)
-    # Block #11 Card #8 not appear because NOPUL = 0
-    inputfile +="\n< Block #12 card #1\n"
-    # Block #12 Card #1 IIFD
-    inputfile += "0\n"
-    # Block #12 Card #2 to #15 not appear because IIFD = 0
-    inputfile +="< Block #13 card #1\n"
-    # BLOCK #13 Card #1 NCYO IFSO
-    inputfile += "0 1\n"
-    # BLOCK #13 Card #2 not appears because NCYO = 0
-    inputfile +="< Block #13 card #3\n"
-    # BLOCK #13 Card #3 ITSO
-    str_outputs = [str(output) for output in outputs]
-    inputfile += '\n'.join([' '.join(str_outputs[i:i+8]) for i in range(0,j_total, 8)])
-    inputfile += '\n'
-    if Sce_name != None:
-        with open (Sce_name, "w", encoding='utf-8') as writefile:
-            writefile.write(inputfile)
-    return inputfile
+    # A single irradiation is the simplest operating history
+    return cycles.cycle_scenario([(irr_time, 1.0, 0)], cooling_times, outputs, feeds=feeds,
+                                 resolution=resolution, flux=flux, Sce_name=Sce_name)
 
-def create_inp(flux,irr_time,mat,vol,**kwargs):
-    ''' Create an ACAB imput file inp.5 kwargs can be:
-        sce_file: irradiation scenario file. Renders irr_time irrelevant
-        feeds: External isotopical feed, typically for proton activation'''
-    sce_file = kwargs.get('sce_file', None)
-    feeds = kwargs.get('feeds', None)
+# Decaimiento:                 1 h    1day    1week   1month    1year   5years
+AUTO_COOLING_TIMES = [0.1, 1, 10, 100, 3600, 3600*24, 3600*24*7, 3600*24*30, 3600*24*365, 3600*24*365*5]
+AUTO_OUTPUTS = [0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1] # One more element than Cooling_time (the irradiation!)
+
+def compile_scenario(irr_time, sce_file=None, **kwargs):
+    ''' Blocks 7-13 of inp.5, read once per campaign from sce_file or built by
+    scenary_generator. Returns a tuple with the text for cells without and with
+    isotopical feeds. kwargs can be:
+        history: operating history file, see cycles.read_history
+        cooling_times, outputs: cooling after the history, as in scenary_generator
+        max_error, min_half_life: merging of the history phases, see cycles.cycle_scenario
+        resolution, flux: adaptive sub-steps, see cycles.cycle_scenario'''
+    history = kwargs.get('history', None)
+    resolution = kwargs.get('resolution', None)
+    flux = kwargs.get('flux', 0.0)
     if sce_file is not None:   # Scenario file provided
         print("Using Scenario file", repr(sce_file))
         if not os.path.exists(str(sce_file)):
             raise FileNotFoundError(f'Warning!!! No Scenario File!!! {str(sce_file)} is not here')
-        else:
-            with open(sce_file, 'r', encoding='utf-8') as infile:
-                sce_str = infile.read()
+        with open(sce_file, 'r', encoding='utf-8') as infile:
+            sce_str = infile.read()
+        return sce_str, sce_str
+    if history is not None:
+        print("Building up a scenario from operating history", repr(history))
+        phases = cycles.read_history(history)
+        cooling_times = kwargs.get('cooling_times', None) or list(AUTO_COOLING_TIMES)
+        outputs = kwargs.get('outputs', None) or list(AUTO_OUTPUTS)
+        return tuple(cycles.cycle_scenario(phases, cooling_times, outputs, feeds=isfed,
+                                           max_error=kwargs.get('max_error', 0.01),
+                                           min_half_life=kwargs.get('min_half_life', 60.0),
+                                           resolution=resolution, flux=flux)
+                     for isfed in [False, True])
+    print("Building up an automatic scenario file")
+    return tuple(scenary_generator(irr_time, list(AUTO_COOLING_TIMES), list(AUTO_OUTPUTS),
+                                   Sce_name=None, feeds=isfed, resolution=resolution, flux=flux)
+                 for isfed in [False, True])
+
+def inp_template(scenario, adaptive_itmax=False):
+    ''' Parts of inp.5 common to all the cells of a campaign, pre-rendered for
+    render_inp. scenario is the output of compile_scenario. With adaptive_itmax
+    ITMAX follows the flux of each cell, see adaptive.choose_itmax'''
+    # Block 1
+    head = "Entrada generada por MCNP_ACAB\n" # Card 1
+    head += "0\n" # Card 2
+    #Card 6
+    Elist = ['2.0e+01', '1.4e+01', '1.2e+01', '1.0e+01', '8.0e+00', '6.5e+00',
+             '5.0e+00', '4.0e+00', '3.0e+00', '2.5e+00', '2.0e+00', '1.7e+00',
+             '1.4e+00', '1.2e+00', '1.0e+00', '8.0e-01', '6.0e-01', '4.0e-01',
+             '3.0e-01', '2.0e-01', '1.0e-01', '5.0e-02', '2.0e-02', '1.0e-02',
+             '0.0e+00']
+    energies = '\n'.join([', '.join(Elist[i:i+8]) for i in range(0,len(Elist), 8)]) + '\n'
+    # Card 7
+    energies += "0.00E+00  0.00E+00  0.00E+00  0.00E+00  0.00E+00  0.00E+00   \n"
+    # Card 8: Outputs
+    energies += "0 0 1   0 0 0   0 0 1   0 0 1   0 0 0   0 0 0   \n"
+    return {'library': 2232, 'head': head, 'energies': energies, 'scenario': tuple(scenario),
+            'adaptive_itmax': adaptive_itmax}
+
+def __rows(items, sep, nrow):
+    "Lines of nrow items joined by sep"
+    return '\n'.join([sep.join(items[i:i+nrow]) for i in range(0, len(items), nrow)])
+
+def render_inp(template, flux, mat, vol, feeds=None):
+    ''' Text of the inp.5 of a cell from an inp_template'''
+    if template.get('adaptive_itmax'):
+        ITMAX = adaptive.choose_itmax(flux)
     else:
-        print("Building up an automatic scenario file")
-        # Decaimiento:                 1 h    1day    1week   1month    1year   5years
-        cooling_times = [0.1, 1, 10, 100, 3600, 3600*24, 3600*24*7, 3600*24*30, 3600*24*365, 3600*24*365*5]
-        outputs = [0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1] # One more element than Cooling_time (the irradiation!)
-        sce_str = scenary_generator(irr_time, cooling_times, outputs, Sce_name=None, feeds=feeds)
-
-    with open ("inp.5", "w", encoding='utf-8') as inputfile:
-        libreria = 2232
-        # Block 1
-        inputfile.write("Entrada generada por MCNP_ACAB\n") # Card 1
-        inputfile.write("0\n") # Card 2
         ITMAX = 250000 if flux == 0 else 900000
-        isfed = 1 if feeds else 0
-        inputfile.write(f'{libreria:d} {ITMAX:d}  0   1  1 0 2    2 '
-                        f'{2*isfed}    24  1  0  4  1  1  0  1  0  0  0  0 \n') #  Card 3
-        # Block 2
-        inputfile.write("{0:E}     1.0000\n".format(vol))
-        inputfile.write("1\n")
-        Niso=len(mat.zaid)
-        # inputfile.write("{0:d}\n".format(Niso)) # Block 2 Card 4: Numero de isotopos
-        inputfile.write("{}\n".format(Niso)) # Block 2 Card 4:
-        # Card 5 ISOZO
-        if feeds is not None:
-            inputfile.write("{0:d}\n".format(len(feeds[1])))
-        #Card 6
-        Elist = ['2.0e+01', '1.4e+01', '1.2e+01', '1.0e+01', '8.0e+00', '6.5e+00',
-                 '5.0e+00', '4.0e+00', '3.0e+00', '2.5e+00', '2.0e+00', '1.7e+00',
-                 '1.4e+00', '1.2e+00', '1.0e+00', '8.0e-01', '6.0e-01', '4.0e-01',
-                 '3.0e-01', '2.0e-01', '1.0e-01', '5.0e-02', '2.0e-02', '1.0e-02',
-                 '0.0e+00']
-        inputfile.write('\n'.join([', '.join(Elist[i:i+8]) for i in range(0,len(Elist), 8)]))
-        inputfile.write('\n')
-        # Card 7
-        inputfile.write("0.00E+00  0.00E+00  0.00E+00  0.00E+00  0.00E+00  0.00E+00   \n")
-        # Card 8: Outputs
-        inputfile.write("0 0 1   0 0 0   0 0 1   0 0 1   0 0 0   0 0 0   \n")
-        #Block 3: Neutron flux
-        inputfile.write("{0:E}\n".format(flux))
-        # Block 4:
-        inputfile.write("0 IREST\n")
-        #Block 5:
-        inputfile.write("< Isotopia\n")
-        str_mats = [str(isotope) for isotope in mat.zaid]
-        inputfile.write('\n'.join([' '.join(str_mats[i:i+5]) for i in range(0,len(str_mats), 5)]))
-        inputfile.write('\n')
-        str_mats = [f'{isotope:.6e}' for isotope in mat.frac]
-        inputfile.write('\n'.join([' '.join(str_mats[i:i+5]) for i in range(0,len(str_mats), 5)]))
-        inputfile.write('\n')
-        #Blocks 6: Feeds.
-        if feeds is not None:
-            str_mats = [str(isotope) for isotope in feeds[1]]
-            inputfile.write('\n'.join([', '.join(str_mats[i:i+5]) for i in range(0,len(str_mats), 5)]))
-            inputfile.write('\n')
-            str_mats = [str(isotope) for isotope in feeds[2]]
-            inputfile.write('\n'.join([', '.join(str_mats[i:i+5]) for i in range(0,len(str_mats), 5)]))
-            inputfile.write('\n')
-        #Blocks 7-8: Burn out and cooldown scenario
-        inputfile.write(sce_str)
+    isfed = 1 if feeds else 0
+    parts = [template['head'],
+             f'{template["library"]:d} {ITMAX:d}  0   1  1 0 2    2 '
+             f'{2*isfed}    24  1  0  4  1  1  0  1  0  0  0  0 \n', #  Card 3
+             # Block 2
+             "{0:E}     1.0000\n".format(vol), "1\n",
+             "{}\n".format(len(mat.zaid))] # Block 2 Card 4: Numero de isotopos
+    # Card 5 ISOZO
+    if feeds is not None:
+        parts.append("{0:d}\n".format(len(feeds[1])))
+    parts.append(template['energies'])
+    #Block 3: Neutron flux, Block 4 and Block 5
+    parts.append("{0:E}\n0 IREST\n< Isotopia\n".format(flux))
+    parts.append(__rows([str(isotope) for isotope in mat.zaid], ' ', 5) + '\n')
+    parts.append(__rows(list(np.char.mod('%.6e', np.asarray(mat.frac, dtype=float))), ' ', 5) + '\n')
+    #Blocks 6: Feeds.
+    if feeds is not None:
+        parts.append(__rows([str(isotope) for isotope in feeds[1]], ', ', 5) + '\n')
+        parts.append(__rows([str(isotope) for isotope in feeds[2]], ', ', 5) + '\n')
+    #Blocks 7-8: Burn out and cooldown scenario
+    parts.append(template['scenario'][isfed])
+    return ''.join(parts)
 
-def MCNP_ACAB_Map(**kwargs):
+def create_inp(flux,irr_time,mat,vol,**kwargs):
+    ''' Create an ACAB imput file inp.5 kwargs can be:
+        sce_file: irradiation scenario file. Renders irr_time irrelevant
+        feeds: External isotopical feed, typically for proton activation
+        template: inp_template of the campaign, sce_file and irr_time are then ignored
+        folder: folder of inp.5, the current one by default'''
+    sce_file = kwargs.get('sce_file', None)
+    feeds = kwargs.get('feeds', None)
+    template = kwargs.get('template', None)
+    if template is None:
+        template = inp_template(compile_scenario(irr_time, sce_file))
+    with open (os.path.join(kwargs.get('folder', '.'), "inp.5"), "w", encoding='utf-8') as inputfile:
+        inputfile.write(render_inp(template, flux, mat, vol, feeds))
+
+def prepare_cell(**kwargs):
     #tally0,mater,irr_cell,irr_time,irr_type,n_id,save,esc_file,passive_sector,source,id_lib,id_ILIB,corte):
-    '''Assistant to carry ouy MCNP_ACAB calculations'''
+    ''' First stage of MCNP_ACAB_Map: material, library links, feeds and decks of a cell,
+    written in its own folder given as an explicit path, so the working folder is never
+    changed. Returns the job of the cell for execute_cell and parse_cell, finished with
+    its outputs already if it needs no run (null, decks only or in the result cache)'''
     feeds = None  # Default value
     start_time = time.time()
     tally0 = kwargs.get('tally0')
@@ -380,94 +683,169 @@ def MCNP_ACAB_Map(**kwargs):
     id_lib = kwargs.get('id_lib', 'EAF') # the only one that works in ACAB
     id_ILIB = kwargs.get('id_ILIB', 'vitJ+') # the only one that works in ACAB
     corte = kwargs.get('corte', 1E-2)
+    metrics_dir = kwargs.get('metrics_dir', None)
+    template = kwargs.get('template', None)  # inp_template of the campaign
+    decks_only = kwargs.get('decks_only', False)  # Write COLL.inp and inp.5 but run neither
+    collapse_templates = kwargs.get('collapse_templates', None)  # From native_collapse, None runs COLLAPS
+    gxs_cache = kwargs.get('gxs_cache', 'gxs_cache')
+    result_cache = kwargs.get('result_cache', None)  # cellcache store, None runs every cell
+    prune = kwargs.get('prune', None)  # Bound of pruning.prune_cell, None keeps every nuclide
+    compose = kwargs.get('compose', None) or {}  # Cells of the rotating groups, from tally_compose
+    # Workers fed from shared memory give the spectrum and volume of the cell instead of tally0
+    spectrum = kwargs.get('spectrum')
+    vol = kwargs.get('vol')
+    if tally0 is not None:
+        spectrum = tally0.value[n_id, 0, 0, 0, :]
+        vol = tally0.mass[n_id, 0]
     print('particles: ',irr_type)
-    Wdir = str(irr_cell.ncell)
+    Wdir = str(irr_cell.ncell) + kwargs.get('wdir_suffix', '')
     print(f"doing cell {irr_cell.ncell}")
-    flux = tally0.value[n_id, 0, 0, 0, -1]*source
+    flux = spectrum[-1]*source
+    finished = SimpleNamespace(finished=True, outputs=None)
     if not mater.zaid:
         print(f"doing cell {irr_cell.ncell} null material")
-        return None
+        return finished
     if flux == 0:
         print(f"doing cell {irr_cell.ncell} null tally")
-        return None
-    backup_previous(Wdir)
-    os.mkdir(Wdir)
-    os.chdir(Wdir)
-    if sce_file0 is not None:
-        os.symlink(os.pardir+os.sep+sce_file0, sce_file0)
-# Manipulamos el mat para que pueda representar estados excitados
-    mater.n2ro(irr_cell.density)
-    matfixed_zaid, matfixed_frac = pyhtape3x.unfold_NA(mater.zaid, mater.frac)
-    mater.zaid[:] = [10*i for i in matfixed_zaid] # Fix material with nat abundance AND add excited state info
-    mater.frac[:] = list(matfixed_frac)
-    vol = tally0.mass[n_id, 0]
-     # Parte de enlazar *.dat
-    DatFiles=["DHEAT.dat","FYBL.dat","af_asscfy.dat","PHOTON.dat","MACOEF.dat","EBEATA.dat","DECAY.dat","WD.dat"]
-    Dat_origin_Files=[]
-    for datfile in DatFiles:
-        dfile = os.environ["ACAB_LB_PATH"]+datfile
-        Dat_origin_Files.append(dfile)
-    Dat_origin_Files[1] = os.environ["ACAB_LB_PATH"]+"eaf_n_fis_20070"
-    Dat_origin_Files[2] = os.environ["ACAB_LB_PATH"]+"eaf_n_asscfy_20070"
-    for index,datfile in enumerate(DatFiles):
-        if not os.path.isfile(datfile):
-            os.symlink(Dat_origin_Files[index],datfile)
-#    print('\033[31m flux {0}, tally_ncel {1}, n {2}\033[0m'.format(tally.value[n][-1],tally.cells[n],n))
-    if 'n' in irr_type:
-        xsfile = f"{os.environ['ACAB_LB_PATH']}eaf_n_gxs_211_flt_20070"
-    else:
-        xsfile = f"{os.environ['ACAB_LB_PATH']}eaf_p_gxs_211_flt_20070"
-    if not os.path.isfile('XSBL.dat'):
-        os.symlink(xsfile, 'XSBL.dat')
+        return finished
+    if metrics_dir is not None:
+        metrics_dir = os.path.abspath(metrics_dir)
+    root = os.getcwd()  # Campaign folder, the cell folder and logfile.txt are in it
+    wdir = os.path.join(root, Wdir)
+    cell_metrics = metrics.CellMetrics(irr_cell.ncell)
+    with cell_metrics.stage('material'):
+        backup_previous(wdir)
+        os.mkdir(wdir)
+        if sce_file0 is not None:
+            os.symlink(os.pardir+os.sep+sce_file0, os.path.join(wdir, sce_file0))
+    # Manipulamos el mat para que pueda representar estados excitados
+        mater.n2ro(irr_cell.density)
+        matfixed_zaid, matfixed_frac = pyhtape3x.unfold_NA(mater.zaid, mater.frac)
+        mater.zaid[:] = [10*i for i in matfixed_zaid] # Fix material with nat abundance AND add excited state info
+        mater.frac[:] = list(matfixed_frac)
+        npruned = 0
+        if prune is not None:
+            npruned = pruning.prune_cell(mater, spectrum, gxs_file(irr_type), prune, gxs_cache,
+                                         record=os.path.join(wdir, 'pruned.txt'))
+         # Parte de enlazar *.dat
+        DatFiles=["DHEAT.dat","FYBL.dat","af_asscfy.dat","PHOTON.dat","MACOEF.dat","EBEATA.dat","DECAY.dat","WD.dat"]
+        Dat_origin_Files=[]
+        for datfile in DatFiles:
+            dfile = os.environ["ACAB_LB_PATH"]+datfile
+            Dat_origin_Files.append(dfile)
+        Dat_origin_Files[1] = os.environ["ACAB_LB_PATH"]+"eaf_n_fis_20070"
+        Dat_origin_Files[2] = os.environ["ACAB_LB_PATH"]+"eaf_n_asscfy_20070"
+        for index,datfile in enumerate(DatFiles):
+            if not os.path.isfile(os.path.join(wdir, datfile)):
+                os.symlink(Dat_origin_Files[index], os.path.join(wdir, datfile))
+    #    print('\033[31m flux {0}, tally_ncel {1}, n {2}\033[0m'.format(tally.value[n][-1],tally.cells[n],n))
+        if not os.path.isfile(os.path.join(wdir, 'XSBL.dat')):
+            os.symlink(gxs_file(irr_type), os.path.join(wdir, 'XSBL.dat'))
 
     if  re.match(r"[^pn]", irr_type):
         print("particle type not valid")
-        os.chdir(os.pardir)
-        return None
+        return finished
 
     if 'p' in irr_type:  # Deal with the isotopical feeds
-        backup_previous("RES_H")
-        pyhtape3x.createRSH(irr_cell.ncell)
-        os.symlink("../histp", "./histp")
-        os.system("htape3x int=RSH outt=RES_H")
-        feeds=pyhtape3x.get_atom_feed(irr_cell.ncell,"RES_H")
-        feeds[2][:]=[source/6.023E23*i for i in feeds[2]]
+        with cell_metrics.stage('feeds'):
+            backup_previous(os.path.join(wdir, "RES_H"))
+            members = compose.get(int(irr_cell.ncell))
+            if members:  # Rotating, the feeds of all the cells of the group add up
+                pyhtape3x.create_composedRSH(members[0], members[1:], RSHfile=os.path.join(wdir, "RSH"))
+            else:
+                pyhtape3x.createRSH(irr_cell.ncell, RSHfile=os.path.join(wdir, "RSH"))
+            os.symlink("../histp", os.path.join(wdir, "histp"))
+            subprocess.run("htape3x int=RSH outt=RES_H", shell=True, cwd=wdir)
+            if members:
+                feeds = composed_feeds(members, os.path.join(wdir, "RES_H"))
+            else:
+                feeds=pyhtape3x.get_atom_feed(irr_cell.ncell, os.path.join(wdir, "RES_H"))
+            feeds[2][:]=[source/6.023E23*i for i in feeds[2]]
 
-    collapse(tally0, source, id_lib=id_lib, id_ilib=id_ILIB, cell=n_id)
-    create_inp(flux,irr_time,mater,vol,sce_file=sce_file0,feeds=feeds)
+    with cell_metrics.stage('inp5'):
+        collapse_spectrum(spectrum, source, id_lib=id_lib, id_ilib=id_ILIB, vol=vol,
+                          tally_n=getattr(tally0, 'n', ''), ebins=getattr(tally0, 'ebins', kwargs.get('ebins')),
+                          run=False, folder=wdir)
+        create_inp(flux,irr_time,mater,vol,sce_file=sce_file0,feeds=feeds,template=template,folder=wdir)
+    if decks_only:
+        print(f"Decks of cell {irr_cell.ncell} written in {Wdir}")
+        return finished
+    cache_key = None
+    if result_cache is not None:  # Same ACAB inputs as a cell run before, by any campaign
+        cache_key = cellcache.cell_key(wdir, Dat_origin_Files + [gxs_file(irr_type)], irr_type=irr_type,
+                                       id_lib=id_lib, id_ILIB=id_ILIB, corte=corte,
+                                       collapse='collaps' if collapse_templates is None else 'numpy')
+        outputs = cellcache.get(result_cache, cache_key)
+        if outputs is not None:
+            print(f"doing cell {irr_cell.ncell} from the result cache")
+            if save not in ['All', 'all', True]:
+                shutil.rmtree(wdir)
+            return SimpleNamespace(finished=True, outputs=outputs)
+    return SimpleNamespace(finished=False, outputs=None, Wdir=Wdir, wdir=wdir, root=root,
+                           irr_cell=irr_cell, irr_time=irr_time, irr_type=irr_type, source=source,
+                           spectrum=spectrum, vol=vol, flux=flux, save=save, corte=corte,
+                           collapse_templates=collapse_templates, gxs_cache=gxs_cache,
+                           result_cache=result_cache, cache_key=cache_key, metrics_dir=metrics_dir,
+                           metrics=cell_metrics, start_time=start_time, niso=len(mater.zaid),
+                           npruned=npruned, nfeeds=len(feeds[1]) if feeds is not None else 0)
+
+def execute_cell(job):
+    ''' Second stage of MCNP_ACAB_Map: COLLAPS (or its NumPy replacement) and ACAB in the
+    folder of a job of prepare_cell'''
+    with job.metrics.stage('collapse'):
+        if job.collapse_templates is not None:  # COLLAPS outputs from NumPy
+            groupxs.write_collapsed(groupxs.load_templates(job.collapse_templates),
+                                    groupxs.load_gxs(gxs_file(job.irr_type), job.gxs_cache)[1],
+                                    job.spectrum, job.source, folder=job.wdir)
+        else:
+            run_collaps(job.wdir)
 
     print("*********** RUNNING ACAB 2008 **********")
-    subprocess.run('acab_2008',check=True)
+    with job.metrics.stage('acab'):
+        subprocess.run('acab_2008', check=True, cwd=job.wdir)
+
+def parse_cell(job):
+    ''' Last stage of MCNP_ACAB_Map: parse fort.6 of a job run by execute_cell, store it in
+    the result cache, clean its folder up and log it. Returns the outputs'''
+    fort6 = os.path.join(job.wdir, "fort.6")
     ignore_outputs = StringIO()
-    with redirect_stdout(ignore_outputs):
-        heat = apypa.heat_isotopes_full_pd("fort.6",threshold = corte)
-        gamma = apypa.gammas_full_pd("fort.6")
-        dose = apypa.gamma_dose_isotopes_full_pd("fort.6", threshold = corte)
+    with job.metrics.stage('parse'), redirect_stdout(ignore_outputs):
+        heat = apypa.heat_isotopes_full_pd(fort6,threshold = job.corte)
+        gamma = apypa.gammas_full_pd(fort6)
+        dose = apypa.gamma_dose_isotopes_full_pd(fort6, threshold = job.corte)
         # timesets = apypa.get_time_sets('fort.6')
-        decay = apypa.rad_act_isotopes_full_pd('fort.6', threshold = corte)
-        mol = apypa.iso_mol('fort.6', threshold = corte)
-    if save in  ['All','all']:
-        os.chdir(os.pardir)
-    elif save == True:
-        print('\nRemoving REACTIONS.dat and XSECTION.dat\n')
-        os.remove('REACTIONS.dat')
-        os.remove('XSECTION.dat')
-        os.chdir(os.pardir)
-    else:
-        os.chdir(os.pardir)
-        print('Removing working directory '+str(Wdir))
-        shutil.rmtree(Wdir)
+        decay = apypa.rad_act_isotopes_full_pd(fort6, threshold = job.corte)
+        mol = apypa.iso_mol(fort6, threshold = job.corte)
+    if job.cache_key is not None:
+        cellcache.put(job.result_cache, job.cache_key, (decay, gamma, heat, dose, mol))
+    with job.metrics.stage('cleanup'):
+        if job.save in  ['All','all']:
+            pass
+        elif job.save == True:
+            print('\nRemoving REACTIONS.dat and XSECTION.dat\n')
+            os.remove(os.path.join(job.wdir, 'REACTIONS.dat'))
+            os.remove(os.path.join(job.wdir, 'XSECTION.dat'))
+        else:
+            print('Removing working directory '+str(job.Wdir))
+            shutil.rmtree(job.wdir)
 # Calculamos el tiempo de ejecución
-    elapsed_time=time.time()-start_time
-# Escribimos la linea en el log
-    with open('logfile.txt','a', encoding='utf-8') as logfile:
-        line = [f'cell/voxel={Wdir}/{irr_cell.ncell}',f'vol={vol:.2e}ccm', f'ro={irr_cell.density*-1:.2f}g/ccm',
-                f'SourceTerm={source/6.24E15:.3e}mA',f'NeutronFlux={flux:.2e}part/s',
-                f'IrrTime={__display_time(irr_time,3)}', f'Run=-{str(irr_type)}',
-                f'Time={elapsed_time//60:.0f}m {elapsed_time%60:.2f}s']
-        [logfile.write(f'{item} ') for item in line]
-        logfile.write('\n')
-        logfile.close()
+    elapsed_time=time.time()-job.start_time
+    if job.metrics_dir is not None:
+        job.metrics.info = {'vol': float(job.vol), 'flux': float(job.flux), 'niso': job.niso,
+                            'npruned': job.npruned, 'nfeeds': job.nfeeds,
+                            'disk_mb': folder_size(job.wdir)/2**20}
+        job.metrics.write(job.metrics_dir)
+# Escribimos la linea en el log, de una vez y bloqueando el fichero, porque lo comparten todos los workers
+    line = [f'cell/voxel={job.Wdir}/{job.irr_cell.ncell}',f'vol={job.vol:.2e}ccm',
+            f'ro={job.irr_cell.density*-1:.2f}g/ccm',
+            f'SourceTerm={job.source/6.24E15:.3e}mA',f'NeutronFlux={job.flux:.2e}part/s',
+            f'IrrTime={__display_time(job.irr_time,3)}', f'Run=-{str(job.irr_type)}',
+            f'Time={elapsed_time//60:.0f}m {elapsed_time%60:.2f}s']
+    with open(os.path.join(job.root, 'logfile.txt'),'a', encoding='utf-8') as logfile:
+        fcntl.flock(logfile, fcntl.LOCK_EX)
+        logfile.write(' '.join(line) + ' \n')
+        logfile.flush()
+        fcntl.flock(logfile, fcntl.LOCK_UN)
     # Outputs:
     #     1 decay= Bq as ACAB
     #     2 gamma= PHOTONS/CCM/SEC (as ACAB)
@@ -476,6 +854,15 @@ def MCNP_ACAB_Map(**kwargs):
     #     5 mol = mol
     return decay, gamma, heat ,dose, mol
 
+def MCNP_ACAB_Map(**kwargs):
+    '''Assistant to carry ouy MCNP_ACAB calculations: the stages prepare_cell,
+    execute_cell and parse_cell of a cell one after the other'''
+    job = prepare_cell(**kwargs)
+    if job.finished:
+        return job.outputs
+    execute_cell(job)
+    return parse_cell(job)
+
 def summary_table_gen(totaldata_ACAB,tally,**kwargs):
     """ Script de generacion de tablas resumen de MCNP_ACAB """
     t_times = kwargs.get('t_times','All')
@@ -509,13 +896,32 @@ def summary_table_gen(totaldata_ACAB,tally,**kwargs):
                 totalsT = totalsT.drop(columns = time_i)
         totals = totalsT.T
         totals = totals.round(3)
-        totals = totals.applymap('{:.3e}'.format)
+        totals = resultcube.formatted(totals)
         backup_previous('summary_ACAB_{tally.cells[i]}.csv')
         if save == True:
             totals.to_csv(f'summary_ACAB_{tally.cells[i]}.csv',sep='\t',encoding='utf-8')
     # apypas = np.load('summary_apypas.npy', allow_pickle=True)
     return apypas
 
+def summary_table_cube(cube, **kwargs):
+    """ summary_ACAB files of the cells of a resultcube.ResultCube, read cell by cell
+    so the memory does not grow with the number of cells """
+    t_times = kwargs.get('t_times','All')
+    save = kwargs.get('save',True)
+    print('Writing down summary_ACAB file')
+    for i in tqdm(range(cube.ncells)):
+        if cube.status[i] != resultcube.DONE:
+            continue
+        totals = cube.cell_totals(i)
+        totals.index.name = f'Cell:{cube.cells[i]} Vol:{float(cube.vol[i]):.2e}'
+        if t_times not in ['all','All']:
+            totals = totals[totals.index.isin(t_times)]
+        totals = totals.round(3)
+        totals = resultcube.formatted(totals)
+        backup_previous(f'summary_ACAB_{cube.cells[i]}.csv')
+        if save == True:
+            totals.to_csv(f'summary_ACAB_{cube.cells[i]}.csv',sep='\t',encoding='utf-8')
+
 def apypa2sdef(in_cell=None, in_times=None,  infile='summary_apypas.npy'):
     """ Genera una entrada SDEF para multiples celdas y tiempos a partir de un summary_apypa"""
     while not os.path.exists(infile):
@@ -5,10 +5,22 @@ Created on Thu Feb 23 16:54:35 2023
 
 @author: mmagan
 """
+import os
 import re
+from types import SimpleNamespace
 from math import radians, cos
 from numpy import linalg, cross, array, zeros, transpose, matmul
 
+TALLY_CHUNK = 1 << 24  # Bytes read at a time looking backwards for the last tally dump
+
+def is_number(string):
+    "Check if a string is a number"
+    try:
+        float(string)
+        return True
+    except ValueError:
+        return False
+
 def input_finder(infile):
     "Get the input from MCNP output infile"
     inputlines = []
@@ -155,3 +167,82 @@ def get_histpcells(outpinfile):
     uf_tokens = __interval_unfold(tokens, token_type=int)
     histp_cells = array(uf_tokens,dtype=int)
     return histp_cells
+
+def last_tally_offset(outpinfile, ntal):
+    """Offset of the header of the last dump of tally ntal in outpinfile. The file is read
+    backwards from its end, so multi-GB outputs only read their last dump"""
+    pattern = re.compile(rb'^1tally +%d +nps' % int(ntal), re.MULTILINE)
+    with open(outpinfile, 'rb') as outp:
+        end = outp.seek(0, os.SEEK_END)
+        tail = b''
+        while end > 0:
+            start = max(0, end - TALLY_CHUNK)
+            outp.seek(start)
+            block = outp.read(end - start) + tail
+            # A match at the start of a block may be mid line, it is checked with the next block
+            found = [m.start() for m in pattern.finditer(block) if m.start() > 0 or start == 0]
+            if found:
+                return start + found[-1]
+            tail = block[:256]
+            end = start
+    raise ValueError(f'Tally {ntal} not found in {outpinfile}')
+
+def read_f4(outpinfile, ntal):
+    """Cells, volumes, upper energy bounds, fluxes and relative errors of the last dump of
+    F4 tally ntal in outpinfile. Fluxes and errors are (cells x energies+1), total last.
+    Only the first segment, multiplier... bin of each cell is read, as MCNP_ACAB uses"""
+    vol_cells, volumes, ebins = [], [], []
+    cells, flux, error = [], [], []
+    seen = set()
+    reading = False  # Inside the energy bins of a cell
+    # Binary, the offset is in bytes; the lines are ASCII
+    with open(outpinfile, 'rb') as outp:
+        outp.seek(last_tally_offset(outpinfile, ntal))
+        outp.readline()
+        for line in outp:
+            line = line.decode('utf-8', errors='replace')
+            tokens = line.split()
+            if line.startswith('1') or '=====' in line or 'statistical checks' in line:
+                break  # Next table
+            if not tokens:
+                continue
+            if tokens[0] == 'cell:':
+                vol_cells.extend(tokens[1:])
+                volumes.extend(float(token) for token in next(outp).split())
+            elif tokens[0] == 'cell' and len(tokens) == 2:
+                reading = tokens[1] not in seen
+                if reading:
+                    seen.add(tokens[1])
+                    cells.append(tokens[1])
+                    flux.append([])
+                    error.append([])
+            elif reading and tokens[0] == 'total':
+                flux[-1].append(float(tokens[1]))
+                error[-1].append(float(tokens[2]))
+                reading = False
+            elif reading and len(tokens) in [2, 3] and is_number(tokens[0]):
+                if len(tokens) == 2:  # No energy bins, the total only
+                    flux[-1].append(float(tokens[0]))
+                    error[-1].append(float(tokens[1]))
+                    reading = False
+                    continue
+                if len(cells) == 1:
+                    ebins.append(float(tokens[0]))
+                flux[-1].append(float(tokens[1]))
+                error[-1].append(float(tokens[2]))
+    if not cells or any(len(values) != len(ebins) + 1 for values in flux):
+        raise ValueError(f'Tally {ntal} of {outpinfile} is not a plain F4 tally by cells')
+    if vol_cells != cells:
+        raise ValueError(f'Volumes of tally {ntal} do not match its cells')
+    if not all(is_number(ncell) for ncell in cells):
+        raise ValueError(f'Tally {ntal} has union cells')
+    return (array([int(ncell) for ncell in cells]), array(volumes, dtype=float),
+            array(ebins, dtype=float), array(flux, dtype=float), array(error, dtype=float))
+
+def f4_tally(outpinfile, ntal):
+    """Tally object for MCNP_ACAB from read_f4: n, cells, ncells, ebins, mass (cells x 1)
+    and value, error (cells x 1 x 1 x 1 x energies+1), these being views of the arrays"""
+    cells, volumes, ebins, flux, error = read_f4(outpinfile, ntal)
+    return SimpleNamespace(n=int(ntal), cells=cells.tolist(), ncells=len(cells), ebins=ebins,
+                           mass=volumes[:, None], value=flux[:, None, None, None, :],
+                           error=error[:, None, None, None, :])
@@ -0,0 +1,93 @@
+#! /usr/bin/env python
+
+''' Adaptive sub-steps and ITMAX for the ACAB decks.
+    The fixed decks use ten geometric sub-steps for the irradiation and for every
+    cooling set over 1000 s, and ITMAX 900000 whenever there is flux. Here the steps of
+    a set are only those needed for its first step to be shorter than a time resolution
+    (or than the time already on its clock), refined for high fluence irradiations,
+    and ITMAX grows with the flux level.
+    select_resolution runs some benchmark cells with the fixed (reference) decks and with
+    coarser and coarser resolutions, and keeps the fastest one whose totals stay within
+    tolerance of the reference.
+    By Miguel Magan and Octavio Gonzalez'''
+
+import time
+import numpy as np
+
+DEFAULT_RESOLUTION = 1000.0  # s, the fixed decks took one step for cooling sets below it
+MAX_STEPS = 10  # Sub-steps of the fixed decks, never exceeded
+SIGMA_BURN = 1E-21  # cm2 (1000 b), a strong absorber, for the burn-up of an irradiation
+BURN_STEP = 0.01  # Burn-up of the strong absorber over which the resolution is refined
+ITMAX_LEVELS = [(0.0, 250000), (1E10, 500000), (1E13, 900000)]  # (lowest flux, ITMAX)
+CANDIDATES = [1E5, 3E4, 1E4, 3E3, 1E3]  # Resolutions (s) tried, fastest first
+
+def set_steps(duration, clock, resolution, irradiation=False, flux=0.0):
+    ''' Geometric sub-steps of a set of duration s starting at clock s: enough for its
+    first step, duration/2**(steps-1), to be shorter than resolution or clock.
+    For irradiations the resolution is divided by the burn-up over BURN_STEP'''
+    if irradiation:
+        burn = flux*SIGMA_BURN*duration
+        resolution = resolution/max(1.0, burn/BURN_STEP)
+    first = max(resolution, clock)
+    if duration <= first:
+        return 1
+    return int(min(MAX_STEPS, np.ceil(np.log2(duration/first)) + 1))
+
+def choose_itmax(flux):
+    ''' ITMAX of the inp.5 Block 1 card 3 for a cell with flux (part/cm2 s)'''
+    itmax = ITMAX_LEVELS[0][1]
+    for level, value in ITMAX_LEVELS:
+        if flux > level:
+            itmax = value
+    return itmax
+
+def output_deviation(outputs, reference):
+    ''' Largest relative deviation of the totals of outputs from those of reference
+    (MCNP_ACAB_Map outputs) at their common times. Values under 1e-6 of the largest
+    reference one are not considered'''
+    deviation = 0.0
+    for table, ref_table in zip(outputs, reference):
+        if 'Total' in ref_table.columns:
+            total, ref_total = table['Total'], ref_table['Total']
+        else:  # Gamma, times by columns
+            total, ref_total = table.loc['Total'], ref_table.loc['Total']
+        times = [time_i for time_i in ref_total.index if time_i in total.index]
+        values = np.abs(np.array([total[t] for t in times], dtype=float))
+        ref_values = np.abs(np.array([ref_total[t] for t in times], dtype=float))
+        if not len(times) or ref_values.max() == 0:
+            continue
+        floor = 1E-6*ref_values.max()
+        mask = ref_values > floor
+        deviation = max(deviation, float(np.max(np.abs(values[mask] - ref_values[mask])/ref_values[mask])))
+    return deviation
+
+def select_resolution(run_cell, cells, tolerance=0.02):
+    ''' Coarsest resolution of CANDIDATES whose outputs stay within tolerance of the reference
+    on all cells. run_cell(n, resolution) runs cell n and returns its outputs, the reference
+    deck being resolution None. Returns the resolution, None if no candidate passes,
+    and the text of the comparison'''
+    reference = {}
+    ref_wall = 0.0
+    for n in cells:
+        start = time.perf_counter()
+        reference[n] = run_cell(n, None)
+        ref_wall += time.perf_counter() - start
+    cells = [n for n in cells if reference[n] is not None]
+    lines = [f'Reference decks: {ref_wall:.1f} s for {len(cells)} cells']
+    if not cells:
+        return None, '\n'.join(lines + ['No benchmark cell with results, using the reference decks'])
+    for resolution in CANDIDATES:
+        wall = 0.0
+        deviation = 0.0
+        for n in cells:
+            start = time.perf_counter()
+            outputs = run_cell(n, resolution)
+            wall += time.perf_counter() - start
+            deviation = max(deviation, output_deviation(outputs, reference[n]))
+            if deviation > tolerance:
+                break
+        lines.append(f'Resolution {resolution:.0e} s: max deviation {deviation:.2%}'
+                     + (f', {wall:.1f} s' if deviation <= tolerance else ', rejected'))
+        if deviation <= tolerance:
+            return resolution, '\n'.join(lines)
+    return None, '\n'.join(lines + ['No resolution within tolerance, using the reference decks'])
@@ -0,0 +1,322 @@
+#! /usr/bin/env python
+
+''' Bateman screening of the cells before ACAB.
+    A sparse decay and transmutation system is built once per campaign from the ENDF-6
+    decay data (MF8/MT457, the DECAY.dat of ACAB_LB_PATH) and the EAF group cross sections
+    of groupxs, restricted to the nuclides reachable from the materials of the campaign.
+    Nuclides shorter lived than min_half_life are taken in equilibrium with their
+    producers (quasi steady state), which keeps the system soft enough for
+    scipy.sparse.linalg.expm_multiply; after the shutdown, their excess over that
+    equilibrium decays with their own half-life. Their own reactions are neglected, their
+    decay being far faster than any removal by reactions, so the reduced matrices are
+    linear in the reaction rates: their terms are worked out once per campaign and every
+    cell only adds its rates to them, with no solve.
+    The inventories of a batch of cells are evolved at once, a block diagonal matrix for
+    the irradiation and one matrix with a column per cell for the cooling, and give the
+    activity, decay heat and gamma power (a dose proxy) at the output times.
+    Not included: isotopical feeds, fission products and target isomers. Nuclides of the
+    cross sections missing from the decay data are taken as stable.
+    chain() is the analytic solution of a linear decay chain, to check the solver.
+    By Miguel Magan and Octavio Gonzalez'''
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import expm_multiply, spsolve
+from mc2acab import groupxs
+from mc2acab import material
+from mc2acab import pyhtape3x
+
+EV = 1.602176634E-19  # J
+BARN = 1E-24  # cm2
+MIN_HALF_LIFE = 3600.0  # s, shorter lived nuclides are in quasi steady state
+PARTICLES = {'n': (0, 1), 'p': (1, 1), 'd': (1, 2), 't': (1, 3), 'h': (2, 3), 'a': (2, 4)}
+# Particles emitted by the EAF reactions, by MT. The residual is target + incident - emitted
+EMITTED = {4: 'n', 16: 'nn', 17: 'nnn', 37: 'nnnn', 22: 'na', 24: 'nna', 28: 'np', 32: 'nd',
+           33: 'nt', 41: 'nnp', 102: '', 103: 'p', 104: 'd', 105: 't', 106: 'h', 107: 'a',
+           108: 'aa', 111: 'pp'}
+TRITIUM = 10030  # The only radioactive light particle
+# (dZ, dA) of the ENDF decay modes (RTYP digits), SF (6) has no tracked daughter
+MODES = {0: (0, 0), 1: (1, 0), 2: (-1, 0), 3: (0, 0), 4: (-2, -4), 5: (0, -1), 7: (-1, -1)}
+
+def _zai(z, a, state=0):
+    "Nuclide id as in the ACAB inputs: 10*ZA + state"
+    return (int(z)*1000 + int(a))*10 + int(state)
+
+def _daughter(zai, rtyp, rfs):
+    "Daughter of zai by the (maybe multiple) decay mode rtyp, None if not tracked"
+    z, a = divmod(zai//10, 1000)
+    text = f'{rtyp:.4f}'.rstrip('0').rstrip('.')
+    if '.' not in text and len(text) > 1:  # 10, unknown
+        return None
+    for digit in text.replace('.', ''):
+        if int(digit) not in MODES:
+            return None
+        z, a = z + MODES[int(digit)][0], a + MODES[int(digit)][1]
+    return _zai(z, a, rfs)
+
+def _decay_section(rows, decay):
+    "Add the MT457 section of rows (fields of its lines) to decay"
+    za, _, _, liso, nst, _ = rows[0]
+    half_life, _, _, _, npl, _ = rows[1]
+    nlines = int(np.ceil(npl/6))
+    energies = [value for row in rows[2:2+nlines] for value in row][:int(npl)] + [0.0]*6
+    cursor = 2 + nlines
+    npl, ndk = rows[cursor][4], int(rows[cursor][5])
+    modes = [value for row in rows[cursor+1:cursor+1+int(np.ceil(npl/6))] for value in row]
+    zai = int(za)*10 + int(liso)
+    lam = np.log(2)/half_life if half_life > 0 and not nst else 0.0
+    daughters = {}
+    for i in range(ndk if lam else 0):
+        rtyp, rfs, _, _, br, _ = modes[6*i:6*i+6]
+        daughter = _daughter(zai, rtyp, rfs)
+        if daughter is not None:
+            daughters[daughter] = daughters.get(daughter, 0.0) + br
+    decay[zai] = {'lambda': lam, 'daughters': daughters,
+                  'heat': energies[0] + energies[2] + energies[4], 'gamma': energies[2]}
+
+def read_decay(filename):
+    ''' Decay data of an ENDF-6 decay file: {zai: {'lambda' (1/s), 'daughters' {zai: branching},
+    'heat' and 'gamma' (mean energy per decay, eV)}}'''
+    decay = {}
+    rows, section = [], None
+    with open(filename, 'r', encoding='utf-8', errors='replace') as infile:
+        for line in infile:
+            line = line.rstrip('\n').ljust(75)
+            try:
+                key = (int(line[66:70]), int(line[70:72]), int(line[72:75]))
+            except ValueError:
+                continue
+            if key != section:
+                if section is not None and section[1:] == (8, 457) and rows:
+                    _decay_section(rows, decay)
+                rows, section = [], key
+            if key[1:] == (8, 457):
+                rows.append([groupxs.fortran_float(line[i:i+11]) if line[i:i+11].strip() else 0.0
+                             for i in range(0, 66, 11)])
+    return decay
+
+def reaction_products(reactions, incident='n'):
+    ''' Residual nuclide (zai) of every reaction (ZA, MT, LFS) of groupxs, None if its MT is
+    not known, and whether it also makes tritium'''
+    products, tritium = [], []
+    for za, mt, lfs in reactions:
+        if mt not in EMITTED:
+            products.append(None)
+            tritium.append(False)
+            continue
+        z, a = divmod(int(za), 1000)
+        z, a = z + PARTICLES[incident][0], a + PARTICLES[incident][1]
+        for particle in EMITTED[mt]:
+            z, a = z - PARTICLES[particle][0], a - PARTICLES[particle][1]
+        products.append(_zai(z, a, lfs) if z > 0 and a >= z else None)
+        tritium.append('t' in EMITTED[mt])
+    return products, tritium
+
+def cell_inventory(mater, density):
+    ''' Atoms/cm3 by zai of a cell, as MCNP_ACAB_Map gives them to ACAB. mater is not modified'''
+    mater1 = material.Mat(mater.number)
+    mater1.zaid, mater1.frac = list(mater.zaid), list(mater.frac)
+    mater1.n2ro(density)
+    zaids, fracs = pyhtape3x.unfold_NA(mater1.zaid, mater1.frac)
+    inventory = {}
+    for zaid, frac in zip(zaids, fracs):
+        inventory[10*int(zaid)] = inventory.get(10*int(zaid), 0.0) + frac/BARN
+    return inventory
+
+def radioactive(inventory, decay):
+    ''' Whether an inventory {zai: atoms} has radioactive nuclides, decay as read_decay'''
+    return any(decay.get(zai, {}).get('lambda', 0.0) > 0 for zai in inventory)
+
+def chain(lambdas, n0, times):
+    ''' Analytic Bateman solution of the linear chain 0 -> 1 -> ... with decay constants
+    lambdas (all different) and n0 atoms of the first: (times x nuclides) atoms'''
+    lambdas = np.asarray(lambdas, dtype=float)
+    times = np.asarray(times, dtype=float)
+    atoms = np.zeros((len(times), len(lambdas)))
+    for k in range(len(lambdas)):
+        factor = n0*np.prod(lambdas[:k])
+        for i in range(k + 1):
+            others = np.delete(lambdas[:k+1], i)
+            atoms[:, k] += factor*np.exp(-lambdas[i]*times)/np.prod(others - lambdas[i])
+    return atoms
+
+class Screening:
+    """
+    Sparse Bateman system of a campaign. decay as read_decay, reactions and products
+    as reaction_products, initial the zai of the materials of the campaign.
+    """
+    def __init__(self, decay, reactions, products, tritium, initial, min_half_life=MIN_HALF_LIFE):
+        children = {}
+        for zai, data in decay.items():
+            children.setdefault(zai, set()).update(data['daughters'])
+        self.kept = [r for r, product in enumerate(products) if product is not None]
+        for r in self.kept:
+            target = _zai(*divmod(int(reactions[r][0]), 1000))
+            children.setdefault(target, set()).add(products[r])
+            if tritium[r]:
+                children[target].add(TRITIUM)
+        # Nuclides reachable from the initial ones
+        nuclides = set(initial)
+        front = list(initial)
+        while front:
+            for child in children.get(front.pop(), ()):
+                if child not in nuclides:
+                    nuclides.add(child)
+                    front.append(child)
+        self.zai = sorted(nuclides)
+        self.index = {zai: i for i, zai in enumerate(self.zai)}
+        nnuc = len(self.zai)
+        self.lam = np.array([decay.get(zai, {}).get('lambda', 0.0) for zai in self.zai])
+        self.heat = np.array([decay.get(zai, {}).get('heat', 0.0) for zai in self.zai])*EV
+        self.gamma = np.array([decay.get(zai, {}).get('gamma', 0.0) for zai in self.zai])*EV
+        rows, cols, data = [], [], []
+        for zai in self.zai:
+            if zai not in decay or not decay[zai]['lambda']:
+                continue
+            j = self.index[zai]
+            rows.append(j)
+            cols.append(j)
+            data.append(-decay[zai]['lambda'])
+            for daughter, branching in decay[zai]['daughters'].items():
+                rows.append(self.index[daughter])
+                cols.append(j)
+                data.append(decay[zai]['lambda']*branching)
+        self.decay = sp.csr_matrix((data, (rows, cols)), shape=(nnuc, nnuc))
+        # Reactions whose target is in the system
+        self.kept = [r for r in self.kept if _zai(*divmod(int(reactions[r][0]), 1000)) in self.index]
+        self.target = np.array([self.index[_zai(*divmod(int(reactions[r][0]), 1000))] for r in self.kept], dtype=int)
+        self.product = np.array([self.index[products[r]] for r in self.kept], dtype=int)
+        self.tritium = np.array([i for i, r in enumerate(self.kept) if tritium[r]], dtype=int)
+        self.short = np.flatnonzero(self.lam > np.log(2)/min_half_life)
+        self.long = np.flatnonzero(self.lam <= np.log(2)/min_half_life)
+        self.decay_reduced, self.decay_quasi = self.reduce(self.decay)
+        self._reduced_terms, self._quasi_terms = self._rate_terms()
+
+    def transmutation(self, rates):
+        ''' Sparse matrix of the reactions with rates (1/s, one per kept reaction)'''
+        nnuc = len(self.zai)
+        h3 = np.full(len(self.tritium), self.index.get(TRITIUM, 0), dtype=int)
+        data = np.concatenate([rates, -rates, rates[self.tritium]])
+        rows = np.concatenate([self.product, self.target, h3])
+        cols = np.concatenate([self.target, self.target, self.target[self.tritium]])
+        return sp.csr_matrix((data, (rows, cols)), shape=(nnuc, nnuc))
+
+    def reduce(self, matrix):
+        ''' Matrix of the long lived nuclides, with the short lived ones in quasi steady
+        state, and the (short x long) matrix giving their atoms from the long lived ones'''
+        matrix = matrix.tocsr()
+        long_long = matrix[self.long][:, self.long]
+        if not len(self.short):
+            return long_long.tocsc(), sp.csr_matrix((0, len(self.long)))
+        short_short = matrix[self.short][:, self.short].tocsc()
+        quasi = -sp.csr_matrix(spsolve(short_short, matrix[self.short][:, self.long].tocsc()))
+        quasi = quasi.reshape((len(self.short), len(self.long)))
+        return (long_long + matrix[self.long][:, self.short] @ quasi).tocsc(), quasi.tocsr()
+
+    def _rate_terms(self):
+        ''' Terms of the reactions of long lived targets in the reduced matrices, as arrays
+        of row, column, reaction and coefficient: the entry of a matrix is the sum of the
+        rates of its reactions times their coefficients'''
+        nnuc = len(self.zai)
+        position = np.full(nnuc, -1, dtype=int)
+        position[self.long] = np.arange(len(self.long))
+        short_position = np.full(nnuc, -1, dtype=int)
+        short_position[self.short] = np.arange(len(self.short))
+        reaction = np.arange(len(self.kept))
+        h3 = np.full(len(self.tritium), self.index.get(TRITIUM, 0), dtype=int)
+        rows = np.concatenate([self.product, self.target, h3])
+        cols = np.concatenate([self.target, self.target, self.target[self.tritium]])
+        reactions = np.concatenate([reaction, reaction, self.tritium])
+        coefs = np.concatenate([np.ones(len(reaction)), -np.ones(len(reaction)), np.ones(len(h3))])
+        keep = position[cols] >= 0  # Reactions of the short lived are neglected
+        rows, cols, reactions, coefs = rows[keep], position[cols[keep]], reactions[keep], coefs[keep]
+        into_long = position[rows] >= 0
+        reduced = [(position[rows[into_long]], cols[into_long], reactions[into_long], coefs[into_long])]
+        quasi = [(np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0))]
+        if len(self.short) and not into_long.all():
+            # A short lived product is in equilibrium, -(short x short)^-1 of it, and feeds
+            # the long lived through the decay
+            rows, cols, reactions, coefs = (rows[~into_long], cols[~into_long], reactions[~into_long],
+                                            coefs[~into_long])
+            products, column = np.unique(short_position[rows], return_inverse=True)
+            unit = sp.csc_matrix((np.ones(len(products)), (products, np.arange(len(products)))),
+                                 shape=(len(self.short), len(products)))
+            short_short = self.decay[self.short][:, self.short].tocsc()
+            equilibrium = -sp.csc_matrix(spsolve(short_short, unit)).reshape((len(self.short), len(products)))
+            fed = (self.decay[self.long][:, self.short] @ equilibrium).tocsc()
+            for matrix, terms in [(equilibrium.tocsc(), quasi), (fed, reduced)]:
+                matrix = matrix[:, column].tocoo()  # A column per term
+                terms.append((matrix.row, cols[matrix.col], reactions[matrix.col], coefs[matrix.col]*matrix.data))
+        return [tuple(np.concatenate(parts) for parts in zip(*terms)) for terms in (reduced, quasi)]
+
+    def reduce_rates(self, rates):
+        ''' Reduced matrix of the long lived nuclides and quasi steady state matrix of the
+        short lived ones, as reduce, with the reactions at rates (1/s, one per kept reaction)'''
+        matrices = []
+        for base, (rows, cols, reactions, coefs) in [(self.decay_reduced, self._reduced_terms),
+                                                      (self.decay_quasi, self._quasi_terms)]:
+            matrices.append((base + sp.csr_matrix((coefs*rates[reactions], (rows, cols)), shape=base.shape)).tocsc())
+        return matrices[0], matrices[1].tocsr()
+
+    def initial(self, inventory):
+        ''' Atoms vector of an inventory {zai: atoms}'''
+        atoms = np.zeros(len(self.zai))
+        for zai, value in inventory.items():
+            atoms[self.index[zai]] += value
+        return atoms
+
+    def evolve(self, atoms, rates, phases, cooling_times):
+        ''' Atoms (times x cells x nuclides) of cells with initial atoms (cells x nuclides),
+        reaction rates (cells x kept reactions, 1/s at power 1), irradiation phases
+        (duration s, power) and cooling_times (s after the phases). The first time is
+        the end of the phases'''
+        ncells = len(atoms)
+        along = atoms[:, self.long].T.reshape(-1, order='F')  # Cell by cell, the block order
+        quasi_end = [self.decay_quasi]*ncells
+        for duration, power in phases:
+            reduced, quasi = [], []
+            for c in range(ncells):
+                matrix_c, quasi_c = self.reduce_rates(power*np.asarray(rates[c], dtype=float))
+                reduced.append(matrix_c)
+                quasi.append(quasi_c)
+            along = expm_multiply(sp.block_diag(reduced, format='csc')*duration, along)
+            quasi_end = quasi
+        along = along.reshape((len(self.long), ncells), order='F')
+        short_end = np.column_stack([quasi_end[c] @ along[:, c] for c in range(ncells)])
+        # Excess of the short lived over their equilibrium with decay only, decays freely
+        excess = np.maximum(short_end - self.decay_quasi @ along, 0.0)
+        times = [0.0] + list(cooling_times)
+        result = np.zeros((len(times), ncells, len(self.zai)))
+        for t, time in enumerate(times):
+            if t > 0:
+                along = expm_multiply(self.decay_reduced*(time - times[t-1]), along)
+            result[t][:, self.long] = along.T
+            if t == 0:
+                result[t][:, self.short] = short_end.T
+            else:
+                decayed = excess*np.exp(-self.lam[self.short]*time)[:, None]
+                result[t][:, self.short] = (self.decay_quasi @ along + decayed).T
+        return result
+
+    def quantities(self, atoms):
+        ''' Activity (Bq), decay heat (W) and gamma power (W) of atoms (... x nuclides)'''
+        activity = atoms*self.lam
+        return activity.sum(axis=-1), (activity*self.heat).sum(axis=-1), (activity*self.gamma).sum(axis=-1)
+
+def estimate(screening, xs, spectra, source, inventories, phases, cooling_times, chunk=64):
+    ''' Activity (Bq/cm3), decay heat and gamma power (W/cm3) of cells (cells x times) with
+    tally spectra (per source particle, total last) and inventories {zai: atoms/cm3}, for
+    irradiation phases (duration s, power) and cooling_times. The reaction rates of a chunk
+    of cells are one matrix product'''
+    xs = np.asarray(xs)[screening.kept]
+    spectra = np.atleast_2d(spectra)
+    ntimes = len(cooling_times) + 1
+    activity, heat, gamma = (np.zeros((len(spectra), ntimes)) for _ in range(3))
+    for start, sigma in groupxs.collapse_all(xs, groupxs.group_spectra(spectra), chunk):
+        end = start + sigma.shape[1]
+        rates = (sigma*spectra[start:end, -1]*source*BARN).T
+        atoms = np.array([screening.initial(inventory) for inventory in inventories[start:end]])
+        result = screening.quantities(screening.evolve(atoms, rates, phases, cooling_times))
+        for array, values in zip([activity, heat, gamma], result):
+            array[start:end] = values.T
+    return activity, heat, gamma
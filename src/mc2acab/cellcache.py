@@ -0,0 +1,105 @@
+#! /usr/bin/env python
+
+''' Content-addressed store of the results of ACAB runs, shared by campaigns.
+    The key of a cell is the hash of what ACAB reads: its inp.5 (material after n2ro and
+    unfold_NA, flux, volume, feeds and scenario) and COLL.inp (collapsed spectrum), plus
+    the library ids, the apypa threshold, how COLL.inp is collapsed (COLLAPS or NumPy) and
+    the size and date of the library files linked in the folder (group cross sections,
+    DECAY.dat, FYBL.dat...).
+    A cell of a new campaign whose key is already stored takes its results from the store
+    and ACAB does not run. Entries are <key>.pkl in subfolders by the first two characters
+    of the key; every hit touches its entry, and evict() removes the least recently used
+    ones once the store exceeds its size.
+    mc2acab-cache [-cache=folder] [-cache_size=GB] evicts by hand.
+    By Miguel Magan and Octavio Gonzalez'''
+
+import os
+import sys
+import hashlib
+import pickle
+
+DEFAULT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'mc2acab')
+DEFAULT_SIZE = 10.0  # GB
+KEY_FILES = ['inp.5', 'COLL.inp']  # Inputs of ACAB and COLLAPS written by MCNP_ACAB_Map
+
+def cell_key(folder, libfiles, **ids):
+    ''' Key of the ACAB run prepared in folder with the library files libfiles (group
+    cross sections, decay data...), ids being the library ids and any other setting
+    changing the results'''
+    digest = hashlib.sha256()
+    for name in KEY_FILES:
+        with open(os.path.join(folder, name), 'rb') as infile:
+            digest.update(name.encode())
+            digest.update(infile.read())
+    for libfile in libfiles:
+        stat = os.stat(libfile)
+        digest.update(f'{os.path.basename(libfile)} {stat.st_size} {stat.st_mtime_ns}'.encode())
+    for item in sorted(ids):
+        digest.update(f'{item}:{ids[item]}'.encode())
+    return digest.hexdigest()
+
+def _entry(cache_dir, key):
+    "File of key in the store"
+    return os.path.join(cache_dir, key[:2], f'{key}.pkl')
+
+def get(cache_dir, key):
+    ''' Outputs stored for key, None if there are none'''
+    filename = _entry(cache_dir, key)
+    try:
+        with open(filename, 'rb') as infile:
+            outputs = pickle.load(infile)
+        os.utime(filename)  # Recently used
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    return outputs
+
+def put(cache_dir, key, outputs):
+    ''' Store the outputs of key, written whole or not at all'''
+    filename = _entry(cache_dir, key)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmpname = f'{filename}.{os.getpid()}.tmp'
+    with open(tmpname, 'wb') as outfile:
+        pickle.dump(outputs, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmpname, filename)
+
+def evict(cache_dir, max_gb=DEFAULT_SIZE):
+    ''' Remove the least recently used entries until the store takes at most max_gb.
+    Returns the number of entries removed and the size left in bytes'''
+    entries = []
+    for root, _, files in os.walk(cache_dir):
+        for name in files:
+            if name.endswith('.pkl'):
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except FileNotFoundError:  # Evicted by another campaign
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+    size = sum(entry[1] for entry in entries)
+    removed = 0
+    for _, entry_size, filename in sorted(entries):
+        if size <= max_gb*2**30:
+            break
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
+        size -= entry_size
+        removed += 1
+    return removed, size
+
+def main():
+    ''' mc2acab-cache entry point, see the module documentation'''
+    cache_dir, max_gb = DEFAULT_DIR, DEFAULT_SIZE
+    for arg in sys.argv[1:]:
+        if arg.startswith('-cache='):
+            cache_dir = arg.split('=')[1]
+        elif arg.startswith('-cache_size='):
+            max_gb = float(arg.split('=')[1])
+        else:
+            print(__doc__)
+            sys.exit(1)
+    removed, size = evict(cache_dir, max_gb)
+    print(f'{removed} entries evicted from {cache_dir}, {size/2**30:.2f} GB left')
+
+if __name__ == '__main__':
+    main()
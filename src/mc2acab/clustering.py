@@ -0,0 +1,97 @@
+#! /usr/bin/env python
+
+''' Spectral clustering of the cells of a campaign.
+    Cells of the same material and density whose normalized spectra differ less than tol
+    (L1 distance, so the one-group cross sections differ at most by tol times the
+    largest group cross section) are run once: ACAB only runs the cell of largest flux
+    of each cluster, and the others get its results scaled by their flux, and by their
+    volume for the quantities ACAB gives for the whole zone (EXTENSIVE). The atoms of
+    the same material and density are the same, so the induced quantities go with the
+    flux. The mol tables also hold the initial inventory, which does not: only their
+    change from it is scaled by the flux.
+    Materials radioactive at start, whose own activity does not scale, are not
+    clustered (key None), as response.burnup_rates flags them.
+    A sample of members, those farthest from their representative, is also run
+    exactly to measure the error of the mapping.
+    By Miguel Magan and Octavio Gonzalez'''
+
+import numpy as np
+import pandas as pd
+from mc2acab import adaptive
+from mc2acab import redecay
+
+EXTENSIVE = [True, False, False, False, True]  # decay (Bq) and mol of the zone, by MCNP_ACAB_Map output
+
+def normalized(spectra):
+    ''' Group spectra (cells x groups, total last) divided by their total'''
+    spectra = np.atleast_2d(np.asarray(spectra, dtype=float))
+    total = spectra[:, -1:]
+    return np.divide(spectra[:, :-1], total, out=np.zeros_like(spectra[:, :-1]), where=total > 0)
+
+def cluster(spectra, keys, tol=0.05):
+    ''' Representative of every cell (its index, itself for the representatives) and the
+    distance to it. Only cells with the same key (material, density) are clustered,
+    largest flux first. Cells of key None are left alone'''
+    shapes = normalized(spectra)
+    flux = np.asarray(spectra, dtype=float)[:, -1]
+    leader = np.full(len(shapes), -1, dtype=int)
+    distance = np.zeros(len(shapes))
+    groups = {}
+    for n, key in enumerate(keys):
+        groups.setdefault(('alone', n) if key is None else key, []).append(n)
+    for members in groups.values():
+        members = np.array(sorted(members, key=lambda n: -flux[n]), dtype=int)
+        while len(members):
+            head = members[0]
+            dist = np.abs(shapes[members] - shapes[head]).sum(axis=1)
+            close = dist <= tol
+            leader[members[close]] = head
+            distance[members[close]] = dist[close]
+            members = members[~close]
+    return leader, distance
+
+def sample(leader, distance, nsample):
+    ''' The nsample members farthest from their representative'''
+    members = np.flatnonzero(leader != np.arange(len(leader)))
+    return list(members[np.argsort(-distance[members])][:nsample])
+
+def initial_mol(columns, inventory, volume):
+    ''' Initial mol of the nuclides of columns (labels of a mol table, with Total) in a zone
+    of volume cm3 with inventory {zai: atoms/cm3}, as bateman.cell_inventory'''
+    initial = pd.Series(0.0, index=columns)
+    for label in columns:
+        zai = redecay.label_zai(label)
+        if zai in inventory:
+            initial[label] = inventory[zai]*volume/redecay.AVOGADRO
+    if 'Total' in initial.index:
+        initial['Total'] = sum(inventory.values())*volume/redecay.AVOGADRO
+    return initial
+
+def scale_outputs(outputs, factor, volume_ratio, initial=None):
+    ''' MCNP_ACAB_Map outputs of a representative scaled to a member of the same material
+    and density: factor (flux ratio) for all, times volume_ratio for the EXTENSIVE ones.
+    Only the change of the mol table from initial, the initial mol of the representative
+    (initial_mol), goes with the flux'''
+    if outputs is None:
+        return None
+    scaled = []
+    for table, extensive in zip(outputs[:4], EXTENSIVE):
+        table = table*(factor*volume_ratio if extensive else factor)
+        scaled.append(table)
+    initial = 0.0 if initial is None else initial
+    scaled.append((initial + (outputs[4] - initial)*factor)*volume_ratio)
+    return tuple(scaled)
+
+def report(mapped, exact):
+    ''' Text of the largest deviation of the totals of the mapped outputs from the exact
+    ones, {cell: outputs} both'''
+    lines = []
+    worst = 0.0
+    for ncell, outputs in exact.items():
+        if outputs is None or mapped.get(ncell) is None:
+            continue
+        deviation = adaptive.output_deviation(mapped[ncell], outputs)
+        worst = max(worst, deviation)
+        lines.append(f'Cell {ncell}: max deviation of the mapped results {deviation:.2%}')
+    lines.append(f'Clustering error on {len(lines)} sampled cells: {worst:.2%}')
+    return '\n'.join(lines)
@@ -0,0 +1,198 @@
+#! /usr/bin/env python
+
+''' Multi-cycle irradiation scenarios for ACAB.
+    An operating history is a list of phases (duration in s, relative beam power,
+    output flag). Runs of phases are merged into a single phase at their average power
+    whenever the inventory of any nuclide with half-life over min_half_life at the end
+    of the run stays within max_error of the exact pulsed one, so hundreds of beam
+    cycles become a handful of ACAB sets. The Blocks 7 to 13 text is then written as
+    scenary_generator does: the clock of the sets restarts each time the beam goes
+    on or off, and Block 11 card 7 carries the power of each set as FVAR.
+    History file format, one phase per line, # for comments:
+        duration[s|m|h|d|y] power [output]
+    By Miguel Magan and Octavio Gonzalez'''
+
+import numpy as np
+from mc2acab import adaptive
+
+UNITS = {'s': 1.0, 'm': 60.0, 'h': 3600.0, 'd': 86400.0, 'y': 86400*365.0}
+MAX_HALF_LIFE = 1E10  # s, longer lived nuclides do not care about the pulses
+NLAMBDA = 200  # Decay constants checked for the error
+
+def read_history(filename):
+    ''' List of phases (duration in s, power, output) of an operating history file'''
+    history = []
+    with open(filename, 'r', encoding='utf-8') as infile:
+        for line in infile:
+            tokens = line.split('#')[0].split()
+            if not tokens:
+                continue
+            duration = tokens[0]
+            if duration[-1] in UNITS:
+                duration = float(duration[:-1])*UNITS[duration[-1]]
+            else:
+                duration = float(duration)
+            if duration <= 0 or float(tokens[1]) < 0:
+                raise ValueError(f'Wrong phase in {filename}: {line.strip()}')
+            output = int(tokens[2]) if len(tokens) > 2 else 0
+            history.append((duration, float(tokens[1]), output))
+    if not history:
+        raise ValueError(f'No phases in history file {filename}')
+    return history
+
+def decay_constants(min_half_life=60.0):
+    ''' Decay constants (1/s) of the half-lives checked, from min_half_life to MAX_HALF_LIFE'''
+    return np.log(2)/np.geomspace(min_half_life, MAX_HALF_LIFE, NLAMBDA)
+
+def _average(phases):
+    "Single phase equivalent to phases: total duration, average power, last output flag"
+    duration = sum(phase[0] for phase in phases)
+    power = sum(phase[0]*phase[1] for phase in phases)/duration
+    return duration, power, phases[-1][2]
+
+def _grow(inventory, phase, lambdas):
+    "Inventory per unit production after phase, from inventory at its start"
+    decay = np.exp(-lambdas*phase[0])
+    return inventory*decay + phase[1]*(1 - decay)/lambdas
+
+def merge_error(inventory, duration, fluence, lambdas):
+    ''' Largest relative error in the end inventory of replacing the phases of
+    (exact) inventory, duration and fluence by one phase at their average power'''
+    averaged = fluence/duration*(1 - np.exp(-lambdas*duration))/lambdas
+    if not np.any(inventory > 0):
+        return 0.0 if not np.any(averaged > 0) else np.inf
+    error = np.abs(averaged - inventory)/np.where(inventory > 0, inventory, np.inf)
+    return float(np.max(error))
+
+def compress_history(history, max_error=0.01, min_half_life=60.0):
+    ''' Merge consecutive phases of history while the error of merge_error stays below
+    max_error. A phase with output closes its run, so its output time is kept.
+    Returns the merged phases and the largest error made'''
+    lambdas = decay_constants(min_half_life)
+    merged = []
+    worst = 0.0
+    i = 0
+    while i < len(history):
+        inventory = _grow(np.zeros(NLAMBDA), history[i], lambdas)
+        duration, fluence = history[i][0], history[i][0]*history[i][1]
+        error = 0.0
+        j = i + 1
+        while j < len(history) and not history[j-1][2]:
+            inventory1 = _grow(inventory, history[j], lambdas)
+            duration1, fluence1 = duration + history[j][0], fluence + history[j][0]*history[j][1]
+            error1 = merge_error(inventory1, duration1, fluence1, lambdas)
+            if error1 > max_error:
+                break
+            inventory, duration, fluence, error = inventory1, duration1, fluence1, error1
+            j += 1
+        merged.append(_average(history[i:j]))
+        worst = max(worst, error)
+        i = j
+    return merged, worst
+
+def _set_times(t0, duration, steps):
+    "Step end times of a set starting at t0 on the clock"
+    if steps == 1:
+        return [t0 + duration]
+    return [(duration*pow(2, i)/pow(2, steps - 1)) + t0 for i in range(steps)]
+
+def scenario_tail(fvar, outputs):
+    ''' Blocks 9 to 13 of a scenario with the FVAR and ITSO of each set'''
+    j_total = len(fvar)
+    inputfile = "\n< Block #9 Card #1\n"
+    inputfile += "1.0E-25 1.0E+00\n"
+    inputfile +="< Block #10 Card #1\n"
+    inputfile += "0 0 0 \n"
+    inputfile +="< Block #11 card #1\n"
+    # Card 1 IWP IMTX IWDR       IDOSE IPHCUT IDHEAT     IOFFSD ICEDE INEMISS IDAMAGE
+    inputfile += "1 0 1  1 1 0  0 0 0 0 \n"
+    inputfile +="< Block #11 card #2\n"
+    inputfile += "0 0 1 0 \n" # Card 2
+    # Block #11 cards #3 #4 not appear because IOFFSD = 0
+    # Block #11 card #5 not appear because IOFFSD = 0 and ILIFR = 0
+    inputfile +="< Block #11 card #6\n"
+    # Block #11 Card #6  NOPUL NTSEQ NOTTS NVFL
+    inputfile += f"0 0 {j_total:d} 1 \n"
+    inputfile +="< Block #11 card #7\n"
+    # Block #11 Card #7 FVAR for each set in the unit plus aditional sets
+    inputfile += ' '.join([f'{fvar_i:g}' for fvar_i in fvar])
+    # Block #11 Card #8 not appear because NOPUL = 0
+    inputfile +="\n< Block #12 card #1\n"
+    # Block #12 Card #1 IIFD
+    inputfile += "0\n"
+    # Block #12 Card #2 to #15 not appear because IIFD = 0
+    inputfile +="< Block #13 card #1\n"
+    # BLOCK #13 Card #1 NCYO IFSO
+    inputfile += "0 1\n"
+    # BLOCK #13 Card #2 not appears because NCYO = 0
+    inputfile +="< Block #13 card #3\n"
+    # BLOCK #13 Card #3 ITSO
+    str_outputs = [str(output) for output in outputs]
+    inputfile += '\n'.join([' '.join(str_outputs[i:i+8]) for i in range(0,j_total, 8)])
+    inputfile += '\n'
+    return inputfile
+
+def cycle_scenario(history, cooling_times, outputs, **kwargs):
+    ''' Blocks 7 to 13 of inp.5 for an operating history followed by cooling_times (s after
+    the end of the history). outputs as in scenary_generator: its first element is the
+    output at the end of the history, the rest those of cooling_times. kwargs can be:
+        feeds: the cells have isotopical feeds
+        max_error: relative error allowed when merging phases (default 0.01)
+        min_half_life: shortest half-life (s) the error is checked for (default 60)
+        resolution: time resolution (s) of the adaptive sub-steps, see adaptive.set_steps.
+            None (default) for the fixed sub-steps
+        flux: largest flux of the cells, refines the adaptive irradiation steps
+        Sce_name: file to write the scenario to'''
+    isfed = 1 if kwargs.get('feeds', None) else 0
+    max_error = kwargs.get('max_error', 0.01)
+    min_half_life = kwargs.get('min_half_life', 60.0)
+    resolution = kwargs.get('resolution', None)
+    flux = kwargs.get('flux', 0.0)
+    Sce_name = kwargs.get('Sce_name', None)
+    if len(outputs) != len(cooling_times) + 1:
+        raise ValueError('Outputs times must we a list of 0 (NO output) or 1 (output) '
+              'plus an initial 0 correspoding to the irradiation')
+    phases, error = compress_history(history, max_error, min_half_life)
+    if len(history) > 1:
+        print(f'Operating history of {len(history)} phases compressed to {len(phases)} ACAB sets,'
+              f' max error {error:.2%} for half-lives over {min_half_life:g} s')
+    phases[-1] = phases[-1][:2] + (phases[-1][2] or outputs[0],)
+    # Sets: (irradiation, duration, power, output), the cooling times after the history
+    sets = [(power > 0, duration, power, output) for duration, power, output in phases]
+    prev_time = 0
+    for ctime, output in zip(cooling_times, outputs[1:]):
+        sets.append((False, ctime - prev_time, 0.0, output))
+        prev_time = ctime
+    inputfile = ''
+    prev_nsteps = 10
+    clock = 0.0
+    nirr = 0
+    for i, (irradiation, duration, power, output) in enumerate(sets):
+        if i > 0 and irradiation != sets[i-1][0]:
+            clock = 0.0  # The beam went on or off
+        isend = 0 if i == len(sets) - 1 else 1
+        if irradiation:
+            steps = 10 if resolution is None else adaptive.set_steps(duration, clock, resolution, True, flux)
+            inputfile += f"{'' if i == 0 else chr(10)}< Blocks #7 & #8 irradiation set {nirr}\n"
+            inputfile += f"{steps}  {steps}  {isend}  {prev_nsteps}  1  {isfed:d}  0  0\n"
+            nirr += 1
+        else:
+            if resolution is None:
+                steps = 1 if clock + duration < 1000 else 10
+            else:
+                steps = adaptive.set_steps(duration, clock, resolution)
+            inputfile += f"{'' if i == 0 else chr(10)}< Blocks #7 & #8 post-irradiation set {i}\n"
+            inputfile += f"0  {steps}  {isend}  {prev_nsteps}  1  0  0  0\n"
+        times = _set_times(clock, duration, steps)
+        if steps == 1:
+            inputfile += f"{times[0]:.3E}"
+        else:
+            inputfile += ', '.join(['{:.3e}'.format(time) for time in times])
+        clock += duration
+        prev_nsteps = steps
+    inputfile += scenario_tail([power if irradiation else 1 for irradiation, _, power, _ in sets],
+                               [output for _, _, _, output in sets])
+    if Sce_name is not None:
+        with open(Sce_name, 'w', encoding='utf-8') as writefile:
+            writefile.write(inputfile)
+    return inputfile
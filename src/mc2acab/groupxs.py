@@ -0,0 +1,259 @@
+#! /usr/bin/env python
+
+''' NumPy group collapse, in place of running COLLAPS for every cell.
+    The EAF group cross sections (eaf_n_gxs_211_flt_20070, eaf_p_gxs_211_flt_20070) are
+    parsed once into a (reactions x groups) array cached as .npy, which the workers
+    memory-map. One-group cross sections of any number of cells are then a single matrix
+    product with their (groups x cells) spectra.
+    Assumptions, as neither file format is documented here:
+      * The gxs file follows the ENDF-6 layout: six 11 character fields, then MAT, MF and
+        MT in columns 67-75. Each (MAT, MF, MT) section is a reaction; its first record is
+        a HEAD (ZA, AWR, L1, L2=LFS, N1, N2) and its last NGROUPS values are the group
+        cross sections, by decreasing energy as COLL.inp card 7.
+      * The files written by COLLAPS are not rebuilt from scratch. One COLLAPS run gives
+        a template: its real numbers are matched, in library order, to the one-group cross
+        sections, reaction rates or total flux of that run, and only those are rewritten
+        for other cells, keeping their Fortran format.
+    validate() diffs the files written from the template against real COLLAPS outputs,
+    use it before trusting the engine with a new library.
+    By Miguel Magan and Octavio Gonzalez'''
+
+import os
+import re
+import pickle
+import numpy as np
+
+NGROUPS = 211
+COLLAPS_OUTPUTS = ['XSECTION.dat', 'REACTIONS.dat']  # Files of COLLAPS read by ACAB
+FLOAT = re.compile(r'[+-]?\d*\.\d+(?:[EeDd][+-]?\d+|[+-]\d+)')
+MATCH_WINDOW = 64  # Reactions looked ahead when matching a template number
+_LOADED = {}  # Cross sections and templates already loaded by this process
+
+def fortran_float(text):
+    ''' Value of a Fortran or ENDF real: 1.0E-02, 1.0D-02 or 1.0-2'''
+    text = text.strip().upper().replace('D', 'E')
+    if 'E' not in text:
+        text = text[0] + re.sub(r'([+-])', r'E\1', text[1:])
+    return float(text)
+
+def parse_gxs(filename, ngroups=NGROUPS):
+    ''' Reactions (ZA, MT, LFS) and (reactions x ngroups) cross sections of a gxs file'''
+    reactions, xs = [], []
+    section, head, values = None, None, []
+    def close():
+        if section is not None and len(values) >= ngroups:
+            reactions.append((int(head[0]), section[2], int(head[3])))
+            xs.append(values[-ngroups:])
+    with open(filename, 'r', encoding='utf-8', errors='replace') as infile:
+        for line in infile:
+            line = line.rstrip('\n').ljust(75)
+            try:
+                key = (int(line[66:70]), int(line[70:72]), int(line[72:75]))
+            except ValueError:  # Text records
+                continue
+            if key != section:
+                close()
+                # MT 0 are separators, MF 1 the file header
+                section, head, values = (key if key[2] != 0 and key[1] != 1 else None), None, []
+                if section is None:
+                    continue
+            fields = [line[i:i+11] for i in range(0, 66, 11)]
+            if head is None:
+                head = [fortran_float(f) if f.strip() else 0.0 for f in fields]
+                continue
+            values.extend(fortran_float(f) for f in fields if f.strip())
+        close()
+    return np.array(reactions, dtype=int).reshape(-1, 3), np.array(xs, dtype=float).reshape(-1, ngroups)
+
+def group_bounds(filename, ngroups=NGROUPS):
+    ''' Group boundaries (eV, increasing) of a gxs file, from its GENDF header (MF 1, MT 451):
+    a HEAD (ZA, AWR, 0, NZ, -1, NTW) and a LIST (TEMP, 0, NGN, NGG, NW, 0) of NTW title
+    words, NZ dilutions and the NGN+1 boundaries'''
+    records = []
+    with open(filename, 'r', encoding='utf-8', errors='replace') as infile:
+        for line in infile:
+            line = line.rstrip('\n').ljust(75)
+            try:
+                mf, mt = int(line[70:72]), int(line[72:75])
+            except ValueError:
+                continue
+            if (mf, mt) != (1, 451):
+                if records:
+                    break
+                continue
+            for i in range(0, 66, 11):
+                try:
+                    records.append(fortran_float(line[i:i+11]) if line[i:i+11].strip() else 0.0)
+                except (ValueError, IndexError):  # Title words
+                    records.append(0.0)
+    if len(records) < 12:
+        raise ValueError(f'No GENDF header in {filename}')
+    nz, ntw, ngn = int(records[3]), int(records[5]), int(records[8])
+    start = 12 + ntw + nz
+    bounds = np.array(records[start:start + ngn + 1])
+    if ngn != ngroups or np.any(np.diff(bounds) <= 0):
+        raise ValueError(f'No {ngroups} group boundaries in the header of {filename}')
+    return bounds
+
+def load_gxs(filename, cache_dir='gxs_cache', ngroups=NGROUPS):
+    ''' Reactions and memory-mapped cross sections of filename, parsed only the first time
+    and then read from cache_dir'''
+    stat = os.stat(filename)
+    tag = f'{os.path.basename(filename)}_{stat.st_size}_{stat.st_mtime_ns}'
+    if tag in _LOADED:
+        return _LOADED[tag]
+    xsfile = os.path.join(cache_dir, f'{tag}.xs.npy')
+    reacfile = os.path.join(cache_dir, f'{tag}.reactions.npy')
+    if not os.path.isfile(xsfile):
+        print(f'Parsing group cross sections of {filename}')
+        reactions, xs = parse_gxs(filename, ngroups)
+        os.makedirs(cache_dir, exist_ok=True)
+        for name, array in [(reacfile, reactions), (xsfile, xs)]:
+            np.save(f'{name}.tmp.npy', array)
+            os.replace(f'{name}.tmp.npy', name)
+    _LOADED[tag] = np.load(reacfile), np.load(xsfile, mmap_mode='r')
+    return _LOADED[tag]
+
+def group_spectra(spectra, ngroups=NGROUPS):
+    ''' (cells x ngroups) group fluxes by decreasing energy, as COLLAPS takes them, from tally
+    spectra (one per row, or a single one) by increasing energy with the total last'''
+    spectra = np.atleast_2d(spectra)
+    return spectra[:, :ngroups][:, ::-1]
+
+def one_group(xs, spectra):
+    ''' (reactions x cells) one-group cross sections for the (cells x groups) group fluxes:
+    one matrix product for all the cells. Cells without flux get 0'''
+    rates = np.asarray(xs) @ spectra.T
+    total = spectra.sum(axis=1)
+    return np.divide(rates, total, out=np.zeros_like(rates), where=total > 0)
+
+def collapse_all(xs, spectra, chunk=1024):
+    ''' One-group cross sections of many cells, chunk cells per product so that the
+    (reactions x cells) result stays in memory. Yields the first cell and the block'''
+    for start in range(0, len(spectra), chunk):
+        yield start, one_group(xs, spectra[start:start+chunk])
+
+def _float_spec(text):
+    "Width, mantissa digits and exponent style of a template number"
+    mantissa = re.match(r'[+-]?\d*\.(\d+)', text.strip())
+    marker = next((c for c in 'EeDd' if c in text), '')
+    exp_digits = len(re.search(r'(\d+)\s*$', text).group(1))
+    return len(text), len(mantissa.group(1)), marker, exp_digits
+
+def _format(value, spec):
+    "value written as the template number of spec"
+    width, digits, marker, exp_digits = spec
+    mantissa, exponent = f'{value:.{digits}E}'.split('E')
+    if not marker:  # ENDF style, no exponent letter
+        text = f'{mantissa}{int(exponent):+d}'
+    else:
+        text = f'{mantissa}{marker}{exponent[0]}{abs(int(exponent)):0{exp_digits}d}'
+    return text.rjust(width)
+
+def _close(value, target, rtol):
+    return abs(value - target) <= rtol*max(abs(target), 1E-30)
+
+def learn_template(filename, sigma, flux, rtol=1E-3, possible=None):
+    ''' Template of a COLLAPS output file written for one-group cross sections sigma
+    (by reaction) and total flux. Each real number is matched to the flux, or to the
+    cross section or rate (sigma*flux) of the next reactions in library order. Matches
+    must be unambiguous: zeros are never matched, nor are numbers fitting more than one
+    candidate. possible marks the reactions with some non-zero group cross section (all
+    if None). Raises ValueError if a number between the first and last reactions found is
+    left unmatched, or if a possible reaction up to the last one found has no cross
+    section in this cell, since its numbers would keep this cell's values in every other'''
+    with open(filename, 'r', encoding='utf-8', errors='replace') as infile:
+        lines = infile.readlines()
+    fields = []
+    unmatched = []
+    pointer = 0  # The same reaction can be printed more than once, as cross section and rate
+    for nline, line in enumerate(lines):
+        for match in FLOAT.finditer(line):
+            value = fortran_float(match.group())
+            if value == 0:  # Any reaction without cross section, kept as it is
+                continue
+            candidates = [('flux', 0)] if _close(value, flux, rtol) else []
+            for index in range(pointer, min(pointer + MATCH_WINDOW, len(sigma))):
+                if _close(value, sigma[index], rtol):
+                    candidates.append(('xs', index))
+                if _close(value, sigma[index]*flux, rtol):
+                    candidates.append(('rate', index))
+            if len(candidates) != 1:
+                unmatched.append(nline)
+                continue
+            kind, index = candidates[0]
+            fields.append((nline, match.start(), match.end(), _float_spec(match.group()), kind, index))
+            if kind != 'flux':
+                pointer = index
+    reactions = [field for field in fields if field[4] != 'flux']
+    name = os.path.basename(filename)
+    if not reactions and unmatched:
+        raise ValueError(f'{name}: no reaction found, {len(unmatched)} numbers ambiguous or unknown')
+    if reactions:
+        inside = [nline for nline in unmatched if reactions[0][0] <= nline <= reactions[-1][0]]
+        if inside:
+            raise ValueError(f'{name}: {len(inside)} numbers of the reaction block are ambiguous or'
+                             f' unknown, the first in line {inside[0] + 1}')
+        last = max(field[5] for field in reactions)
+        possible = np.ones(len(sigma), dtype=bool) if possible is None else np.asarray(possible)
+        hidden = np.flatnonzero((np.asarray(sigma[:last + 1]) == 0) & possible[:last + 1])
+        if len(hidden):
+            raise ValueError(f'{name}: {len(hidden)} reactions without cross section in the template cell'
+                             f' can have one in others, the first is reaction {hidden[0]}')
+    nmatched = len({field[5] for field in reactions})
+    print(f'{name}: {nmatched} of {len(sigma)} reactions found in the template')
+    return {'lines': lines, 'fields': fields}
+
+def render_template(template, sigma, flux):
+    ''' Text of a COLLAPS output file for one-group cross sections sigma and total flux'''
+    lines = list(template['lines'])
+    # Right to left, so the spans of a line stay valid
+    for nline, start, end, spec, kind, index in reversed(template['fields']):
+        value = flux if kind == 'flux' else sigma[index]*flux if kind == 'rate' else sigma[index]
+        lines[nline] = lines[nline][:start] + _format(value, spec) + lines[nline][end:]
+    return ''.join(lines)
+
+def write_collapsed(templates, xs, spectrum, source, folder='.'):
+    ''' Write the COLLAPS outputs of a cell, from templates (by file name), the memory-mapped
+    cross sections and the tally spectrum of the cell (per source particle)'''
+    sigma = one_group(xs, group_spectra(spectrum))[:, 0]
+    for name, template in templates.items():
+        with open(os.path.join(folder, name), 'w', encoding='utf-8') as outfile:
+            outfile.write(render_template(template, sigma, spectrum[-1]*source))
+
+def load_templates(filename):
+    ''' Templates pickled by MCNP_ACAB_library.native_collapse, loaded once per process'''
+    if filename not in _LOADED:
+        with open(filename, 'rb') as infile:
+            _LOADED[filename] = pickle.load(infile)
+    return _LOADED[filename]
+
+def diff_outputs(ours, reference):
+    ''' Largest relative difference between the real numbers of two files, and the
+    number of them differing by more than the last printed digit'''
+    with open(ours, 'r', encoding='utf-8', errors='replace') as infile:
+        values = [fortran_float(m.group()) for m in FLOAT.finditer(infile.read())]
+    with open(reference, 'r', encoding='utf-8', errors='replace') as infile:
+        matches = list(FLOAT.finditer(infile.read()))
+    ref_values = [fortran_float(m.group()) for m in matches]
+    if len(values) != len(ref_values):
+        return np.inf, abs(len(values) - len(ref_values))
+    worst, ndiff = 0.0, 0
+    for value, ref_value, match in zip(values, ref_values, matches):
+        error = abs(value - ref_value)/max(abs(ref_value), 1E-30)
+        if error > 10**(1 - _float_spec(match.group())[1]):
+            ndiff += 1
+        worst = max(worst, error if ref_value != 0 or value != 0 else 0.0)
+    return worst, ndiff
+
+def validate(templates, xs, spectrum, source, collaps_dir):
+    ''' Diff the files written for a cell against those of COLLAPS in collaps_dir.
+    Returns {file: (largest relative difference, numbers differing)}'''
+    sigma = one_group(xs, group_spectra(spectrum))[:, 0]
+    report = {}
+    for name, template in templates.items():
+        ours = os.path.join(collaps_dir, f'{name}.numpy')
+        with open(ours, 'w', encoding='utf-8') as outfile:
+            outfile.write(render_template(template, sigma, spectrum[-1]*source))
+        report[name] = diff_outputs(ours, os.path.join(collaps_dir, name))
+    return report
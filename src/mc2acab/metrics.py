@@ -0,0 +1,134 @@
+#! /usr/bin/env python
+
+''' Per-stage timing and resource metrics of MCNP_ACAB cells.
+    Each worker process appends JSON lines to its own file in a metrics folder,
+    so no locking is needed. merge() joins them at the end of the campaign and
+    mc2acab-stats reports on the result.
+    By Miguel Magan and Octavio Gonzalez'''
+
+import os
+import sys
+import json
+import time
+import glob
+import socket
+import resource
+from contextlib import contextmanager
+import numpy as np
+
+STAGES = ['material', 'feeds', 'collapse', 'inp5', 'acab', 'parse', 'cleanup']
+
+class CellMetrics:
+    """
+    Wall time, CPU time and child process rusage of the stages of a single cell.
+    The peak RSS of the children is not per stage nor per cell: the kernel only keeps the
+    largest one of all the children of the worker so far, which the record gives as
+    children_peak_rss_kb.
+    """
+    def __init__(self, ncell):
+        self.ncell = ncell
+        self.stages = {}
+        self.info = {}
+
+    @contextmanager
+    def stage(self, name):
+        ''' Context manager timing the stage name. Children rusage includes the
+        external codes (htape3x, COLLAPS, ACAB) run during the stage'''
+        wall0 = time.perf_counter()
+        cpu0 = time.process_time()
+        child0 = resource.getrusage(resource.RUSAGE_CHILDREN)
+        try:
+            yield
+        finally:
+            child1 = resource.getrusage(resource.RUSAGE_CHILDREN)
+            self.stages[name] = {'wall': time.perf_counter() - wall0,
+                                 'cpu': time.process_time() - cpu0,
+                                 'child_utime': child1.ru_utime - child0.ru_utime,
+                                 'child_stime': child1.ru_stime - child0.ru_stime}
+
+    def record(self):
+        ''' Dictionary with the metrics of the cell, as written in the JSON lines'''
+        return {'cell': self.ncell, 'host': socket.gethostname(), 'pid': os.getpid(),
+                'wall': sum(stage['wall'] for stage in self.stages.values()),
+                'children_peak_rss_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+                'stages': self.stages, **self.info}
+
+    def write(self, metrics_dir):
+        ''' Append the record to the file of this worker in metrics_dir'''
+        os.makedirs(metrics_dir, exist_ok=True)
+        filename = os.path.join(metrics_dir,
+                                f'metrics_{socket.gethostname()}_{os.getpid()}.jsonl')
+        with open(filename, 'a', encoding='utf-8') as outfile:
+            outfile.write(json.dumps(self.record()) + '\n')
+
+def merge(metrics_dir='metrics', outfile='metrics.jsonl'):
+    ''' Join the worker files of metrics_dir into outfile. Returns the number of records'''
+    nrecords = 0
+    with open(outfile, 'a', encoding='utf-8') as merged:
+        for filename in sorted(glob.glob(os.path.join(metrics_dir, 'metrics_*.jsonl'))):
+            with open(filename, 'r', encoding='utf-8') as infile:
+                for line in infile:
+                    if line.strip():
+                        merged.write(line if line.endswith('\n') else line + '\n')
+                        nrecords += 1
+            os.remove(filename)
+    return nrecords
+
+def load(infile='metrics.jsonl'):
+    ''' Read the records of a merged metrics file, or of all the worker files
+    if infile is a metrics folder'''
+    if os.path.isdir(infile):
+        filenames = sorted(glob.glob(os.path.join(infile, 'metrics_*.jsonl')))
+    else:
+        filenames = [infile]
+    records = []
+    for filename in filenames:
+        with open(filename, 'r', encoding='utf-8') as datafile:
+            records.extend(json.loads(line) for line in datafile if line.strip())
+    return records
+
+def report(records, nslowest=10, percentiles=(50, 90, 99)):
+    ''' Text report: wall time percentiles per cell and per stage, slowest cells
+    and share of the total time spent in each stage'''
+    if not records:
+        return 'No metrics recorded'
+    walls = np.array([record['wall'] for record in records])
+    stages = [stage for stage in STAGES if any(stage in rec['stages'] for rec in records)]
+    lines = [f'{len(records)} cells, {walls.sum():.1f} s of cell wall time']
+    header = f"{'stage':<10}" + ''.join(f'{"p"+str(p):>10}' for p in percentiles)
+    header += f"{'max':>10}{'cpu':>10}{'child':>10}{'share':>8}"
+    lines.append(header)
+    total_wall = walls.sum()
+    for stage in stages:
+        data = [rec['stages'][stage] for rec in records if stage in rec['stages']]
+        wall = np.array([item['wall'] for item in data])
+        cpu = sum(item['cpu'] for item in data)
+        child = sum(item['child_utime'] + item['child_stime'] for item in data)
+        line = f'{stage:<10}' + ''.join(f'{v:>10.2f}' for v in np.percentile(wall, percentiles))
+        line += f'{wall.max():>10.2f}{cpu:>10.1f}{child:>10.1f}{wall.sum()/total_wall:>8.1%}'
+        lines.append(line)
+    line = f"{'cell':<10}" + ''.join(f'{v:>10.2f}' for v in np.percentile(walls, percentiles))
+    lines.append(line + f'{walls.max():>10.2f}')
+    lines.append(f'Slowest {min(nslowest, len(records))} cells:')
+    for i in np.argsort(walls)[::-1][:nslowest]:
+        slowest = max(records[i]['stages'].items(), key=lambda item: item[1]['wall'])
+        lines.append(f"  cell {records[i]['cell']:<10} {walls[i]:10.2f} s"
+                     f"  (mostly {slowest[0]}: {slowest[1]['wall']:.2f} s)")
+    return '\n'.join(lines)
+
+def main():
+    ''' mc2acab-stats entry point: mc2acab-stats [metrics.jsonl or metrics folder] [-n=slowest]'''
+    infile = 'metrics.jsonl'
+    nslowest = 10
+    for arg in sys.argv[1:]:
+        if arg.startswith('-n='):
+            nslowest = int(arg.split('=')[1])
+        else:
+            infile = arg
+    if not os.path.exists(infile):
+        print(f'{infile} not found')
+        sys.exit(1)
+    print(report(load(infile), nslowest=nslowest))
+
+if __name__ == '__main__':
+    main()
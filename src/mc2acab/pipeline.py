@@ -0,0 +1,151 @@
+#! /usr/bin/env python
+
+''' Staged run of the cells of a campaign, instead of a pool running every step of a
+    cell one after the other. The cells go through three stages, each with its own worker
+    processes, connected by bounded queues:
+        prepare   material, links, feeds (htape3x) and decks    MCNP_ACAB_library.prepare_cell
+        execute   COLLAPS and ACAB                              MCNP_ACAB_library.execute_cell
+        parse     apypa parses, cleanup, journal or cube        MCNP_ACAB_library.parse_cell
+    The stages work on the cell folders as explicit paths and no worker changes its working
+    folder, so the parse of a cell overlaps with the external codes of the next ones. A full
+    queue holds its producers back, which bounds the prepared folders waiting on disk.
+    The depth of the queues is sampled during the run and reported at the end: a queue
+    always empty starves the stage it feeds, one always full has a slow consumer.
+    -pipeline=p,e,s sets the workers of each stage, -pipeline_depth the size of the queues.
+    By Miguel Magan and Octavio Gonzalez'''
+
+import os
+import time
+import queue
+import numpy as np
+from mc2acab import MCNP_ACAB_library as MCNPACAB
+from mc2acab import sharedflux
+
+STAGES = ['prepare', 'execute', 'parse']
+SAMPLE = 1.0  # s between samples of the queue depths
+
+def stage_workers(spec=None, nproc=None):
+    ''' Workers of every stage from -pipeline, p,e,s. By default the nproc cores are
+    shared: an eighth of them (at least one) prepare, as many parse and the rest execute,
+    so only under three cores are oversubscribed'''
+    if spec:
+        workers = [int(count) for count in spec.split(',')]
+        if len(workers) != len(STAGES) or min(workers) < 1:
+            raise ValueError(f'-pipeline needs a positive number of workers for each of {STAGES}')
+        return workers
+    nproc = nproc or os.cpu_count()
+    side = max(1, nproc//8)
+    return [side, max(1, nproc - 2*side), side]
+
+def _work(stage, inbox, outbox, results, remaining, downstream, init_args):
+    "Worker process of stage: take cells from inbox and pass them to outbox or results"
+    sharedflux.init_worker(*init_args)
+    while True:
+        item = inbox.get()
+        if item is None:
+            break
+        n, job = item
+        try:
+            if stage == 'prepare':
+                job = sharedflux.prepare(n)
+                if job.finished:  # Nothing to run
+                    results.put(sharedflux.finish(n, job.outputs))
+                    continue
+            elif stage == 'execute':
+                MCNPACAB.execute_cell(job)
+            else:
+                results.put(sharedflux.finish(n, MCNPACAB.parse_cell(job)))
+                continue
+            outbox.put((n, job))
+        except Exception as e:  # A failed cell must not take down the whole campaign
+            print(f'\033[31m cell {sharedflux.cell_number(n)} failed in {stage}: {e} \033[0m')
+            results.put((n, None, False))
+    # The last worker of the stage to finish closes the next one
+    with remaining.get_lock():
+        remaining.value -= 1
+        last = remaining.value == 0
+    if last and outbox is not None:
+        for _ in range(downstream):
+            outbox.put(None)
+
+class Pipeline:
+    """
+    Worker processes of the stages and the queues between them, used as a context manager.
+    """
+    def __init__(self, workers, depth, context, init_args):
+        self.workers = workers
+        self.depth = depth or workers[1]  # Default, a cell waiting for every ACAB running
+        self.context = context
+        self.init_args = init_args  # Of sharedflux.init_worker
+        self.processes = []
+        self.queues = {}
+        self.remaining = []  # Workers left in every stage, kept here so their shared memory is not reused
+        self.depths = {stage: [] for stage in STAGES[1:]}  # Samples of the queue feeding each stage
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        return False
+
+    def _start(self):
+        "Queues and worker processes of all the stages"
+        self.queues = {'prepare': self.context.Queue()}
+        self.queues.update({stage: self.context.Queue(maxsize=self.depth) for stage in STAGES[1:]})
+        self.results = self.context.Queue()
+        for s, stage in enumerate(STAGES):
+            last = s == len(STAGES) - 1
+            self.remaining.append(self.context.Value('i', self.workers[s]))
+            for _ in range(self.workers[s]):
+                process = self.context.Process(
+                    target=_work, args=(stage, self.queues[stage], None if last else self.queues[STAGES[s+1]],
+                                        self.results, self.remaining[s], 0 if last else self.workers[s+1],
+                                        self.init_args))
+                process.start()
+                self.processes.append(process)
+
+    def run(self, pending):
+        ''' Run the cells pending (tally indexes) through the stages. Yields n, the outputs and
+        whether the cell finished as they do, as sharedflux.run_cell'''
+        self._start()
+        for n in pending:
+            self.queues['prepare'].put((n, None))
+        for _ in range(self.workers[0]):
+            self.queues['prepare'].put(None)
+        missing = set(pending)
+        sampled = 0.0
+        while missing:
+            if time.monotonic() - sampled >= SAMPLE:
+                for stage in self.depths:
+                    self.depths[stage].append(self.queues[stage].qsize())
+                sampled = time.monotonic()
+            try:
+                n, outputs, done = self.results.get(timeout=SAMPLE)
+            except queue.Empty:
+                if any(process.exitcode not in (None, 0) for process in self.processes):
+                    print('\033[31m A pipeline worker died, its cells are failed \033[0m')
+                    break
+                continue
+            missing.discard(n)
+            yield n, outputs, done
+        for n in sorted(missing):
+            yield n, None, False
+        if not missing:
+            for process in self.processes:
+                process.join()
+
+    def report(self):
+        ''' Text with the workers of every stage and the depths of the queues feeding them'''
+        lines = [f"Pipeline workers: {', '.join(f'{stage} {count}' for stage, count in zip(STAGES, self.workers))},"
+                 f' queues of {self.depth}']
+        for stage, samples in self.depths.items():
+            if not samples:
+                continue
+            samples = np.array(samples)
+            lines.append(f'  waiting for {stage}: mean {samples.mean():.1f}, max {samples.max()},'
+                         f' empty {np.mean(samples == 0):.0%}, full {np.mean(samples >= self.depth):.0%} of the time')
+        return '\n'.join(lines)
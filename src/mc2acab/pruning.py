@@ -0,0 +1,89 @@
+#! /usr/bin/env python
+
+''' Pruning of the initial nuclides of a cell before ACAB.
+    unfold_NA gives every natural isotope, down to traces that add nothing but inventory
+    to ACAB. The activation potential of a nuclide is its atomic density times its total
+    one-group cross section in the cell spectrum, summed over all its reactions; nuclides
+    whose share of the total potential of the cell is under the bound (-prune) are dropped.
+    Radioactive nuclides and those without cross sections are always kept. What is removed
+    is written in pruned.txt of the cell folder, and verify() compares pruned and unpruned
+    runs of some cells (-prune_check).
+    By Miguel Magan and Octavio Gonzalez'''
+
+import os
+import time
+import numpy as np
+from mc2acab import groupxs
+from mc2acab import bateman
+from mc2acab import adaptive
+
+_LOADED = {}  # Radioactive nuclides of every decay file, read once per process
+
+def potentials(reactions, sigma):
+    ''' {zai: total one-group cross section (b)} from the one-group cross sections sigma of
+    the reactions (ZA, MT, LFS) of groupxs.load_gxs'''
+    targets, inverse = np.unique(reactions[:, 0], return_inverse=True)
+    total = np.zeros(len(targets))
+    np.add.at(total, inverse, sigma)
+    return {int(za)*10: float(value) for za, value in zip(targets, total)}
+
+def radioactive(decay_file):
+    ''' zai of the nuclides with a decay constant in decay_file'''
+    if decay_file not in _LOADED:
+        _LOADED[decay_file] = {zai for zai, data in bateman.read_decay(decay_file).items()
+                               if data['lambda'] > 0}
+    return _LOADED[decay_file]
+
+def prune(zaid, frac, sigma_total, bound, keep=()):
+    ''' Split the nuclides zaid (zai) of densities frac in those kept and those removed,
+    whose share of the activation potential is under bound. Returns the kept zaid and frac
+    and the removed (zai, density, share)'''
+    weights = np.array([f*sigma_total.get(z, 0.0) for z, f in zip(zaid, frac)])
+    total = weights.sum()
+    kept_zaid, kept_frac, removed = [], [], []
+    for zai, density, weight in zip(zaid, frac, weights):
+        share = weight/total if total > 0 else 1.0
+        if share < bound and zai in sigma_total and zai not in keep:
+            removed.append((zai, density, share))
+        else:
+            kept_zaid.append(zai)
+            kept_frac.append(density)
+    return kept_zaid, kept_frac, removed
+
+def prune_cell(mater, spectrum, xsfile, bound, cache_dir='gxs_cache', record='pruned.txt'):
+    ''' Prune in place the unfolded material mater of a cell of tally spectrum, with the
+    group cross sections of xsfile, and write what is removed in record.
+    Returns the number of nuclides removed'''
+    reactions, xs = groupxs.load_gxs(xsfile, cache_dir)
+    sigma = groupxs.one_group(xs, groupxs.group_spectra(spectrum))[:, 0]
+    keep = radioactive(os.environ['ACAB_LB_PATH'] + 'DECAY.dat')
+    kept_zaid, kept_frac, removed = prune(mater.zaid, mater.frac, potentials(reactions, sigma), bound, keep)
+    mater.zaid[:], mater.frac[:] = kept_zaid, kept_frac
+    with open(record, 'w', encoding='utf-8') as outfile:
+        outfile.write(f'# Nuclides with an activation potential share under {bound:.1e}\n')
+        outfile.write('# zai density(at/b-cm) share\n')
+        for zai, density, share in removed:
+            outfile.write(f'{zai} {density:.6e} {share:.3e}\n')
+    return len(removed)
+
+def verify(run_cell, cells, tolerance=0.01):
+    ''' Compare the outputs of cells run pruned and unpruned. run_cell(n, pruned) runs cell n
+    and returns its outputs. Returns whether all deviations are within tolerance and the
+    text of the comparison'''
+    lines = []
+    worst = 0.0
+    for n in cells:
+        start = time.perf_counter()
+        reference = run_cell(n, False)
+        ref_wall = time.perf_counter() - start
+        start = time.perf_counter()
+        outputs = run_cell(n, True)
+        wall = time.perf_counter() - start
+        if reference is None or outputs is None:
+            continue
+        deviation = adaptive.output_deviation(outputs, reference)
+        worst = max(worst, deviation)
+        lines.append(f'Tally cell {n}: pruned deviation {deviation:.2%}, {wall:.1f} s instead of {ref_wall:.1f} s')
+    lines.append(f'Largest deviation of the pruned runs: {worst:.2%}'
+                 + ('' if worst <= tolerance else f', over {tolerance:.2%}, pruning disabled'))
+    return worst <= tolerance, '\n'.join(lines)
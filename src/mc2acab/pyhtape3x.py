@@ -22,16 +22,18 @@ def createRSH(cell, RSHfile="RSH"):
 def create_composedRSH(acell, pcell, RSHfile="RSH"):
     """
     Create a RSH cell for a composed analysis for rotating elements.
-    Passivecell is the matching cell of the passive sector
-    n1 is the number of elements, and n2 is the volume ratio (passive/active)
+    acell are the cells of the active sector and pcell the matching ones of the passive
+    sector, single cells or lists of them
     """
+    cells = [cell for cell_list in (acell, pcell)
+             for cell in (cell_list if isinstance(cell_list, (list, tuple)) else [cell_list])]
     with open (RSHfile,"w", encoding="UTF-8") as RSH:
         RSH.write("Entrada de residuos para HTAPE3X\n")
-        line="Calculo en las celdas "+str(acell)+" y "+str(pcell) +"\n"
+        line="Calculo en las celdas "+" y ".join(str(cell) for cell in cells) +"\n"
         RSH.write(line)
 #            IOPT, NERG, NTIM, NTYPE, KOPT, NPARM, NFPRM, FNORM, KPLOT,IXOUT, IRS, IMERGE, ITCONV, IRSP, ITMULT/
-        RSH.write("8,0,0,0,0,2,0,0,0,0,0,0,0,0,0,0,0\n")
-        line=str(acell)+","+str(pcell)+'\n'
+        RSH.write(f"8,0,0,0,0,{len(cells)},0,0,0,0,0,0,0,0,0,0,0\n")
+        line=",".join(str(cell) for cell in cells)+'\n'
         RSH.write(line)
 
 def get_atom_feed(cell, Resfile):
@@ -64,7 +66,7 @@ def get_atom_feeds(cells, Resfile):
                     continue
                 sline[idx] = i
                 found[idx] = True
-            if re.findall("all z", lines) and found[idx]:
+            if re.findall("all z", lines) and idx is not None and found[idx]:
                 eline[idx] = i+1
             if re.findall("metastable state", lines):
                 print ("metastable isotopes found")
@@ -72,7 +74,8 @@ def get_atom_feeds(cells, Resfile):
                     lines = next(htape3xfile, "end")
                     inputstr2.append(lines)
         htape3xfile.seek(0, 0)
-        inputstrs = [htape3xfile.readlines()[sl:el] for sl, el in zip (sline, eline)]
+        alllines = htape3xfile.readlines()
+        inputstrs = [alllines[sl:el] for sl, el in zip (sline, eline)]
         residuals = [__readfeed(inputstr) for inputstr in inputstrs]
     residuals = __addmetastable(residuals, inputstr2)
     if residuals==[]:
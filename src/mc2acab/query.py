@@ -0,0 +1,308 @@
+#! /usr/bin/env python
+
+''' Campaign-wide queries over the results of MCNP_ACAB, from cube/ or summary_apypas.npy.
+    Results are kept as arrays: values (cell, slot, time) and the label of every
+    (cell, slot), which is turned once into an index over the nuclides (or gamma groups) of
+    the whole campaign. summary_apypas.npy, whose cells have any number of nuclides, is
+    read into the (cell, nuclide) entries of every cell instead. Every query is then a few
+    NumPy operations over all the cells, in chunks of CHUNK cells:
+        nuclide_totals    sum over cells of every nuclide, np.bincount of the index
+        top               top N nuclides of the campaign, np.argpartition
+        top_per_cell      top N nuclides of every cell
+        nuclide           one nuclide in every cell
+        group_totals      totals by cell group (material, density or any key per cell)
+    The quantities given per cm3 are volume weighted in the sums over cells.
+    The cube keeps the largest nuclides of a cell that has more than its slots, so the
+    nuclide values of the truncated cells are understated: every answer reports them.
+    summary_apypas.npy has no material or density of the cells, from_apypas takes them
+    from the run; without them the groups by material or density are refused.
+    mc2acab-query -quantity=dose -time=s [-top=n] [-nuclide=Co60] [-by=material]
+    By Miguel Magan and Octavio Gonzalez'''
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+from mc2acab import resultcube
+from mc2acab import clustering
+
+CHUNK = 4096  # Cells read at once
+EXTENSIVE = dict(zip(resultcube.QUANTITIES, clustering.EXTENSIVE))  # Totals of the zone, not per cm3
+
+class Entries:
+    """
+    Nuclides of a quantity stored cell by cell: the entries offsets[n]:offsets[n+1] are
+    those of the n-th cell, nuclide being their index into names and values (entries x
+    times) their values. Only the nuclides each cell has take room.
+    """
+    def __init__(self, names, offsets, nuclide, values):
+        self.names = names
+        self.offsets = np.asarray(offsets, dtype=int)
+        self.nuclide = np.asarray(nuclide, dtype=int)
+        self.values = values
+
+class Campaign:
+    """
+    Results of a campaign as arrays, see the module documentation. values of a quantity are
+    (cells x slots x times) with its labels (cells x slots), as in the cube, or Entries.
+    truncated are the nuclides dropped from every cell by quantity, when there were more
+    than slots; their values are then understated, the totals are exact.
+    """
+    def __init__(self, cells, vol, density, material, times, labels, values, total, names=None,
+                 truncated=None):
+        self.cells = np.asarray(cells)
+        self.vol = np.asarray(vol, dtype=float)
+        self.density = None if density is None else np.asarray(density, dtype=float)
+        self.material = None if material is None else np.asarray(material)
+        self.times = np.asarray(times, dtype=float)
+        self.labels = labels  # {quantity: (cells x slots)}, None for Entries
+        self.values = values  # {quantity: (cells x slots x times) or Entries}
+        self.total = total  # {quantity: (cells x times)}
+        self.names = names or {q: q for q in resultcube.QUANTITIES}  # Units of each quantity
+        self.truncated = truncated or {q: np.zeros(len(self.cells), dtype=int) for q in resultcube.QUANTITIES}
+        self._index = {}
+
+    @classmethod
+    def open(cls, folder='.'):
+        ''' Campaign of folder, from its cube if it has one, else from summary_apypas.npy'''
+        cube = resultcube.open_cube(os.path.join(folder, 'cube'))
+        if cube is not None:
+            return cls.from_cube(cube)
+        return cls.from_apypas(np.load(os.path.join(folder, 'summary_apypas.npy'), allow_pickle=True))
+
+    @classmethod
+    def from_cube(cls, cube):
+        ''' Campaign on the memmaps of a resultcube.ResultCube, nothing is copied'''
+        first = cube.first_done()
+        times = cube.cell_times(first) if first is not None else []
+        names = {q: cube.names[iq].decode() for iq, q in enumerate(resultcube.QUANTITIES)}
+        return cls(cube.cells, cube.vol, cube.density, cube.material, times, cube.labels,
+                   {q: cube.values[q][:, :, :len(times)] for q in resultcube.QUANTITIES},
+                   {q: cube.total[q][:, :len(times)] for q in resultcube.QUANTITIES}, names,
+                   {q: cube.truncated[:, iq] for iq, q in enumerate(resultcube.QUANTITIES)})
+
+    @classmethod
+    def from_apypas(cls, apypas, density=None, material=None):
+        ''' Campaign of the records of summary_apypas.npy, copied into Entries. The density
+        and material of every cell are not in them, unknown if not given'''
+        tables = [tuple(row)[2:] if isinstance(row[2], pd.DataFrame) else None for row in apypas]
+        first = next((outputs for outputs in tables if outputs is not None), None)
+        times = list(first[0].index) if first is not None else []
+        values, total, names = {}, {}, {}
+        for iq, quantity in enumerate(resultcube.QUANTITIES):
+            # As in the cube, times by rows for all of them
+            per_cell = [None if outputs is None else
+                        (outputs[iq].T if quantity == 'gamma' else outputs[iq]) for outputs in tables]
+            labels, offsets, nuclide, blocks = {}, [0], [], []
+            total[quantity] = np.zeros((len(tables), len(times)))
+            for n, table in enumerate(per_cell):
+                if table is not None:
+                    names[quantity] = str(table.columns.name)
+                    columns = [label for label in table.columns if label != 'Total']
+                    nuclide.extend(labels.setdefault(str(label), len(labels)) for label in columns)
+                    blocks.append(table[columns].to_numpy(dtype=float).T[:, :len(times)])
+                    total[quantity][n] = table['Total'].to_numpy(dtype=float)[:len(times)]
+                offsets.append(len(nuclide))
+            data = np.zeros((len(nuclide), len(times)))
+            row = 0
+            for block in blocks:
+                data[row:row+len(block), :block.shape[1]] = block
+                row += len(block)
+            # Sorted names, as those of the cube
+            order = np.argsort(list(labels))
+            rank = np.empty(len(order), dtype=int)
+            rank[order] = np.arange(len(order))
+            values[quantity] = Entries([list(labels)[i] for i in order], offsets,
+                                       rank[np.asarray(nuclide, dtype=int)], data)
+        return cls(apypas['cell'], apypas['vol'].astype(float), density, material,
+                   times, None, values, total, names)
+
+    def index(self, quantity):
+        ''' Names of the nuclides (or groups) of quantity in the campaign and the (cells x
+        slots) index of every slot into them, -1 if unused, None for Entries. Built once'''
+        if quantity not in self._index:
+            if isinstance(self.values[quantity], Entries):
+                self._index[quantity] = (self.values[quantity].names, None)
+                return self._index[quantity]
+            labels = np.asarray(self.labels[quantity])
+            names, inverse = np.unique(labels, return_inverse=True)
+            inverse = inverse.reshape(labels.shape)
+            if len(names) and names[0] == b'':  # Unused slots
+                names, inverse = names[1:], inverse - 1
+            self._index[quantity] = ([name.decode() for name in names], inverse)
+        return self._index[quantity]
+
+    def entries(self, quantity, start, stop, columns=None):
+        ''' Cell indexes, nuclide indexes (into the names of index) and (entries x columns)
+        values of the nuclides of quantity in the cells start to stop, at the time columns
+        (all if None)'''
+        stop = min(stop, len(self.cells))
+        columns = slice(None) if columns is None else list(columns)
+        values = self.values[quantity]
+        if isinstance(values, Entries):
+            first, last = values.offsets[start], values.offsets[stop]
+            cells = np.repeat(np.arange(start, stop), np.diff(values.offsets[start:stop+1]))
+            return cells, values.nuclide[first:last], np.asarray(values.values[first:last])[:, columns]
+        _, index = self.index(quantity)
+        slots = index[start:stop]
+        cells, used = np.nonzero(slots >= 0)
+        block = np.asarray(values[start:stop][:, :, columns])
+        return cells + start, slots[cells, used], block[cells, used]
+
+    def time_index(self, time):
+        ''' Column of the output time closest to time (s)'''
+        return int(np.argmin(np.abs(self.times - time)))
+
+    def _cells(self, cells):
+        "Boolean mask of cells, a mask, cell indexes or None for all of them"
+        if cells is None:
+            return np.ones(len(self.cells), dtype=bool)
+        cells = np.asarray(cells)
+        if cells.dtype == bool:
+            return cells
+        mask = np.zeros(len(self.cells), dtype=bool)
+        mask[cells] = True
+        return mask
+
+    def dropped(self, quantity, cells=None):
+        ''' Number of cells (all or the mask/indexes cells) with nuclides of quantity dropped
+        for the lack of slots, and of the nuclides dropped from them'''
+        truncated = np.asarray(self.truncated[quantity])[self._cells(cells)]
+        return int(np.count_nonzero(truncated)), int(truncated.sum())
+
+    def nuclide_totals(self, quantity, time, cells=None):
+        ''' Sum over cells (all or the mask/indexes cells) of every nuclide of quantity at time,
+        of value*volume for the quantities per cm3. Returns a Series by nuclide, with the
+        dropped (cells, nuclides) of those cells in its attrs['truncated']'''
+        names, _ = self.index(quantity)
+        t = self.time_index(time)
+        mask = self._cells(cells)
+        totals = np.zeros(len(names))
+        for start in range(0, len(self.cells), CHUNK):
+            if not mask[start:start+CHUNK].any():
+                continue
+            rows, nuclides, values = self.entries(quantity, start, start + CHUNK, [t])
+            keep = mask[rows]
+            values = values[keep, 0]
+            if not EXTENSIVE[quantity]:
+                values = values*self.vol[rows[keep]]
+            totals += np.bincount(nuclides[keep], weights=values, minlength=len(names))
+        units = self.names[quantity] if EXTENSIVE[quantity] else f'{self.names[quantity]}*cm3'
+        result = pd.Series(totals, index=names, name=f'{quantity} ({units}) at {self.times[t]:.3e} s')
+        result.attrs['truncated'] = self.dropped(quantity, mask)
+        return result
+
+    def top(self, quantity, time, n=10, cells=None):
+        ''' The n nuclides with the largest sum over cells of quantity at time, volume
+        weighted as nuclide_totals, with its attrs['truncated']'''
+        totals = self.nuclide_totals(quantity, time, cells)
+        if len(totals) <= n:
+            result = totals.sort_values(ascending=False)
+        else:
+            best = np.argpartition(-totals.to_numpy(), n)[:n]
+            result = totals.iloc[best].sort_values(ascending=False)
+        result.attrs['truncated'] = totals.attrs['truncated']
+        return result
+
+    def top_per_cell(self, quantity, time, n=10):
+        ''' (cells x n) names and values of the n largest nuclides of every cell at time,
+        largest first, '' and 0 past the nuclides of a cell. The truncated of the cells
+        tell which ones may miss some'''
+        t = self.time_index(time)
+        names, _ = self.index(quantity)
+        names = np.array(names + [''])
+        top_names = np.full((len(self.cells), n), '', dtype=names.dtype)
+        top_values = np.zeros((len(self.cells), n))
+        for start in range(0, len(self.cells), CHUNK):
+            rows, nuclides, values = self.entries(quantity, start, start + CHUNK, [t])
+            order = np.lexsort((-values[:, 0], rows))  # By cell, largest first
+            rows, nuclides, values = rows[order], nuclides[order], values[order, 0]
+            rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+            keep = rank < n
+            top_names[rows[keep], rank[keep]] = names[nuclides[keep]]
+            top_values[rows[keep], rank[keep]] = values[keep]
+        return top_names, top_values
+
+    def nuclide(self, quantity, name):
+        ''' (cells x times) DataFrame of nuclide name in every cell, with the dropped
+        (cells, nuclides) of the campaign in its attrs['truncated']'''
+        names, _ = self.index(quantity)
+        result = np.zeros((len(self.cells), len(self.times)))
+        if name in names:
+            wanted = names.index(name)
+            for start in range(0, len(self.cells), CHUNK):
+                rows, nuclides, values = self.entries(quantity, start, start + CHUNK)
+                hit = nuclides == wanted
+                result[rows[hit]] = values[hit]
+        frame = pd.DataFrame(result, index=self.cells, columns=self.times)
+        frame.attrs['truncated'] = self.dropped(quantity)
+        return frame
+
+    def group_totals(self, quantity, by='material', time=None):
+        ''' Totals of quantity by cell group at time (all times if None), the groups being
+        by material, density or given as a key per cell. Quantities per cm3 are volume
+        weighted: the sum of value*volume and the mean over the volume of the group are given.
+        They come from the totals, which are never truncated'''
+        if isinstance(by, str):
+            if by not in ('material', 'density'):
+                raise ValueError(f'Cells are grouped by material, density or a key per cell, not {by}')
+            keys = {'material': self.material, 'density': self.density}[by]
+        else:
+            keys = by
+        if keys is None:
+            raise ValueError(f'The {by} of the cells is unknown, it is only stored with -cube')
+        groups, inverse = np.unique(np.asarray(keys), return_inverse=True)
+        columns = range(len(self.times)) if time is None else [self.time_index(time)]
+        total = np.asarray(self.total[quantity])
+        frame = {}
+        group_vol = np.bincount(inverse, weights=self.vol, minlength=len(groups))
+        for t in columns:
+            if EXTENSIVE[quantity]:
+                frame[self.times[t]] = np.bincount(inverse, weights=total[:, t], minlength=len(groups))
+            else:
+                integral = np.bincount(inverse, weights=total[:, t]*self.vol, minlength=len(groups))
+                frame[(self.times[t], 'integral')] = integral
+                frame[(self.times[t], 'mean')] = np.divide(integral, group_vol, out=np.zeros_like(integral),
+                                                          where=group_vol > 0)
+        result = pd.DataFrame(frame, index=groups)
+        result.index.name = by if isinstance(by, str) else 'group'
+        result.insert(0, 'vol', group_vol)
+        return result
+
+def main():
+    ''' mc2acab-query entry point, see the module documentation'''
+    quantity, time, ntop, name, by = 'dose', None, None, None, None
+    for arg in sys.argv[1:]:
+        if arg.startswith('-quantity='):
+            quantity = arg.split('=')[1]
+        elif arg.startswith('-time='):
+            time = float(arg.split('=')[1])
+        elif arg.startswith('-top='):
+            ntop = int(arg.split('=')[1])
+        elif arg.startswith('-nuclide='):
+            name = arg.split('=')[1]
+        elif arg.startswith('-by='):
+            by = arg.split('=')[1]
+    if quantity not in resultcube.QUANTITIES or (ntop is None and name is None and by is None):
+        print(__doc__)
+        sys.exit(1)
+    campaign = Campaign.open('.')
+    if by in ('material', 'density') and getattr(campaign, by) is None:
+        print(f'summary_apypas.npy has no {by} of the cells, group them by {by} from a -cube run')
+        sys.exit(1)
+    time = campaign.times[0] if time is None else time
+    ncells, nuclides = campaign.dropped(quantity)
+    truncated = (f'{ncells} cells had more nuclides than the cube slots, {nuclides} nuclides of them'
+                 ' are missing from these values, the totals are exact' if ncells else '')
+    if ntop is not None:
+        print(campaign.top(quantity, time, ntop).to_string())
+        print(truncated)
+    if name is not None:
+        print(campaign.nuclide(quantity, name).sum(axis=0).to_string())
+        print(truncated)
+    if by is not None:
+        print(campaign.group_totals(quantity, by, time).to_string())
+        print(f'{ncells} cells truncated, their totals are exact' if ncells else '')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#! /usr/bin/env python
+
+''' Rebinning of tally spectra onto the VITAMIN-J+ groups of ACAB.
+    One sparse overlap matrix (VITAMIN-J+ groups x tally groups) gives the fraction of the
+    flux of each tally group falling into each VITAMIN-J+ group, assuming the flux of a
+    tally group flat in lethargy (default) or in energy. Every column adds up to 1, so the
+    total flux is conserved: tally flux beyond the VITAMIN-J+ range goes to its edge groups.
+    All the cells are then rebinned with a single sparse product.
+    The VITAMIN-J+ boundaries are read from the GENDF header of the EAF group cross
+    sections, or from a file of boundaries in MeV (-group_bounds).
+    By Miguel Magan and Octavio Gonzalez'''
+
+import numpy as np
+from scipy import sparse
+from mc2acab import groupxs
+
+WEIGHTINGS = ['lethargy', 'flat']
+
+def read_bounds(filename):
+    ''' Group boundaries (MeV, increasing) of a file with them, in any order and layout'''
+    with open(filename, 'r', encoding='utf-8') as infile:
+        return np.unique([float(token) for token in infile.read().split()])
+
+def vitj_bounds(gxsfile, bounds_file=None, ngroups=groupxs.NGROUPS):
+    ''' VITAMIN-J+ boundaries in MeV, from bounds_file if given, else from gxsfile'''
+    bounds = read_bounds(bounds_file) if bounds_file is not None else groupxs.group_bounds(gxsfile)/1E6
+    if len(bounds) != ngroups + 1:
+        raise ValueError(f'{len(bounds)} group boundaries, {ngroups + 1} expected')
+    return bounds
+
+def tally_bounds(ebins, ngroups):
+    ''' Boundaries of the ngroups groups of a tally: its ebins are the upper bounds, the
+    first group starting at 0, or all of them'''
+    ebins = np.asarray(ebins, dtype=float)
+    if len(ebins) == ngroups:
+        return np.concatenate([[0.0], ebins])
+    if len(ebins) == ngroups + 1:
+        return ebins
+    raise ValueError(f'{len(ebins)} energy bins for {ngroups} groups')
+
+def _width(low, high, weighting):
+    "Width of [low, high] in energy or lethargy"
+    return np.log(high/low) if weighting == 'lethargy' else high - low
+
+def overlap_matrix(source, target, weighting='lethargy'):
+    ''' Sparse (target groups x source groups) fractions of the flux of every source group
+    in every target group, source and target being increasing boundaries. The source groups
+    are clipped to the target range, so its columns add up to 1 and the flux is conserved'''
+    if weighting not in WEIGHTINGS:
+        raise ValueError(f'Unknown weighting {weighting}, use one of {WEIGHTINGS}')
+    source = np.asarray(source, dtype=float)
+    target = np.asarray(target, dtype=float)
+    rows, cols, data = [], [], []
+    for j, (low, high) in enumerate(zip(source[:-1], source[1:])):
+        if high <= target[0]:  # Below the target range, all to its first group
+            rows.append(0), cols.append(j), data.append(1.0)
+            continue
+        if low >= target[-1]:  # Above, all to its last group
+            rows.append(len(target) - 2), cols.append(j), data.append(1.0)
+            continue
+        low, high = max(low, target[0]), min(high, target[-1])
+        first = np.searchsorted(target, low, side='right') - 1
+        last = np.searchsorted(target, high, side='left') - 1
+        width = _width(low, high, weighting)
+        for i in range(first, last + 1):
+            part = _width(max(low, target[i]), min(high, target[i+1]), weighting)
+            if part > 0:
+                rows.append(i), cols.append(j), data.append(part/width)
+    return sparse.csr_matrix((data, (rows, cols)), shape=(len(target) - 1, len(source) - 1))
+
+def rebin(spectra, matrix):
+    ''' (cells x target groups+1) spectra, total last, from the (cells x source groups+1)
+    spectra with one sparse product. The totals are kept'''
+    spectra = np.atleast_2d(np.asarray(spectra, dtype=float))
+    groups = (matrix @ spectra[:, :-1].T).T
+    return np.hstack([groups, spectra[:, -1:]])
+
+def is_vitj(ebins, ngroups, bounds, rtol=1E-4):
+    ''' Whether the tally groups are already the VITAMIN-J+ ones'''
+    if ngroups != len(bounds) - 1:
+        return False
+    upper = tally_bounds(ebins, ngroups)[1:]
+    return bool(np.allclose(upper, bounds[1:], rtol=rtol))
+
+def rebin_tally(tally0, gxsfile, weighting='lethargy', bounds_file=None):
+    ''' Rebin the spectra of tally0 onto VITAMIN-J+ in place, unless they already are.
+    Returns whether they were rebinned'''
+    bounds = vitj_bounds(gxsfile, bounds_file)
+    spectra = np.asarray(tally0.value[:, 0, 0, 0, :], dtype=float)
+    ngroups = spectra.shape[1] - 1
+    if is_vitj(tally0.ebins, ngroups, bounds):
+        return False
+    matrix = overlap_matrix(tally_bounds(tally0.ebins, ngroups), bounds, weighting)
+    tally0.value = rebin(spectra, matrix)[:, None, None, None, :]
+    tally0.ebins = list(bounds[1:])
+    print(f'Tally spectra rebinned from {ngroups} groups onto the {len(bounds) - 1} VITAMIN-J+ groups,'
+          f' {weighting} weighting')
+    return True
@@ -0,0 +1,184 @@
+#! /usr/bin/env python
+
+''' Decay-only re-evaluation of a finished campaign at new cooling times, without ACAB.
+    The shutdown inventory of every cell is its stored mol table (cube/ or
+    summary_apypas.npy) at the first output time, or at -from, which must be one of the
+    output times, and the new cooling times are counted from it. The decay data are read
+    from DECAY.dat of ACAB_LB_PATH, and one
+    decay matrix over all the nuclides of the campaign and their daughters is exponentiated
+    once per new cooling time. Each exponential then takes every cell with a single
+    (nuclides x cells) product.
+    Activity and decay heat come from the decay data. The contact dose of a nuclide is its
+    dose per Bq in the stored tables. Nuclides without a stored dose take the gamma power
+    of the library times the dose per gamma power of their cell.
+    Only the nuclides kept by the apypa threshold (-threshold) are in the mol tables, so
+    nuclides fed only by the dropped ones are missing.
+    mc2acab-decay -decay_times=s,s [-from=s]
+    By Miguel Magan and Octavio Gonzalez'''
+
+import os
+import re
+import sys
+import numpy as np
+import pandas as pd
+from scipy.linalg import expm
+from mc2acab import bateman
+from mc2acab import resultcube
+
+AVOGADRO = 6.02214076E23
+CHUNK = 1024  # Cells evaluated at once
+ELEMENTS = ('H He Li Be B C N O F Ne Na Mg Al Si P S Cl Ar K Ca Sc Ti V Cr Mn Fe Co Ni Cu Zn '
+            'Ga Ge As Se Br Kr Rb Sr Y Zr Nb Mo Tc Ru Rh Pd Ag Cd In Sn Sb Te I Xe Cs Ba La Ce '
+            'Pr Nd Pm Sm Eu Gd Tb Dy Ho Er Tm Yb Lu Hf Ta W Re Os Ir Pt Au Hg Tl Pb Bi Po At Rn '
+            'Fr Ra Ac Th Pa U Np Pu Am Cm Bk Cf Es Fm Md No Lr Rf Db Sg Bh Hs Mt Ds Rg Cn Nh Fl '
+            'Mc Lv Ts Og').split()
+TIME_RTOL = 1E-3  # Relative distance of -from to a stored time
+LABEL = re.compile(r'^\s*([A-Za-z]{1,2})\s*[-_]?\s*0*(\d{1,3})\s*([mMnN]?)\s*$')
+
+def label_zai(label):
+    ''' zai of a nuclide label as the apypa tables give them (Co60, CO 60m, Co-60...),
+    None if it is not one'''
+    match = LABEL.match(str(label))
+    if match is None or match.group(1).capitalize() not in ELEMENTS:
+        return None
+    z = ELEMENTS.index(match.group(1).capitalize()) + 1
+    state = {'': 0, 'm': 1, 'n': 2}[match.group(3).lower()]
+    return (z*1000 + int(match.group(2)))*10 + state
+
+def _row(table, time):
+    "Values of the row of table (times by rows) at time, by nuclide label"
+    index = np.asarray(table.index, dtype=float)
+    closest = int(np.argmin(np.abs(index - time)))
+    if abs(index[closest] - time) > TIME_RTOL*max(abs(time), 1.0):
+        raise ValueError(f'No output at {time:.4e} s, the closest one is {index[closest]:.4e} s')
+    return table.iloc[closest].drop('Total', errors='ignore')
+
+def decay_system(decay, initial):
+    ''' Nuclides reachable by decay from initial (zai) and their dense decay matrix'''
+    nuclides = set(initial)
+    front = list(initial)
+    while front:
+        for child in decay.get(front.pop(), {}).get('daughters', {}):
+            if child not in nuclides:
+                nuclides.add(child)
+                front.append(child)
+    zai = sorted(nuclides)
+    index = {z: i for i, z in enumerate(zai)}
+    matrix = np.zeros((len(zai), len(zai)))
+    for z in zai:
+        lam = decay.get(z, {}).get('lambda', 0.0)
+        if not lam:
+            continue
+        matrix[index[z], index[z]] -= lam
+        for daughter, branching in decay[z]['daughters'].items():
+            matrix[index[daughter], index[z]] += lam*branching
+    return zai, matrix
+
+def shutdown_inventories(tables, ref_time=None):
+    ''' Atoms by zai of every cell at ref_time (the first output time if None) and the dose
+    per Bq of its nuclides. tables are the MCNP_ACAB_Map outputs of every cell, None for
+    those without'''
+    inventories, dose_per_bq = [], []
+    unknown = set()
+    for outputs in tables:
+        if outputs is None:
+            inventories.append({})
+            dose_per_bq.append({})
+            continue
+        decay_table, _, _, dose_table, mol_table = outputs
+        time = float(min(mol_table.index)) if ref_time is None else ref_time
+        inventory, coefficients = {}, {}
+        for label, mol in _row(mol_table, time).items():
+            zai = label_zai(label)
+            if zai is None:
+                unknown.add(label)
+                continue
+            inventory[zai] = inventory.get(zai, 0.0) + float(mol)*AVOGADRO
+        activity, dose = _row(decay_table, time), _row(dose_table, time)
+        for label in dose.index:
+            zai = label_zai(label)
+            if zai is not None and label in activity.index and float(activity[label]) > 0:
+                coefficients[zai] = float(dose[label])/float(activity[label])
+        inventories.append(inventory)
+        dose_per_bq.append(coefficients)
+    if unknown:
+        print(f'{len(unknown)} labels of the mol tables are not nuclides and were ignored: {sorted(unknown)[:10]}')
+    return inventories, dose_per_bq
+
+def evaluate(decay, inventories, dose_per_bq, vol, cooling_times):
+    ''' Activity (Bq), decay heat (W/cm3), gamma power (W/cm3) and dose (mSv/h) of the
+    cells (cells x times) at cooling_times (s after the reference time)'''
+    initial = sorted({zai for inventory in inventories for zai in inventory})
+    zai, matrix = decay_system(decay, initial)
+    index = {z: i for i, z in enumerate(zai)}
+    lam = np.array([decay.get(z, {}).get('lambda', 0.0) for z in zai])
+    heat = np.array([decay.get(z, {}).get('heat', 0.0) for z in zai])*bateman.EV
+    gamma = np.array([decay.get(z, {}).get('gamma', 0.0) for z in zai])*bateman.EV
+    propagators = [expm(matrix*time) for time in cooling_times]  # Once for all the cells
+    ncells = len(inventories)
+    results = [np.zeros((ncells, len(cooling_times))) for _ in range(4)]
+    for start in range(0, ncells, CHUNK):
+        cells = range(start, min(ncells, start + CHUNK))
+        atoms0 = np.zeros((len(zai), len(cells)))
+        known = np.zeros((len(zai), len(cells)), dtype=bool)
+        coefficient = np.zeros((len(zai), len(cells)))
+        for c, n in enumerate(cells):
+            for z, atoms in inventories[n].items():
+                atoms0[index[z], c] = atoms
+            for z, value in dose_per_bq[n].items():
+                if z in index:
+                    coefficient[index[z], c] = value
+                    known[index[z], c] = True
+        for t, propagator in enumerate(propagators):
+            activity = (propagator @ atoms0)*lam[:, None]
+            volume = np.asarray(vol, dtype=float)[start:start + len(cells)]
+            gamma_power = gamma @ activity
+            # Dose per gamma power of the cell, for the nuclides without a dose of their own
+            known_gamma = (gamma[:, None]*activity*known).sum(axis=0)
+            known_dose = (coefficient*activity).sum(axis=0)
+            ratio = np.divide(known_dose, known_gamma, out=np.zeros_like(known_dose), where=known_gamma > 0)
+            results[0][start:start + len(cells), t] = activity.sum(axis=0)
+            results[1][start:start + len(cells), t] = heat @ activity/volume
+            results[2][start:start + len(cells), t] = gamma_power/volume
+            results[3][start:start + len(cells), t] = known_dose + ratio*(gamma[:, None]*activity*~known).sum(axis=0)
+    return tuple(results)
+
+def main():
+    ''' mc2acab-decay entry point, see the module documentation'''
+    cooling_times, ref_time = None, None
+    for arg in sys.argv[1:]:
+        if arg.startswith('-decay_times='):
+            cooling_times = [float(t) for t in arg.split('=')[1].split(',')]
+        elif arg.startswith('-from='):
+            ref_time = float(arg.split('=')[1])
+    cube = resultcube.open_cube('cube')
+    if cooling_times is None or (cube is None and not os.path.isfile('summary_apypas.npy')):
+        print(__doc__)
+        sys.exit(1)
+    if cube is not None:
+        cells, vol = cube.cells, cube.vol
+        tables = [cube.cell_tables(n) for n in range(cube.ncells)]
+    else:
+        apypas = np.load('summary_apypas.npy', allow_pickle=True)
+        cells, vol = apypas['cell'], apypas['vol'].astype(float)
+        tables = [tuple(row)[2:] if isinstance(row[2], pd.DataFrame) else None for row in apypas]
+    try:
+        inventories, dose_per_bq = shutdown_inventories(tables, ref_time)
+    except ValueError as e:
+        print(f'\033[31m -from: {e} \033[0m')
+        sys.exit(1)
+    decay = bateman.read_decay(os.environ['ACAB_LB_PATH'] + 'DECAY.dat')
+    activity, heat, gamma, dose = evaluate(decay, inventories, dose_per_bq, vol, cooling_times)
+    for n, ncell in enumerate(cells):
+        if tables[n] is None:
+            continue
+        totals = pd.DataFrame({'Total_Bq': activity[n], 'Total_W/cm3': heat[n],
+                               'Total_gamma_W/cm3': gamma[n], 'Total_mSv/h': dose[n]},
+                              index=cooling_times)
+        totals.index.name = f'Cell:{ncell} Vol:{float(vol[n]):.2e}'
+        resultcube.formatted(totals).to_csv(f'summary_decay_{ncell}.csv', sep='\t', encoding='utf-8')
+    print(f'{sum(table is not None for table in tables)} cells evaluated at {len(cooling_times)}'
+          ' cooling times in summary_decay_*.csv')
+
+if __name__ == '__main__':
+    main()
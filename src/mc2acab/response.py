@@ -0,0 +1,162 @@
+#! /usr/bin/env python
+
+''' Unit responses of a MCNP_ACAB campaign, to derive other source terms and irradiation
+    times without running ACAB again.
+    With -response the campaign irradiates once for the reference time and outputs on
+    the RESPONSE_TIMES cooling grid. Without burn-up the cells are linear and time invariant,
+    so the results of an irradiation k times longer are the sum of k reference pulses,
+    each one cooled for jT more: D(t) + D(t + T) + ... + D(t + (k-1)T), a fractional last
+    pulse being taken in proportion. A different source term scales them.
+    This does not hold when the materials burn, their nuclides and first products being
+    removed at rate*time over tol, nor for materials radioactive at start, whose own
+    activity neither scales nor adds up. Those cells are flagged to be run again.
+    The mol inventories are not derived, they include the initial materials.
+    mc2acab-response -source_term=x [-st_units=2] -irr_time=h [-decay_times=s,s] [-tol=x]
+    By Miguel Magan and Octavio Gonzalez'''
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+from mc2acab import MCNP_ACAB_library as MCNPACAB
+from mc2acab import groupxs
+from mc2acab import bateman
+from mc2acab import resultcube
+
+RESPONSE_TIMES = [float(f'{t:.3e}') for t in np.geomspace(10, 3.15E10, 56)]  # s, up to 1000 y
+CHUNK = 512  # Pulses added at once
+QUANTITIES = ['decay', 'gamma', 'heat', 'dose']  # Those derived, in the order of MCNP_ACAB_Map
+
+def burnup_rates(spectra, source, irr_type, inventories, chunk=64):
+    ''' Largest removal rate (1/s) by reactions among the nuclides of inventories and their
+    first products, one per cell, and whether the cell has radioactive nuclides at start'''
+    reactions, xs = groupxs.load_gxs(MCNPACAB.gxs_file(irr_type))
+    products, _ = bateman.reaction_products(reactions, 'n' if 'n' in irr_type else 'p')
+    decay = bateman.read_decay(os.environ['ACAB_LB_PATH'] + 'DECAY.dat')
+    targets, inverse = np.unique(reactions[:, 0]*10, return_inverse=True)
+    first = {}  # First products of every target
+    for (za, _, _), product in zip(reactions, products):
+        if product is not None:
+            first.setdefault(za*10, set()).add(product)
+    spectra = np.atleast_2d(spectra)
+    removal = np.zeros(len(spectra))
+    radioactive = np.zeros(len(spectra), dtype=bool)
+    for start, sigma in groupxs.collapse_all(xs, groupxs.group_spectra(spectra), chunk):
+        rates = np.zeros((len(targets), sigma.shape[1]))
+        np.add.at(rates, inverse, sigma*spectra[start:start+sigma.shape[1], -1]*source*bateman.BARN)
+        for c in range(sigma.shape[1]):
+            initial = set(inventories[start+c])
+            radioactive[start+c] = bateman.radioactive(initial, decay)
+            nuclides = initial.union(*[first.get(zai, set()) for zai in initial])
+            rows = np.flatnonzero(np.isin(targets, list(nuclides)))
+            removal[start+c] = rates[rows, c].max() if len(rows) else 0.0
+    return removal, radioactive
+
+def store(filename, reqs, cells, removal, radioactive):
+    ''' Save the reference of a -response campaign'''
+    np.savez(filename, source=reqs['-st'], irr_time=reqs['-irr_time'], part=reqs['-part'],
+             times=np.array(RESPONSE_TIMES), cells=np.asarray(cells, dtype=int),
+             removal=removal, radioactive=radioactive)
+
+def _interpolate(times, values, query):
+    "values (times x columns) at query times, exponential between positive values"
+    if query.max() > times[-1]*(1 + 1E-9):
+        raise ValueError(f'Time {query.max():.3e} s is beyond the response grid ({times[-1]:.3e} s)')
+    index = np.clip(np.searchsorted(times, query, side='right') - 1, 0, len(times) - 2)
+    weight = ((query - times[index])/(times[index+1] - times[index]))[:, None]
+    low, high = values[index], values[index+1]
+    positive = (low > 0) & (high > 0)
+    ratio = np.divide(high, low, out=np.ones_like(high), where=positive)
+    return np.where(positive, low*ratio**weight, low + (high - low)*weight)
+
+def superpose(times, values, ref_irr_time, irr_time, cooling_times):
+    ''' values (times x columns) after a reference irradiation of ref_irr_time s, times
+    being cooling times starting with 0, derived for an irradiation of irr_time s at
+    cooling_times (s)'''
+    ratio = irr_time/ref_irr_time
+    nfull = int(np.floor(ratio + 1E-9))
+    if nfull < 1:
+        raise ValueError(f'Irradiation of {irr_time:.3e} s shorter than the reference one,'
+                         f' {ref_irr_time:.3e} s')
+    times = np.asarray(times, dtype=float)
+    values = np.asarray(values, dtype=float)
+    cooling_times = np.asarray(cooling_times, dtype=float)
+    result = np.zeros((len(cooling_times), values.shape[1]))
+    for start in range(0, nfull, CHUNK):
+        pulses = np.arange(start, min(nfull, start + CHUNK))
+        query = (cooling_times[None, :] + pulses[:, None]*ref_irr_time).ravel()
+        result += _interpolate(times, values, query).reshape(len(pulses), len(cooling_times), -1).sum(axis=0)
+    if ratio - nfull > 1E-9:
+        result += (ratio - nfull)*_interpolate(times, values, cooling_times + nfull*ref_irr_time)
+    return result
+
+def derive_cell(tables, reference, source, irr_time, cooling_times):
+    ''' (decay, gamma, heat, dose) DataFrames of a cell for source (part/s) and irr_time (s)
+    at cooling_times (s, 0 is the shutdown), from the MCNP_ACAB_Map tables of the reference'''
+    grid = [0.0] + list(reference['times'])
+    scale = source/float(reference['source'])
+    derived = []
+    for quantity, table in zip(QUANTITIES, tables):
+        if quantity == 'gamma':
+            table = table.T  # Times by rows, as the others
+        if len(table.index) != len(grid):
+            raise ValueError(f'{len(table.index)} output times, the response grid has {len(grid)}')
+        values = superpose(grid, table.to_numpy(dtype=float), float(reference['irr_time']),
+                           irr_time, cooling_times)*scale
+        frame = pd.DataFrame(values, index=list(cooling_times), columns=table.columns)
+        frame.columns.name = table.columns.name
+        derived.append(frame.T if quantity == 'gamma' else frame)
+    return tuple(derived)
+
+def flag_cells(reference, source, irr_time, tol=0.01):
+    ''' Indexes of the cells whose burn-up (removal rate times irr_time at source) exceeds
+    tol or with radioactive materials, which must be run again'''
+    burnup = reference['removal']*source/float(reference['source'])*irr_time
+    return np.flatnonzero((burnup > tol) | reference['radioactive'])
+
+def main():
+    ''' mc2acab-response entry point, see the module documentation'''
+    source, irr_time, tol, st_units = None, None, 0.01, '1'
+    cooling_times = [0.0] + [t for t in MCNPACAB.AUTO_COOLING_TIMES if t >= 10]
+    for arg in sys.argv[1:]:
+        if arg.startswith('-source_term='):
+            source = float(arg.split('=')[1])
+        elif arg.startswith('-st_units='):
+            st_units = arg.split('=')[1]
+        elif arg.startswith('-irr_time='):
+            irr_time = float(arg.split('=')[1])*3600
+        elif arg.startswith('-decay_times='):
+            cooling_times = [0.0] + [float(t) for t in arg.split('=')[1].split(',')]
+        elif arg.startswith('-tol='):
+            tol = float(arg.split('=')[1])
+    if not os.path.isfile('response.npz') or source is None or irr_time is None:
+        print(__doc__)
+        sys.exit(1)
+    if st_units == '2':
+        source *= 6.24E15
+    reference = np.load('response.npz')
+    cube = resultcube.open_cube('cube')
+    apypas = None if cube is not None else np.load('summary_apypas.npy', allow_pickle=True)
+    flagged = set(flag_cells(reference, source, irr_time, tol))
+    rerun = []
+    for n, ncell in enumerate(reference['cells']):
+        if n in flagged:
+            rerun.append(int(ncell))
+            continue
+        tables = cube.cell_tables(n) if cube is not None else (
+            tuple(apypas[n])[2:] if isinstance(apypas[n][2], pd.DataFrame) else None)
+        if tables is None:
+            continue
+        derived = derive_cell(tables, reference, source, irr_time, cooling_times)
+        totals = pd.DataFrame({f'Total_{table.columns.name}': table['Total'] if 'Total' in table.columns
+                               else table.loc['Total'] for table in derived})
+        totals.index.name = f'Cell:{ncell}'
+        resultcube.formatted(totals).to_csv(f'summary_response_{ncell}.csv', sep='\t',
+                                                 encoding='utf-8')
+    with open('response_rerun.txt', 'w', encoding='utf-8') as outfile:
+        outfile.write('\n'.join(str(ncell) for ncell in rerun) + '\n')
+    print(f'{len(reference["cells"]) - len(rerun)} cells derived in summary_response_*.csv,'
+          f' {len(rerun)} cells burn up or are radioactive and must be run again, see response_rerun.txt')
+
+if __name__ == '__main__':
+    main()
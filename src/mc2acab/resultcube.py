@@ -0,0 +1,220 @@
+#! /usr/bin/env python
+
+''' Memory-mapped result cube of a MCNP_ACAB campaign.
+    Instead of returning the apypa DataFrames of every cell to the parent process,
+    the workers write them into preallocated np.memmap arrays of a cube folder:
+        <quantity>.values  (cell, slot, time) values of the nuclides, or gamma groups
+        <quantity>.labels  (cell, slot) name of each slot, fixed bytes, b'' if unused
+        <quantity>.total   (cell, time) Total column (row for gamma)
+        times              (cell, time) output times, NaN padded
+        status             (cell) PENDING, DONE or NULL (no material or flux)
+    plus meta.json and the cell, volume, density and material of every cell.
+    Cubes of voxels (voxel.voxel_campaign) also keep the mesh, mesh.npz, and write_mesh
+    writes their totals mesh-shaped.
+    Cells with more nuclides than slots keep the largest ones, the totals are always exact.
+    By Miguel Magan and Octavio Gonzalez'''
+
+import os
+import json
+import numpy as np
+import pandas as pd
+
+QUANTITIES = ['decay', 'gamma', 'heat', 'dose', 'mol']  # Order of the MCNP_ACAB_Map outputs
+LABEL_DTYPE = 'S16'
+PENDING, DONE, NULL = 0, 1, 2
+
+def _memmap(cube_dir, name, dtype, shape, mode):
+    "np.memmap of the file name in cube_dir"
+    return np.memmap(os.path.join(cube_dir, name), dtype=dtype, mode=mode, shape=shape)
+
+def _group(label):
+    "Gamma group label back to the energy it was, if it was one"
+    try:
+        return float(label)
+    except ValueError:
+        return label
+
+def formatted(table):
+    ''' table with its values as text, as written in the summary files. Series.map works
+    in every pandas, DataFrame.applymap is gone in pandas 3 and DataFrame.map needs 2.1'''
+    return table.apply(lambda column: column.map('{:.3e}'.format))
+
+def create(cube_dir, key, tally0, irr_cell, nslots=256, ntimes=64):
+    ''' Preallocate the cube of a campaign with the cells of tally0, irr_cell being the
+    matching cells. The files are sparse, disk is only used as the cells are written.
+    Returns the ResultCube'''
+    os.makedirs(cube_dir)
+    ncells = tally0.ncells
+    meta = {'key': key, 'ncells': ncells, 'nslots': nslots, 'ntimes': ntimes,
+            'quantities': QUANTITIES}
+    np.save(os.path.join(cube_dir, 'cells.npy'), np.array([int(c) for c in tally0.cells]))
+    np.save(os.path.join(cube_dir, 'vol.npy'), np.array(tally0.mass[:, 0], dtype=float))
+    np.save(os.path.join(cube_dir, 'density.npy'), np.array([float(c.density) for c in irr_cell]))
+    np.save(os.path.join(cube_dir, 'material.npy'), np.array([int(c.mat) for c in irr_cell]))
+    if getattr(tally0, 'shape', None) is not None:
+        np.savez(os.path.join(cube_dir, 'mesh.npz'), shape=np.array(tally0.shape),
+                 voxels=np.asarray(tally0.voxels), **tally0.bounds)
+    for quantity in QUANTITIES:
+        _memmap(cube_dir, f'{quantity}.values', 'float64', (ncells, nslots, ntimes), 'w+').flush()
+        _memmap(cube_dir, f'{quantity}.labels', LABEL_DTYPE, (ncells, nslots), 'w+').flush()
+        _memmap(cube_dir, f'{quantity}.total', 'float64', (ncells, ntimes), 'w+').flush()
+    times = _memmap(cube_dir, 'times', 'float64', (ncells, ntimes), 'w+')
+    times[:] = np.nan
+    times.flush()
+    _memmap(cube_dir, 'names', LABEL_DTYPE, (len(QUANTITIES),), 'w+').flush()
+    _memmap(cube_dir, 'truncated', 'int32', (ncells, len(QUANTITIES)), 'w+').flush()
+    _memmap(cube_dir, 'status', 'int8', (ncells,), 'w+').flush()
+    # meta.json last, a cube without it is incomplete
+    with open(os.path.join(cube_dir, 'meta.json'), 'w', encoding='utf-8') as outfile:
+        json.dump(meta, outfile)
+    return ResultCube(cube_dir)
+
+def open_cube(cube_dir, key=None):
+    ''' ResultCube in cube_dir, or None if there is none or it belongs to another
+    campaign than key'''
+    if not os.path.isfile(os.path.join(cube_dir, 'meta.json')):
+        return None
+    cube = ResultCube(cube_dir)
+    if key is not None and cube.key != key:
+        return None
+    return cube
+
+class ResultCube:
+    """
+    Result cube of a campaign, opened from its folder.
+    """
+    def __init__(self, cube_dir, mode='r+'):
+        self.cube_dir = cube_dir
+        with open(os.path.join(cube_dir, 'meta.json'), 'r', encoding='utf-8') as infile:
+            meta = json.load(infile)
+        self.key = meta['key']
+        self.ncells = meta['ncells']
+        self.nslots = meta['nslots']
+        self.ntimes = meta['ntimes']
+        self.cells = np.load(os.path.join(cube_dir, 'cells.npy'))
+        self.vol = np.load(os.path.join(cube_dir, 'vol.npy'))
+        self.density = np.load(os.path.join(cube_dir, 'density.npy'))
+        self.material = np.load(os.path.join(cube_dir, 'material.npy'))
+        shape = (self.ncells, self.nslots, self.ntimes)
+        self.values = {q: _memmap(cube_dir, f'{q}.values', 'float64', shape, mode) for q in QUANTITIES}
+        self.labels = {q: _memmap(cube_dir, f'{q}.labels', LABEL_DTYPE, shape[:2], mode)
+                       for q in QUANTITIES}
+        self.total = {q: _memmap(cube_dir, f'{q}.total', 'float64', (self.ncells, self.ntimes), mode)
+                      for q in QUANTITIES}
+        self.times = _memmap(cube_dir, 'times', 'float64', (self.ncells, self.ntimes), mode)
+        self.names = _memmap(cube_dir, 'names', LABEL_DTYPE, (len(QUANTITIES),), mode)
+        self.truncated = _memmap(cube_dir, 'truncated', 'int32', (self.ncells, len(QUANTITIES)), mode)
+        self.status = _memmap(cube_dir, 'status', 'int8', (self.ncells,), mode)
+        self.mesh = None
+        if os.path.isfile(os.path.join(cube_dir, 'mesh.npz')):
+            with np.load(os.path.join(cube_dir, 'mesh.npz')) as infile:
+                self.mesh = {name: infile[name] for name in infile.files}
+
+    def write_cell(self, n, outputs):
+        ''' Write the outputs of MCNP_ACAB_Map for the n-th cell. None marks it as NULL'''
+        if outputs is not None:
+            times = np.asarray(outputs[0].index, dtype=float)
+            ntimes = len(times)
+            if ntimes > self.ntimes:
+                raise ValueError(f'{ntimes} times in cell {self.cells[n]} but the cube only'
+                                 f' holds {self.ntimes}, use a larger -cube_times')
+            self.times[n] = np.nan
+            self.times[n, :ntimes] = times
+            for iq, (quantity, table) in enumerate(zip(QUANTITIES, outputs)):
+                self.names[iq] = str(table.columns.name).encode()
+                if quantity == 'gamma':
+                    table = table.T  # As the others, times by rows
+                labels = [label for label in table.columns if label != 'Total']
+                data = table[labels].to_numpy(dtype=float).T
+                keep = np.arange(len(labels))
+                if len(labels) > self.nslots:  # Keep the largest ones
+                    keep = np.sort(np.argsort(-np.abs(data).max(axis=1))[:self.nslots])
+                nkeep = len(keep)
+                self.values[quantity][n] = 0.0
+                self.values[quantity][n, :nkeep, :ntimes] = data[keep]
+                self.labels[quantity][n] = b''
+                self.labels[quantity][n, :nkeep] = [str(labels[i]).encode() for i in keep]
+                self.total[quantity][n] = 0.0
+                self.total[quantity][n, :ntimes] = table['Total'].to_numpy(dtype=float)
+                self.truncated[n, iq] = len(labels) - nkeep
+            self.flush()
+        # The status goes last, so a cell is not DONE until all its data is on disk
+        self.status[n] = NULL if outputs is None else DONE
+        self.status.flush()
+
+    def flush(self):
+        ''' Write the pending changes of the memmaps to disk'''
+        for quantity in QUANTITIES:
+            self.values[quantity].flush()
+            self.labels[quantity].flush()
+            self.total[quantity].flush()
+        self.times.flush()
+        self.names.flush()
+        self.truncated.flush()
+
+    def cell_times(self, n):
+        ''' Output times of the n-th cell'''
+        times = self.times[n]
+        return list(times[~np.isnan(times)])
+
+    def first_done(self):
+        ''' Index of the first DONE cell, None if there is none'''
+        done = np.flatnonzero(self.status == DONE)
+        return int(done[0]) if len(done) else None
+
+    def cell_tables(self, n):
+        ''' DataFrames (decay, gamma, heat, dose, mol) of the n-th cell as MCNP_ACAB_Map
+        returns them, or None if the cell is not DONE'''
+        if self.status[n] != DONE:
+            return None
+        times = self.cell_times(n)
+        ntimes = len(times)
+        tables = []
+        for iq, quantity in enumerate(QUANTITIES):
+            used = self.labels[quantity][n] != b''
+            labels = [label.decode() for label in self.labels[quantity][n][used]]
+            data = np.vstack([self.values[quantity][n][used, :ntimes],
+                              self.total[quantity][n, :ntimes]])
+            if quantity == 'gamma':
+                table = pd.DataFrame(data, index=[_group(label) for label in labels] + ['Total'],
+                                     columns=times)
+            else:
+                table = pd.DataFrame(data.T, index=times, columns=labels + ['Total'])
+            table.columns.name = self.names[iq].decode()
+            tables.append(table)
+        return tuple(tables)
+
+    def cell_totals(self, n):
+        ''' DataFrame of the totals of the n-th cell by time, with a Total_<name> column
+        per quantity as in the summary_ACAB files'''
+        ntimes = len(self.cell_times(n))
+        return pd.DataFrame({f'Total_{self.names[iq].decode()}': self.total[quantity][n, :ntimes]
+                             for iq, quantity in enumerate(QUANTITIES)},
+                            index=self.cell_times(n))
+
+    def write_mesh(self, out_dir='mesh_results'):
+        ''' Write the totals of a voxel cube mesh-shaped: <quantity>.npy (time, x, y, z),
+        NaN in the voxels not run, plus times.npy and the mesh bounds in bounds.npz.
+        One time at a time goes from the cube to the output memmaps'''
+        if self.mesh is None:
+            raise ValueError(f'{self.cube_dir} is not a voxel cube')
+        first = self.first_done()
+        if first is None:
+            raise ValueError(f'No voxel of {self.cube_dir} is done')
+        os.makedirs(out_dir, exist_ok=True)
+        times = self.cell_times(first)
+        shape = tuple(int(n) for n in self.mesh['shape'])
+        done = np.flatnonzero(self.status == DONE)
+        voxels = self.mesh['voxels'][done]
+        for quantity in QUANTITIES:
+            grid = np.lib.format.open_memmap(os.path.join(out_dir, f'{quantity}.npy'), 'w+',
+                                             'float64', (len(times),) + shape)
+            flat = grid.reshape(len(times), -1)
+            for t in range(len(times)):
+                flat[t] = np.nan
+                flat[t, voxels] = self.total[quantity][done, t]
+            grid.flush()
+        np.save(os.path.join(out_dir, 'times.npy'), np.array(times))
+        np.savez(os.path.join(out_dir, 'bounds.npz'),
+                 **{axis: self.mesh[axis] for axis in ['X', 'Y', 'Z', 'E']})
+        return out_dir
@@ -0,0 +1,115 @@
+#! /usr/bin/env python
+
+''' Cost-model-driven ordering of the cells of a MCNP_ACAB campaign.
+    The cost of a cell is predicted from its isotope count after unfold_NA, its flux
+    and its number of proton feeds, fitted on the metrics of previous runs
+    (metrics.jsonl) or taken directly from them for cells already timed.
+    Cells are dispatched longest first so that no big cell is left for the end.
+    By Miguel Magan and Octavio Gonzalez'''
+
+import os
+import heapq
+import numpy as np
+from mc2acab import metrics
+from mc2acab import pyhtape3x
+from mc2acab import MCNP_outparser
+
+# Rough prior of the cost in seconds: constant, per isotope, per feed, per decade of flux.
+# It is only used until there are metrics to fit
+DEFAULT_COEFS = np.array([30.0, 0.5, 0.05, 2.0])
+DEFAULT_FEEDS = 150  # Feeds of a HISTP cell never run before
+DEFAULT_DISK_MB = 20.0  # Disk left by a cell never run before with -save=True
+MIN_FIT_RECORDS = 8
+
+def cell_features(tally0, mat, irr_cell, source, irr_type='n', outpfile=None, history=None):
+    ''' Array (ncells x 3) of isotopes after unfold_NA, total flux and proton feeds of the
+    cells of tally0. Feeds are taken from history if the cell was run before, otherwise
+    they are estimated for the cells in the HISTP card of outpfile'''
+    history = history or {}
+    niso_cache = {}
+    histp_cells = set()
+    if 'p' in irr_type and outpfile is not None:
+        histp_cells = set(int(c) for c in MCNP_outparser.get_histpcells(outpfile))
+    features = np.zeros((tally0.ncells, 3))
+    for n, mater in enumerate(mat):
+        if mater is None or not mater.zaid:
+            niso = 0
+        else:
+            key = (mater.number, tuple(mater.zaid))
+            if key not in niso_cache:
+                niso_cache[key] = len(pyhtape3x.unfold_NA(mater.zaid, mater.frac)[0])
+            niso = niso_cache[key]
+        ncell = int(irr_cell[n].ncell)
+        if ncell in history:
+            nfeeds = history[ncell].get('nfeeds', 0)
+        else:
+            nfeeds = DEFAULT_FEEDS if ncell in histp_cells else 0
+        features[n] = niso, tally0.value[n, 0, 0, 0, -1]*source, nfeeds
+    return features
+
+def load_history(infile='metrics.jsonl'):
+    ''' Latest metrics record of each cell run before, by cell number'''
+    if not os.path.exists(infile):
+        return {}
+    return {int(record['cell']): record for record in metrics.load(infile)}
+
+def _design(features):
+    "Design matrix of the cost model: 1, isotopes, feeds, log10 of the flux"
+    flux = np.maximum(features[:, 1], 1.0)
+    return np.column_stack([np.ones(len(features)), features[:, 0], features[:, 2], np.log10(flux)])
+
+def fit_cost_model(history):
+    ''' Least squares coefficients of the cost model on the timed cells of history,
+    or DEFAULT_COEFS if there are too few of them'''
+    records = [rec for rec in history.values() if 'niso' in rec]
+    if len(records) < MIN_FIT_RECORDS:
+        return DEFAULT_COEFS
+    features = np.array([[rec['niso'], rec['flux'], rec['nfeeds']] for rec in records])
+    walls = np.array([rec['wall'] for rec in records])
+    coefs = np.linalg.lstsq(_design(features), walls, rcond=None)[0]
+    return coefs
+
+def predict_costs(features, cells, coefs, history=None):
+    ''' Predicted cost in seconds of each cell. Cells timed before keep their measured time'''
+    history = history or {}
+    costs = np.maximum(_design(features) @ coefs, 1.0)
+    for n, ncell in enumerate(cells):
+        if int(ncell) in history:
+            costs[n] = history[int(ncell)]['wall']
+    return costs
+
+def runnable(features):
+    ''' Mask of the cells with material and flux, the others are not worth a worker'''
+    return (features[:, 0] > 0) & (features[:, 1] > 0)
+
+def schedule(pending, costs, features):
+    ''' Split the pending cell indexes in those to dispatch, sorted longest first,
+    and those skipped for null material or null flux'''
+    mask = runnable(features)
+    skipped = [n for n in pending if not mask[n]]
+    torun = sorted((n for n in pending if mask[n]), key=lambda n: costs[n], reverse=True)
+    return torun, skipped
+
+def makespan(costs, nproc):
+    ''' Makespan of running costs longest first on nproc workers'''
+    loads = [0.0]*nproc
+    for cost in sorted(costs, reverse=True):
+        heapq.heappush(loads, heapq.heappop(loads) + cost)
+    return max(loads) if loads else 0.0
+
+def disk_estimate(cells, history=None):
+    ''' Disk (MB) left by the cells: measured for those run before, the mean of them
+    (or DEFAULT_DISK_MB) for the others'''
+    history = history or {}
+    measured = [rec['disk_mb'] for rec in history.values() if 'disk_mb' in rec]
+    default = float(np.mean(measured)) if measured else DEFAULT_DISK_MB
+    return sum(history.get(int(ncell), {}).get('disk_mb', default) for ncell in cells)
+
+def dry_run_report(torun, skipped, costs, cells, nproc, history=None):
+    ''' Text with the predicted makespan and disk usage of a campaign'''
+    lines = [f'{len(torun)} cells to run, {len(skipped)} skipped (null material or flux)',
+             f'Predicted CPU time: {sum(costs[n] for n in torun)/3600:.2f} h',
+             f'Predicted makespan on {nproc} processes: {makespan([costs[n] for n in torun], nproc)/3600:.2f} h',
+             f'Predicted disk usage: {disk_estimate([cells[n] for n in torun], history)/1024:.2f} GB']
+    lines.append('Longest cells: ' + ', '.join(f'{cells[n]} ({costs[n]:.0f} s)' for n in torun[:10]))
+    return '\n'.join(lines)
@@ -0,0 +1,135 @@
+#! /usr/bin/env python
+
+''' Campaign data shared by the MCNP_ACAB workers through multiprocessing.shared_memory.
+    The flux spectra of the cells (cells x groups, total flux last), their volumes,
+    densities and materials are copied once into shared blocks. Workers attach to them
+    in the pool initializer and get only the cell index as task, so the pool starts
+    fast with the spawn and forkserver start methods as well as with fork.
+    By Miguel Magan and Octavio Gonzalez'''
+
+import numpy as np
+from multiprocessing import shared_memory
+from mc2acab import MCNP_ACAB_library as MCNPACAB
+from mc2acab import material
+from mc2acab import cell as cel
+from mc2acab import resultcube
+
+CHUNK = 1 << 16  # Rows copied at a time into the shared blocks
+_WORKER = {}  # Shared arrays and campaign data of a worker process, filled by init_worker
+
+def _share(array, name, blocks, layout, dtype=None):
+    "Copy array (as dtype) into a new shared block and record it in layout as name"
+    dtype = np.dtype(array.dtype if dtype is None else dtype)
+    block = shared_memory.SharedMemory(create=True, size=max(int(np.prod(array.shape))*dtype.itemsize, 1))
+    shared = np.ndarray(array.shape, dtype=dtype, buffer=block.buf)
+    for start in range(0, len(array), CHUNK):  # Memory-mapped arrays are never all in memory
+        shared[start:start+CHUNK] = array[start:start+CHUNK]
+    blocks.append(block)
+    layout[name] = (block.name, array.shape, dtype.str)
+
+def share_campaign(tally0, mat, irr_cell):
+    ''' Copy the spectra and volumes of tally0 and the cells and materials matching them
+    into shared memory. Returns the layout for init_worker, which is small and picklable,
+    and the shared blocks, to be freed with release() once the pool is done'''
+    blocks = []
+    layout = {}
+    _share(tally0.value[:, 0, 0, 0, :], 'spectrum', blocks, layout, float)
+    _share(np.array(tally0.mass[:, 0], dtype=float), 'vol', blocks, layout)
+    _share(np.array([int(c.ncell) for c in irr_cell]), 'ncell', blocks, layout)
+    _share(np.array([int(c.mat) for c in irr_cell]), 'cellmat', blocks, layout)
+    _share(np.array([float(c.density) for c in irr_cell]), 'density', blocks, layout)
+    # Material table: every material once, cells point to it by index
+    numbers, offsets, zaids, fracs = [], [0], [], []
+    matindex = np.zeros(len(mat), dtype=int)
+    for n, mater in enumerate(mat):
+        number = -1 if mater is None else mater.number
+        if number not in numbers:
+            numbers.append(number)
+            if mater is not None:
+                zaids.extend(int(zaid) for zaid in mater.zaid)
+                fracs.extend(float(frac) for frac in mater.frac)
+            offsets.append(len(zaids))
+        matindex[n] = numbers.index(number)
+    _share(matindex, 'matindex', blocks, layout)
+    _share(np.array(numbers, dtype=int), 'mat_number', blocks, layout)
+    _share(np.array(offsets, dtype=int), 'mat_offsets', blocks, layout)
+    _share(np.array(zaids, dtype=int), 'mat_zaid', blocks, layout)
+    _share(np.array(fracs, dtype=float), 'mat_frac', blocks, layout)
+    return layout, blocks
+
+def release(blocks):
+    ''' Close and remove the shared blocks made by share_campaign'''
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+def init_worker(layout, kwargs, key, journal_dir='journal', cube_dir=None):
+    ''' Pool initializer: attach to the shared blocks of layout and keep the MCNP_ACAB_Map
+    kwargs, campaign key and journal folder for run_cell. With cube_dir the outputs are
+    written into that result cube instead of being journaled and returned'''
+    _WORKER['blocks'] = {name: shared_memory.SharedMemory(name=block)
+                         for name, (block, _, _) in layout.items()}
+    _WORKER['arrays'] = {name: np.ndarray(shape, dtype=dtype, buffer=_WORKER['blocks'][name].buf)
+                         for name, (_, shape, dtype) in layout.items()}
+    _WORKER['kwargs'] = kwargs
+    _WORKER['key'] = key
+    _WORKER['journal_dir'] = journal_dir
+    _WORKER['cube'] = resultcube.ResultCube(cube_dir) if cube_dir is not None else None
+
+def cell_number(n):
+    ''' MCNP number of the n-th tally cell'''
+    return int(_WORKER['arrays']['ncell'][n])
+
+def cell_inputs(n):
+    ''' Material and cell of the n-th tally cell, rebuilt from the shared arrays.
+    They are new objects, MCNP_ACAB_Map can modify them freely'''
+    arrays = _WORKER['arrays']
+    index = arrays['matindex'][n]
+    start, end = arrays['mat_offsets'][index:index+2]
+    mater = material.Mat(int(arrays['mat_number'][index]))
+    mater.zaid = arrays['mat_zaid'][start:end].tolist()
+    mater.frac = arrays['mat_frac'][start:end].tolist()
+    irr_cell = cel.Cell(cell_number(n))
+    irr_cell.mat = int(arrays['cellmat'][n])
+    irr_cell.density = float(arrays['density'][n])
+    return mater, irr_cell
+
+def prepare(n):
+    ''' prepare_cell of MCNP_ACAB_Map for the n-th tally cell, the first stage of a
+    pipeline.Pipeline'''
+    arrays = _WORKER['arrays']
+    mater, irr_cell = cell_inputs(n)
+    return MCNPACAB.prepare_cell(mater=mater, n_id=n, irr_cell=irr_cell,
+                                 spectrum=np.array(arrays['spectrum'][n]),
+                                 vol=float(arrays['vol'][n]), **_WORKER['kwargs'])
+
+def finish(n, outputs):
+    ''' Journal the outputs of the n-th tally cell, or write them in the result cube.
+    Returns n, the outputs (None with a cube) and True, as run_cell'''
+    if _WORKER['kwargs'].get('decks_only'):  # Nothing ran, nothing to keep
+        return n, None, True
+    if _WORKER['cube'] is not None:  # Nothing to pickle back, the parent reads the cube
+        _WORKER['cube'].write_cell(n, outputs)
+        return n, None, True
+    MCNPACAB.journal_write(_WORKER['journal_dir'], cell_number(n), _WORKER['key'], outputs)
+    # Outputs:
+    #     0 Timesets (arrays of times)
+    #     1 Decay= Bq as ACAB
+    #     2 Gamma= PHOTONS/CCM/SEC (as ACAB)
+    #     3 Heat= W/cm3
+    #     4 Dose= mSv/h (ACAB is Sv/h)
+    #     5 mol = mol
+    return n, outputs, True
+
+def run_cell(n):
+    ''' Run MCNP_ACAB_Map for the n-th tally cell and journal its outputs, or write them
+    in the result cube. Returns n, the outputs (None with a cube) and whether the cell finished'''
+    try:
+        job = prepare(n)
+        if not job.finished:
+            MCNPACAB.execute_cell(job)
+            job.outputs = MCNPACAB.parse_cell(job)
+        return finish(n, job.outputs)
+    except Exception as e:  # A failed cell must not take down the whole campaign
+        print(f'\033[31m cell {cell_number(n)} failed: {e} \033[0m')
+        return n, None, False
@@ -0,0 +1,167 @@
+#! /usr/bin/env python
+
+''' Shared-filesystem task queue to spread a MCNP_ACAB campaign over several nodes.
+    plan() writes one task file per cell in queue/pending. Any number of workers
+    (mc2acab-worker) on any node seeing the same folder claim the tasks by atomic
+    rename into queue/running, and write the outputs into queue/done.
+    gather() collects queue/done for summary_table_gen.
+    By Miguel Magan and Octavio Gonzalez'''
+
+import os
+import sys
+import time
+import pickle
+import socket
+import traceback
+from mc2acab import MCNP_ACAB_library as MCNPACAB
+from mc2acab import material
+from mc2acab import cell as cel
+
+QUEUE_DIRS = ['pending', 'running', 'done', 'failed']
+
+def plan(queue_dir, tally0, mat, irr_cell, reqs, options, key=None, cells=None, skipped=()):
+    ''' Write the campaign description and one task per cell of tally0 in queue_dir.
+    mat and irr_cell are the lists of materials and cells matching the tally cells.
+    cells are the indexes of the cells to run (all if None), those of skipped are done
+    with no outputs. key is the campaign key, from reqs and options if None'''
+    MCNPACAB.backup_previous(queue_dir)
+    for folder in QUEUE_DIRS:
+        os.makedirs(os.path.join(queue_dir, folder))
+    campaign = {'key': key or MCNPACAB.campaign_key(reqs, options),
+                'cells': [int(ncell) for ncell in tally0.cells],
+                'mass': tally0.mass,
+                'reqs': reqs,
+                'options': options}
+    MCNPACAB.atomic_dump(campaign, os.path.join(queue_dir, 'campaign.pkl'))
+    kwargs = MCNPACAB.map_kwargs(reqs, options)
+    cells = range(tally0.ncells) if cells is None else cells
+    for n in cells:
+        # Only plain data travels in the task, so any worker can rebuild it
+        task = {'n': n,
+                'key': campaign['key'],
+                'tally': MCNPACAB.cell_tally(tally0, n),
+                # A material missing in the outp is an empty one, as in sharedflux
+                'mat': (-1, [], []) if mat[n] is None else (mat[n].number, list(mat[n].zaid), list(mat[n].frac)),
+                'cell': (irr_cell[n].ncell, irr_cell[n].mat, irr_cell[n].density),
+                'kwargs': kwargs}
+        MCNPACAB.atomic_dump(task, os.path.join(queue_dir, 'pending',
+                                                f'cell_{irr_cell[n].ncell}.task'))
+    for n in skipped:
+        MCNPACAB.journal_write(os.path.join(queue_dir, 'done'), irr_cell[n].ncell, campaign['key'], None)
+    print(f'{len(cells)} tasks written in {queue_dir}, {len(skipped)} cells skipped')
+
+def claim(queue_dir):
+    ''' Claim a pending task by renaming it into running. Returns the claimed file
+    or None if there is nothing left. The rename is atomic, so a task can only be
+    claimed by one worker even if several of them race for it'''
+    pending = os.path.join(queue_dir, 'pending')
+    worker_id = f'{socket.gethostname()}.{os.getpid()}'
+    for name in sorted(os.listdir(pending)):
+        if not name.endswith('.task'):
+            continue
+        claimed = os.path.join(queue_dir, 'running', f'{name}.{worker_id}')
+        try:
+            os.rename(os.path.join(pending, name), claimed)
+        except FileNotFoundError:  # Somebody else was faster
+            continue
+        os.utime(claimed)  # Claim time, to spot tasks of dead workers
+        return claimed
+    return None
+
+def run_task(taskfile):
+    ''' Run MCNP_ACAB_Map for a claimed task file. Returns the cell number, campaign key and outputs'''
+    with open(taskfile, 'rb') as infile:
+        task = pickle.load(infile)
+    mater = material.Mat(task['mat'][0])
+    mater.zaid, mater.frac = task['mat'][1], task['mat'][2]
+    irr_cell = cel.Cell(task['cell'][0])
+    irr_cell.mat, irr_cell.density = task['cell'][1], task['cell'][2]
+    outputs = MCNPACAB.MCNP_ACAB_Map(tally0=task['tally'], mater=mater, n_id=0,
+                                     irr_cell=irr_cell, **task['kwargs'])
+    return irr_cell.ncell, task['key'], outputs
+
+def worker(queue_dir='queue'):
+    ''' Process tasks of queue_dir until there are no pending ones.
+    Cells are run from the folder containing queue_dir, where the outp, histp
+    and scenario files of the campaign are'''
+    queue_dir = os.path.abspath(queue_dir)
+    os.chdir(os.path.dirname(queue_dir))
+    ndone = 0
+    while True:
+        taskfile = claim(queue_dir)
+        if taskfile is None:
+            break
+        cwd = os.getcwd()
+        try:
+            ncell, key, outputs = run_task(taskfile)
+        except Exception:
+            os.chdir(cwd)
+            print(f'\033[31m Task {os.path.basename(taskfile)} failed \033[0m')
+            traceback.print_exc()
+            os.rename(taskfile, os.path.join(queue_dir, 'failed', os.path.basename(taskfile)))
+            continue
+        MCNPACAB.journal_write(os.path.join(queue_dir, 'done'), ncell, key, outputs)
+        os.remove(taskfile)
+        ndone += 1
+    print(f'No more pending tasks in {queue_dir}, {ndone} done by this worker')
+    return ndone
+
+def requeue(queue_dir='queue', stale_hours=None):
+    ''' Send failed tasks back to pending. If stale_hours is given, tasks claimed
+    longer than that ago (i.e. whose worker probably died) are also sent back'''
+    moved = 0
+    folders = ['failed'] if stale_hours is None else ['failed', 'running']
+    for folder in folders:
+        for name in os.listdir(os.path.join(queue_dir, folder)):
+            taskfile = os.path.join(queue_dir, folder, name)
+            if folder == 'running' and time.time() - os.path.getmtime(taskfile) < stale_hours*3600:
+                continue
+            taskname = name[:name.index('.task')+5]
+            try:
+                os.rename(taskfile, os.path.join(queue_dir, 'pending', taskname))
+            except FileNotFoundError:  # Finished or moved meanwhile
+                continue
+            moved += 1
+    print(f'{moved} tasks sent back to pending')
+    return moved
+
+def gather(queue_dir='queue'):
+    ''' Collect the outputs of a planned campaign. Returns the campaign description
+    and the list of outputs in tally order, as pool.map would do. Cells not finished
+    yet are reported and left as None'''
+    with open(os.path.join(queue_dir, 'campaign.pkl'), 'rb') as infile:
+        campaign = pickle.load(infile)
+    totaldata = []
+    missing = []
+    for ncell in campaign['cells']:
+        found, outputs = MCNPACAB.journal_read(os.path.join(queue_dir, 'done'), ncell,
+                                               campaign['key'])
+        if not found:
+            missing.append(ncell)
+        totaldata.append(outputs)
+    if missing:
+        print(f'\033[31m Warning!!! cells {missing} not finished \033[0m')
+    return campaign, totaldata
+
+def main():
+    ''' mc2acab-worker entry point: mc2acab-worker [queue_dir] [-requeue[=stale_hours]]'''
+    queue_dir = 'queue'
+    stale_hours = None
+    do_requeue = False
+    for arg in sys.argv[1:]:
+        if arg.startswith('-requeue'):
+            do_requeue = True
+            if '=' in arg:
+                stale_hours = float(arg.split('=')[1])
+        else:
+            queue_dir = arg
+    if not os.path.isfile(os.path.join(queue_dir, 'campaign.pkl')):
+        print(f'{queue_dir} is not a MCNP_ACAB task queue, run MCNP_ACAB.py with -plan first')
+        sys.exit(1)
+    if do_requeue:
+        requeue(queue_dir, stale_hours)
+    else:
+        worker(queue_dir)
+
+if __name__ == '__main__':
+    main()
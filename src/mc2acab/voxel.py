@@ -0,0 +1,212 @@
+#! /usr/bin/env python
+
+''' Voxel activation from an energy binned FMESH of a meshtal file (R2S studies).
+    The mesh tally is parsed once, in column format, into a (voxel x group+total) array
+    cached as .npy next to the meshtal and memory-mapped from then on, so its size is
+    only limited by the disk. Only rectangular meshes are read.
+    MCNP does not give the material of a voxel, it comes from a voxel material file
+    (-voxel_mat), one line per non void voxel:
+        i j k  mat density fraction  [mat density fraction ...]
+    i, j, k being the 0-based X, Y, Z indexes of the voxel, density as in the MCNP cells
+    (negative in g/cm3, positive in at/b-cm) and fraction the volume fraction of the voxel
+    filled with that material, as given by any voxel sampling tool. Voxels with several
+    materials get their homogenized mixture, in at/b-cm. Voxels missing from the file,
+    void or without flux are skipped.
+    The voxels then go through the cell pipeline as if they were cells numbered by their
+    flattened index plus 1, and their results are written mesh-shaped by
+    resultcube.ResultCube.write_mesh.
+    By Miguel Magan and Octavio Gonzalez'''
+
+import os
+import re
+import itertools
+from types import SimpleNamespace
+import numpy as np
+from mc2acab import material
+from mc2acab import cell as cel
+
+MESH_CHUNK = 1 << 18  # Lines of the meshtal parsed at once
+GATHER_CHUNK = 1 << 12  # Voxels copied at once
+MIXTURE_BASE = 100000  # Numbers of the homogenized materials start here
+HEADER_COLUMNS = {'Rel Error': 'RelError', 'Rslt * Vol': 'RsltVol'}
+
+def _bounds(line):
+    "Bin boundaries of a meshtal 'direction:' or 'bin boundaries:' line"
+    return np.array([float(x) for x in line.split(':')[1].split()])
+
+def _is_data(line):
+    "Whether a meshtal line is a row of the column format"
+    first = line.split()[0]
+    if first == 'Total':
+        return True
+    try:
+        float(first)
+        return True
+    except ValueError:
+        return False
+
+def read_header(infile, ntal):
+    ''' Bounds (x, y, z, energy) and data columns of mesh tally ntal, reading infile up to
+    the first data line'''
+    target = re.compile(rf'^\s*Mesh Tally Number\s+{int(ntal)}\s*$')
+    for line in infile:
+        if target.match(line):
+            break
+    else:
+        raise ValueError(f'Mesh tally {ntal} not found')
+    bounds = {}
+    for line in infile:
+        stripped = line.strip()
+        if stripped.startswith(('R direction', 'Theta direction')):
+            raise ValueError(f'Mesh tally {ntal} is cylindrical, only rectangular meshes are read')
+        for axis in ['X', 'Y', 'Z']:
+            if stripped.startswith(f'{axis} direction'):
+                bounds[axis] = _bounds(stripped)
+        if stripped.startswith('Energy bin boundaries'):
+            bounds['E'] = _bounds(stripped)
+        if stripped.startswith('Energy') and 'Result' in stripped:
+            for name, column in HEADER_COLUMNS.items():
+                stripped = stripped.replace(name, column)
+            return bounds, stripped.split()
+        if stripped.startswith(('X', 'Y', 'Z')) and 'Result' in stripped:
+            raise ValueError(f'Mesh tally {ntal} has no energy bins, activation needs the spectrum')
+    raise ValueError(f'Mesh tally {ntal} has no data in column format')
+
+def parse_meshtal(meshtal, ntal, flux_file, error_file):
+    ''' Parse mesh tally ntal of meshtal into the .npy flux_file and error_file,
+    (voxels x groups+1) with the total last, voxels flattened in (X, Y, Z) C order.
+    Returns the bounds (x, y, z, energy)'''
+    with open(meshtal, 'r', encoding='utf-8', errors='replace') as infile:
+        bounds, columns = read_header(infile, ntal)
+        shape = tuple(len(bounds[axis]) - 1 for axis in ['X', 'Y', 'Z'])
+        upper = bounds['E'][1:]
+        ngroups = len(upper)
+        nvoxels = int(np.prod(shape))
+        flux = np.lib.format.open_memmap(flux_file, 'w+', 'float64', (nvoxels, ngroups + 1))
+        error = np.lib.format.open_memmap(error_file, 'w+', 'float64', (nvoxels, ngroups + 1))
+        index = [columns.index(name) for name in ['Energy', 'X', 'Y', 'Z', 'Result', 'RelError']]
+        # Up to the first line that is not data, the next tally or the end
+        lines = itertools.takewhile(_is_data, (line for line in infile if line.strip()))
+        while True:
+            chunk = list(itertools.islice(lines, MESH_CHUNK))
+            if not chunk:
+                break
+            # The Total rows get an infinite energy, past the last group
+            text = ' '.join(chunk).replace('Total', 'inf')
+            data = np.array(text.split(), dtype=float).reshape(-1, len(columns))[:, index]
+            group = np.searchsorted(upper*(1 + 1E-4), data[:, 0])
+            group[np.isinf(data[:, 0])] = ngroups
+            voxel = np.ravel_multi_index(
+                tuple(np.searchsorted(bounds[axis], data[:, n + 1]) - 1 for n, axis in enumerate('XYZ')),
+                shape)
+            flux[voxel, group] = data[:, 4]
+            error[voxel, group] = data[:, 5]
+        if ngroups == 1:  # No Total rows
+            flux[:, 1], error[:, 1] = flux[:, 0], error[:, 0]
+        flux.flush()
+        error.flush()
+    return bounds
+
+def load_meshtal(meshtal, ntal, cache_dir='mesh_cache'):
+    ''' Bounds and memory-mapped (voxels x groups+1) flux and error of mesh tally ntal,
+    parsed only the first time and then read from cache_dir'''
+    stat = os.stat(meshtal)
+    tag = os.path.join(cache_dir, f'{os.path.basename(meshtal)}_{ntal}_{stat.st_size}_{stat.st_mtime_ns}')
+    if not os.path.isfile(f'{tag}.bounds.npz'):
+        print(f'Parsing mesh tally {ntal} of {meshtal}')
+        os.makedirs(cache_dir, exist_ok=True)
+        bounds = parse_meshtal(meshtal, ntal, f'{tag}.flux.npy', f'{tag}.error.npy')
+        np.savez(f'{tag}.tmp.npz', **bounds)
+        os.replace(f'{tag}.tmp.npz', f'{tag}.bounds.npz')  # Last, the cache is complete
+    with np.load(f'{tag}.bounds.npz') as infile:
+        bounds = {axis: infile[axis] for axis in infile.files}
+    return bounds, np.load(f'{tag}.flux.npy', mmap_mode='r'), np.load(f'{tag}.error.npy', mmap_mode='r')
+
+def gather(array, rows, filename):
+    ''' Rows of the memory-mapped array copied GATHER_CHUNK at a time into the .npy filename,
+    returned memory-mapped, so the used voxels never have to fit in memory'''
+    if not len(rows):
+        return np.zeros((0,) + array.shape[1:], dtype=array.dtype)
+    gathered = np.lib.format.open_memmap(filename, 'w+', array.dtype, (len(rows),) + array.shape[1:])
+    for start in range(0, len(rows), GATHER_CHUNK):
+        gathered[start:start+GATHER_CHUNK] = array[rows[start:start+GATHER_CHUNK]]
+    gathered.flush()
+    del gathered
+    return np.load(filename, mmap_mode='r')
+
+def read_voxel_materials(filename, shape):
+    ''' {flattened voxel index: ((mat, density, fraction), ...)} of a voxel material file'''
+    voxels = {}
+    with open(filename, 'r', encoding='utf-8') as infile:
+        for line in infile:
+            tokens = line.split('#')[0].split()
+            if len(tokens) < 6 or (len(tokens) - 3) % 3:
+                continue
+            index = np.ravel_multi_index(tuple(int(t) for t in tokens[:3]), shape)
+            components = tuple((int(tokens[i]), float(tokens[i+1]), float(tokens[i+2]))
+                               for i in range(3, len(tokens), 3))
+            components = tuple(c for c in components if c[0] != 0 and c[2] > 0)
+            if components:
+                voxels[int(index)] = components
+    return voxels
+
+def homogenize(components, materials):
+    ''' Material mixing components (mat, density, fraction) by volume, in at/b-cm, and its
+    atomic density. materials are the Mat of the MCNP file by number'''
+    atoms = {}
+    for number, density, fraction in components:
+        mater = material.Mat(number)
+        mater.zaid, mater.frac = list(materials[number].zaid), list(materials[number].frac)
+        mater.n2ro(density)
+        for zaid, frac in zip(mater.zaid, mater.frac):
+            atoms[zaid] = atoms.get(zaid, 0.0) + frac*fraction
+    mixture = material.Mat(0)
+    mixture.zaid, mixture.frac = list(atoms), list(atoms.values())
+    return mixture, sum(mixture.frac)
+
+def voxel_campaign(meshtal, ntal, voxel_mat, outpfile, cache_dir='mesh_cache'):
+    ''' Tally-like object of the voxels of mesh tally ntal with flux and material, and their
+    cells and materials as cel.oget and material.oget give them for tally cells.
+    The tally also has the mesh bounds and the flattened index of every voxel. Its flux
+    and error are memory-mapped copies of the voxels used, in cache_dir'''
+    bounds, flux, error = load_meshtal(meshtal, ntal, cache_dir)
+    shape = tuple(len(bounds[axis]) - 1 for axis in ['X', 'Y', 'Z'])
+    voxels = read_voxel_materials(voxel_mat, shape)
+    filled = np.array(sorted(voxels), dtype=int)
+    used = filled[flux[filled, -1] > 0] if len(filled) else filled
+    print(f'{len(used)} voxels with flux and material out of {int(np.prod(shape))},'
+          f' {len(filled) - len(used)} with material but no flux')
+    materials = {}
+    mixtures = {}
+    irr_cell, mat = [], []
+    for index in used:
+        components = voxels[index]
+        for number, _, _ in components:
+            if number not in materials:
+                materials[number] = material.oget(outpfile, number)
+                if materials[number] is None:
+                    raise ValueError(f'Material {number} of voxel {index} not found in {outpfile}')
+        voxel = cel.Cell(int(index) + 1)
+        if len(components) == 1 and components[0][2] == 1:  # Not mixed, as any cell
+            number, density, _ = components[0]
+            mater = material.Mat(number)
+            mater.zaid, mater.frac = list(materials[number].zaid), list(materials[number].frac)
+        else:
+            if components not in mixtures:
+                mixtures[components] = (MIXTURE_BASE + len(mixtures),) + homogenize(components, materials)
+            number, mixture, density = mixtures[components]
+            mater = material.Mat(number)
+            mater.zaid, mater.frac = list(mixture.zaid), list(mixture.frac)
+        voxel.mat, voxel.density = number, density
+        irr_cell.append(voxel)
+        mat.append(mater)
+    widths = [np.diff(bounds[axis]) for axis in ['X', 'Y', 'Z']]
+    volume = np.einsum('i,j,k->ijk', *widths).ravel()[used]
+    tag = os.path.join(cache_dir, f'{os.path.basename(meshtal)}_{ntal}_used')
+    spectra = gather(flux, used, f'{tag}.flux.npy')
+    tally0 = SimpleNamespace(n=int(ntal), cells=[int(i) + 1 for i in used], ncells=len(used),
+                             ebins=list(bounds['E']), mass=volume[:, None],
+                             value=spectra[:, None, None, None, :],
+                             error=gather(error, used, f'{tag}.error.npy')[:, None, None, None, :],
+                             bounds=bounds, shape=shape, voxels=used)
+    return tally0, irr_cell, mat
@@ -0,0 +1,156 @@
+#! /usr/bin/env python
+
+''' Clearance and waste classification of the activated cells.
+    The limits table (-waste_limits) has a nuclide per row, its label first and then its
+    specific activity limit (Bq/g) for one or more classes, from the most restrictive on;
+    an optional header row names them. The index of a class is the sum over nuclides of
+    specific activity over limit. For every chunk of cells it comes from one sparse
+    (cells*times x nuclides) specific activity matrix times the dense (nuclides x classes)
+    matrix of inverse limits. Nuclides without a limit add nothing.
+    The nuclide tables miss some activity: the apypa threshold drops the smallest
+    nuclides, and so do the cube slots. The index sums are then lower bounds, and the
+    table gives the missing specific activity and the index it would make at the most
+    restrictive limit of each class.
+    A cell at a time goes to the first class with an index up to 1, or is 'above' all of
+    them. The table is written in summary_waste.csv, next to the summary_ACAB files.
+    By Miguel Magan and Octavio Gonzalez'''
+
+import re
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from mc2acab import material
+from mc2acab import redecay
+from mc2acab.pyhtape3x import atomic_mass
+
+CHUNK = 4096  # Cells in each sparse product
+
+def read_limits(filename):
+    ''' Nuclide labels, class names and (nuclides x classes) limits in Bq/g of a limits
+    table, comma, semicolon or blank separated'''
+    rows = []
+    with open(filename, 'r', encoding='utf-8') as infile:
+        for line in infile:
+            line = line.split('#')[0].strip()
+            if line:
+                rows.append(re.split(r'[,;\s]+', line))
+    if not rows:
+        raise ValueError(f'No limits in {filename}')
+    if material.is_number(rows[0][1]):
+        classes = ['limit'] if len(rows[0]) == 2 else [f'class{i}' for i in range(1, len(rows[0]))]
+    else:
+        classes, rows = rows[0][1:], rows[1:]
+    limits = np.array([[float(value) for value in row[1:len(classes) + 1]] for row in rows])
+    if limits.shape != (len(rows), len(classes)) or (limits <= 0).any():
+        raise ValueError(f'{filename} needs a positive limit of every class for every nuclide')
+    return [row[0] for row in rows], classes, limits
+
+def _key(label):
+    "Nuclide of a label as zai, or the label itself if it is not one"
+    zai = redecay.label_zai(label)
+    return str(label).strip() if zai is None else zai
+
+def limit_matrix(names, nuclides, limits):
+    ''' (names x classes) inverse limits of the campaign nuclides names, matched to the
+    nuclides of the limits table by zai. Returns it and the labels without a limit'''
+    rows = {_key(label): i for i, label in enumerate(nuclides)}
+    inverse = np.zeros((len(names), limits.shape[1]))
+    missing = []
+    for j, name in enumerate(names):
+        i = rows.get(_key(name))
+        if i is None:
+            missing.append(name)
+        else:
+            inverse[j] = 1/limits[i]
+    return inverse, missing
+
+def mass_density(mater, density):
+    ''' Density in g/cm3 of material mater of a cell of MCNP density, 0 for void'''
+    if mater is None or density == 0:
+        return 0.0
+    if density < 0:
+        return -density
+    mater1 = material.Mat(mater.number)
+    mater1.zaid, mater1.frac = list(mater.zaid), list(mater.frac)
+    mater1.n2ro(density)  # at/b-cm
+    mass = 0.0
+    for zaid, frac in zip(mater1.zaid, mater1.frac):
+        z, a = divmod(zaid, 1000)
+        if a == 0:
+            a = atomic_mass(z)
+            if a <= 0:
+                raise ValueError(f'Element {z} of material {mater.number} has no natural composition,'
+                                 ' give its isotopes')
+        mass += frac*a
+    return mass/0.6023
+
+def index_sums(campaign, mass, inverse, columns):
+    ''' (cells*times x classes) index sums of a query.Campaign at its time columns, mass
+    being the mass (g) of every cell. Rows are cell by cell, times within'''
+    ntimes = len(columns)
+    mass = np.asarray(mass, dtype=float)
+    ncells = len(campaign.cells)
+    sums = np.zeros((ncells*ntimes, inverse.shape[1]))
+    for start in range(0, ncells, CHUNK):
+        nblock = min(CHUNK, ncells - start)
+        cells, nuclides, values = campaign.entries('decay', start, start + nblock, columns)
+        cell_mass = mass[cells]
+        specific = np.divide(values, cell_mass[:, None], out=np.zeros((len(cells), ntimes)),
+                             where=cell_mass[:, None] > 0)
+        rows = ((cells - start)[:, None]*ntimes + np.arange(ntimes)).ravel()
+        activity = sparse.csr_matrix((specific.ravel(), (rows, np.repeat(nuclides, ntimes))),
+                                     shape=(nblock*ntimes, len(inverse)))
+        sums[start*ntimes:(start + nblock)*ntimes] = activity @ inverse
+    return sums
+
+def _classes(sums, classes):
+    "First class of every row of sums with an index up to 1, 'above' if none"
+    below = sums <= 1
+    return np.where(below.any(axis=1), np.array(classes)[np.argmax(below, axis=1)], 'above')
+
+def missing_activity(campaign, mass, columns):
+    ''' (cells*times) specific activity (Bq/g) of every cell of a query.Campaign at its time
+    columns that is in its total but not in its nuclides, as index_sums'''
+    ntimes = len(columns)
+    mass = np.asarray(mass, dtype=float)
+    ncells = len(campaign.cells)
+    missing = np.zeros((ncells, ntimes))
+    for start in range(0, ncells, CHUNK):
+        nblock = min(CHUNK, ncells - start)
+        cells, _, values = campaign.entries('decay', start, start + nblock, columns)
+        kept = np.zeros((nblock, ntimes))
+        np.add.at(kept, cells - start, values)
+        missing[start:start + nblock] = np.asarray(campaign.total['decay'][start:start + nblock])[:, columns] - kept
+    cell_mass = mass[:, None]
+    missing = np.divide(np.clip(missing, 0, None), cell_mass, out=np.zeros_like(missing), where=cell_mass > 0)
+    return missing.ravel()
+
+def classify(campaign, mass, limits_file, times=None, done=None, outfile='summary_waste.csv'):
+    ''' Index sums and class of every cell done (mask, all if None) of a query.Campaign at
+    times (all of them if None), written in outfile. Returns the table'''
+    nuclides, classes, limits = read_limits(limits_file)
+    names, _ = campaign.index('decay')
+    inverse, unlimited = limit_matrix(names, nuclides, limits)
+    if unlimited:
+        print(f'{len(unlimited)} nuclides of the campaign have no limit in {limits_file}: {unlimited[:10]}')
+    columns = (list(range(len(campaign.times))) if times is None or isinstance(times, str)
+               else sorted({campaign.time_index(time) for time in times}))
+    sums = index_sums(campaign, mass, inverse, columns)
+    table = pd.DataFrame(sums, columns=[f'index_{name}' for name in classes],
+                         index=pd.MultiIndex.from_product([campaign.cells, campaign.times[columns]],
+                                                          names=['cell', 'time']))
+    table['class'] = _classes(sums, classes)
+    missing = missing_activity(campaign, mass, columns)
+    table['missing_Bq/g'] = missing
+    worst = sums + missing[:, None]/limits.min(axis=0)
+    for name, column in zip(classes, worst.T):
+        table[f'max_index_{name}'] = column
+    if done is not None:
+        keep = np.repeat(np.asarray(done, dtype=bool), len(columns))
+        table, worst = table[keep], worst[keep]
+    unsure = (table['class'].to_numpy() != _classes(worst, classes)).sum()
+    if unsure:
+        print(f'{unsure} cell times may be in a worse class: their nuclide tables miss activity'
+              ' (apypa threshold or cube slots), see the max_index columns')
+    table.to_csv(outfile, sep='\t', encoding='utf-8', float_format='%.3e')
+    return table
@@ -0,0 +1,89 @@
+''' Screening.evolve against the analytic Bateman solution bateman.chain'''
+
+import numpy as np
+from mc2acab import bateman
+
+DAY = 86400.0
+
+def _decay(chain_zai, half_lives):
+    "Decay data of the linear chain of chain_zai, the last one stable"
+    decay = {}
+    for zai, daughter, half_life in zip(chain_zai, chain_zai[1:] + [None], half_lives + [0.0]):
+        decay[zai] = {'lambda': np.log(2)/half_life if half_life else 0.0,
+                      'daughters': {daughter: 1.0} if daughter else {}, 'heat': 0.0, 'gamma': 0.0}
+    return decay
+
+def _screening(chain_zai, half_lives, reactions=()):
+    "Screening of the chain from its first nuclide, with the reactions (ZA, MT, LFS)"
+    products, tritium = bateman.reaction_products(reactions)
+    return bateman.Screening(_decay(chain_zai, half_lives), list(reactions), products, tritium, [chain_zai[0]])
+
+def test_two_step_chain():
+    zai = [531310, 541310, 551310]
+    half_lives = [8*DAY, 2*DAY]
+    screening = _screening(zai, half_lives)
+    times = np.array([1, 3, 10, 30])*DAY
+    atoms = screening.evolve(np.array([screening.initial({zai[0]: 1E20})]), np.zeros((1, 0)), [], times)
+    expected = bateman.chain(np.log(2)/np.array(half_lives + [np.inf]), 1E20, times)
+    got = atoms[1:, 0, [screening.index[z] for z in zai]]
+    np.testing.assert_allclose(got, expected, rtol=1E-6, atol=1E-6*1E20)
+
+def test_short_lived_middle():
+    # The middle nuclide lives a minute, in quasi steady state with its parent
+    zai = [420990, 430990, 440990]
+    half_lives = [2.75*DAY, 60.0]
+    screening = _screening(zai, half_lives)
+    assert screening.index[zai[1]] in screening.short
+    times = np.array([0.5, 2, 7, 20])*DAY
+    atoms = screening.evolve(np.array([screening.initial({zai[0]: 1E20})]), np.zeros((1, 0)), [], times)
+    expected = bateman.chain(np.log(2)/np.array(half_lives + [np.inf]), 1E20, times)
+    got = atoms[1:, 0, [screening.index[z] for z in zai]]
+    np.testing.assert_allclose(got[:, :2], expected[:, :2], rtol=1E-3)
+    # The parent feeds the daughter directly, ahead by at most the stock of the middle one
+    assert (np.abs(got[:, 2] - expected[:, 2]) <= 1.01*expected[:, 1]).all()
+
+def test_irradiation():
+    # Co59 (n,g) Co60 -> Ni60 during one phase at a constant rate, then cooling
+    zai = [270590, 270600, 280600]
+    half_lives = [5.27*365.25*DAY]
+    rate = 1E-8  # 1/s
+    screening = bateman.Screening(_decay(zai[1:], half_lives), [(27059, 102, 0)],
+                                  *bateman.reaction_products([(27059, 102, 0)]), [zai[0]])
+    duration = 100*DAY
+    cooling = np.array([1, 365.25, 3652.5])*DAY
+    atoms = screening.evolve(np.array([screening.initial({zai[0]: 1E22})]), np.array([[rate]]),
+                             [(duration, 1.0)], cooling)
+    lambdas = np.array([rate, np.log(2)/half_lives[0], 0.0])
+    end = bateman.chain(lambdas, 1E22, [duration])[0]
+    columns = [screening.index[z] for z in zai]
+    np.testing.assert_allclose(atoms[0, 0, columns], end, rtol=1E-6)
+    # Co60 decays to Ni60 after the shutdown
+    decayed = end[1]*np.exp(-lambdas[1]*cooling)
+    expected = np.column_stack([np.full(len(cooling), end[0]), decayed, end[2] + end[1] - decayed])
+    np.testing.assert_allclose(atoms[1:, 0, columns], expected, rtol=1E-6)
+
+def test_irradiation_short_lived_product():
+    # Mo98 (n,g) Mo99 is taken as a one minute product, in quasi steady state while irradiating
+    zai = [420980, 420990, 430990]
+    half_lives = [60.0, 6.0*3600]
+    rate = 1E-6  # 1/s
+    screening = bateman.Screening(_decay(zai[1:], half_lives), [(42098, 102, 0)],
+                                  *bateman.reaction_products([(42098, 102, 0)]), [zai[0]])
+    assert screening.index[zai[1]] in screening.short
+    atoms = screening.evolve(np.array([screening.initial({zai[0]: 1E22})]), np.array([[rate]]),
+                             [(DAY, 1.0)], [])
+    lambdas = np.array([rate, np.log(2)/half_lives[0], np.log(2)/half_lives[1]])
+    end = bateman.chain(lambdas, 1E22, [DAY])[0]
+    np.testing.assert_allclose(atoms[0, 0, [screening.index[z] for z in zai]], end, rtol=1E-3)
+
+def test_reduce_rates():
+    # The per cell reduction adds the rates to terms worked out once, as reducing the full matrix
+    zai = [420990, 430990, 440990]
+    reactions = [(42098, 102, 0), (42099, 16, 0), (44099, 103, 0)]
+    products, tritium = bateman.reaction_products(reactions)
+    screening = bateman.Screening(_decay(zai, [2.75*DAY, 60.0]), reactions, products, tritium, [420980, 440990])
+    rates = np.array([1E-6, 3E-7, 2E-8])[:len(screening.kept)]
+    reduced, quasi = screening.reduce_rates(rates)
+    expected_reduced, expected_quasi = screening.reduce(screening.decay + screening.transmutation(rates))
+    np.testing.assert_allclose(reduced.toarray(), expected_reduced.toarray(), rtol=1E-12, atol=1E-20)
+    np.testing.assert_allclose(quasi.toarray(), expected_quasi.toarray(), rtol=1E-12, atol=1E-20)
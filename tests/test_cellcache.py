@@ -0,0 +1,38 @@
+''' Keys, storage and eviction of the result cache'''
+
+import os
+from mc2acab import cellcache
+
+def _folder(path):
+    "Cell folder with its ACAB and COLLAPS inputs and a library file"
+    path.mkdir()
+    for name in cellcache.KEY_FILES:
+        (path / name).write_text(f'{name} of the cell\n')
+    library = path / 'DECAY.dat'
+    library.write_text('decay data\n')
+    return str(path), str(library)
+
+def test_cell_key(tmp_path):
+    folder, library = _folder(tmp_path / 'cell')
+    key = cellcache.cell_key(folder, [library], id_lib='EAF', collapse='collaps')
+    assert key == cellcache.cell_key(folder, [library], collapse='collaps', id_lib='EAF')
+    assert key != cellcache.cell_key(folder, [library], id_lib='EAF', collapse='numpy')
+    stat = os.stat(library)
+    os.utime(library, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))  # Library updated
+    assert key != cellcache.cell_key(folder, [library], id_lib='EAF', collapse='collaps')
+    with open(os.path.join(folder, 'inp.5'), 'a', encoding='utf-8') as inp:
+        inp.write('another material\n')
+    assert key != cellcache.cell_key(folder, [library], id_lib='EAF', collapse='collaps')
+
+def test_get_put_evict(tmp_path):
+    store = str(tmp_path / 'store')
+    assert cellcache.get(store, 'ab' + '0'*62) is None
+    keys = [f'{i:02d}' + '0'*62 for i in range(3)]
+    for i, key in enumerate(keys):
+        cellcache.put(store, key, ('outputs', i, 'x'*2**16))
+        os.utime(cellcache._entry(store, key), (i, i))  # Oldest first
+    assert cellcache.get(store, keys[0])[1] == 0  # Touched, now the most recent
+    removed, size = cellcache.evict(store, max_gb=1.5*2**16/2**30)
+    assert removed == 2 and size < 1.5*2**16
+    assert cellcache.get(store, keys[0]) is not None
+    assert cellcache.get(store, keys[1]) is None and cellcache.get(store, keys[2]) is None
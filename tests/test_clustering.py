@@ -0,0 +1,38 @@
+''' Clustering of the cells and scaling of the results of a representative'''
+
+import numpy as np
+import pandas as pd
+from mc2acab import clustering
+from mc2acab import redecay
+
+def _spectrum(shape, flux):
+    "Group spectrum of shape, total flux last"
+    shape = np.asarray(shape, dtype=float)
+    return np.append(shape/shape.sum()*flux, flux)
+
+def test_cluster():
+    spectra = np.array([_spectrum([1, 1, 1], 1.0), _spectrum([1, 1, 1], 5.0), _spectrum([1, 1, 1.01], 2.0),
+                        _spectrum([1, 0, 3], 3.0), _spectrum([1, 1, 1], 9.0), _spectrum([1, 1, 1], 9.0)])
+    keys = [(1, -7.8), (1, -7.8), (1, -7.8), (1, -7.8), (2, -7.8), None]
+    leader, distance = clustering.cluster(spectra, keys, tol=0.05)
+    # Largest flux first, other shapes, materials and unclustered cells lead their own
+    assert list(leader) == [1, 1, 1, 3, 4, 5]
+    assert distance[0] == 0 and 0 < distance[2] < 0.05
+    assert clustering.sample(leader, distance, 1) == [2]
+
+def test_scale_outputs():
+    times = [0.0, 3600.0]
+    table = pd.DataFrame({'Co60': [2.0, 1.0], 'Total': [2.0, 1.0]}, index=times)
+    inventory = {260560: 1E22}  # atoms/cm3
+    initial_mol = 1E22*10/redecay.AVOGADRO
+    mol = pd.DataFrame({'Fe56': [initial_mol - 1E-6]*2, 'Co60': [1E-6]*2, 'Total': [initial_mol]*2}, index=times)
+    initial = clustering.initial_mol(mol.columns, inventory, 10.0)
+    assert initial['Fe56'] == initial['Total'] == initial_mol and initial['Co60'] == 0
+    scaled = clustering.scale_outputs((table, table, table, table, mol), 3.0, 2.0, initial)
+    pd.testing.assert_frame_equal(scaled[0], table*6.0)  # Bq of the zone, flux and volume
+    pd.testing.assert_frame_equal(scaled[1], table*3.0)  # Per cm3, flux only
+    # The initial inventory only goes with the volume, what was induced also with the flux
+    np.testing.assert_allclose(scaled[4]['Co60'], 6E-6)
+    np.testing.assert_allclose(scaled[4]['Fe56'], 2*(initial_mol - 3E-6))
+    np.testing.assert_allclose(scaled[4]['Total'], 2*initial_mol)
+    assert clustering.scale_outputs(None, 3.0, 2.0) is None
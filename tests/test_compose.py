@@ -0,0 +1,39 @@
+''' Grouping of the cells of a rotating element and their time-averaged tally'''
+
+from types import SimpleNamespace
+import numpy as np
+import pytest
+
+for module in ['tqdm', 'apypa', 'tally']:  # Needed by MCNP_ACAB_library
+    pytest.importorskip(module)
+
+from mc2acab import MCNP_ACAB_library as MCNPACAB
+
+def _tally(cells):
+    "Tally of cells, the flux of a cell being its number, unit volumes but the last one"
+    ncells = len(cells)
+    value = np.repeat(np.asarray(cells, dtype=float)[:, None], 3, axis=1)[:, None, None, None, :]
+    mass = np.ones((ncells, 1))
+    mass[-1] = 3.0
+    return SimpleNamespace(n=4, cells=cells, ncells=ncells, ebins=[1.0, 2.0], mass=mass, value=value)
+
+def test_comp_matrix():
+    tally0 = _tally([11, 12, 19, 21, 3, 29])
+    matrix, members = MCNPACAB.comp_matrix(tally0, 9)
+    # 11 and 12 turn with 19, 21 with 29, 3 is not rotating
+    assert members == [[0, 1, 2], [3, 5], [4]]
+    np.testing.assert_allclose(matrix.toarray()[1], [0, 0, 0, 0.25, 0, 0.75])
+    composed, compose = MCNPACAB.tally_compose(tally0, 9)
+    assert composed.cells == [11, 21, 3] and compose == {11: [11, 12, 19], 21: [21, 29]}
+    np.testing.assert_allclose(composed.value[:, 0, 0, 0, -1], [14, 0.25*21 + 0.75*29, 3])
+    np.testing.assert_allclose(composed.mass[:, 0], [3, 4, 1])
+
+def test_comp_matrix_materials():
+    tally0 = _tally([100, 101, 108, 109])
+    same = {100: (1, -7.8), 101: (1, -7.8), 108: (1, -7.8), 109: (1, -7.8)}
+    _, members = MCNPACAB.comp_matrix(tally0, 9, same.get)
+    assert members == [[0, 1, 2, 3]]
+    other = dict(same)
+    other[108] = (2, -2.3)  # Another cell sharing the number, not the material
+    with pytest.raises(ValueError):
+        MCNPACAB.comp_matrix(tally0, 9, other.get)
@@ -0,0 +1,27 @@
+''' Scenarios of cycles.cycle_scenario against the single irradiation of the original
+scenary_generator, kept in data/'''
+
+import os
+import numpy as np
+from mc2acab import cycles
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+def _read(name):
+    with open(os.path.join(DATA, name), 'r', encoding='utf-8') as infile:
+        return infile.read()
+
+def test_single_irradiation():
+    scenario = cycles.cycle_scenario([(1E8, 1.0, 0)], [10, 5000, 3.1E7], [0, 1, 0, 1])
+    assert scenario == _read('scenario.sce')
+
+def test_compress_history():
+    # A hundred short equal pulses act as one long phase at their average power
+    history = [(60.0, 1.0, 0), (60.0, 0.0, 0)]*100
+    merged, error = cycles.compress_history(history, max_error=0.01, min_half_life=3600.0)
+    assert len(merged) == 1 and error <= 0.01
+    np.testing.assert_allclose(merged[0][:2], (12000.0, 0.5))
+    # The output of a phase closes its run
+    history[99] = (60.0, 0.0, 1)
+    merged, _ = cycles.compress_history(history, max_error=0.01, min_half_life=3600.0)
+    assert [phase[2] for phase in merged] == [1, 0] and merged[0][0] == 6000.0
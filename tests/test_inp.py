@@ -0,0 +1,46 @@
+''' inp.5 decks of render_inp and the campaign options, byte-identical to those of the
+original create_inp (data/) when no new option is given'''
+
+import os
+from types import SimpleNamespace
+import pytest
+
+for module in ['tqdm', 'apypa', 'tally']:  # Needed by MCNP_ACAB_library
+    pytest.importorskip(module)
+
+from mc2acab import MCNP_ACAB_library as MCNPACAB
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+MAT = SimpleNamespace(zaid=[26054, 26056, 26057, 26058, 24052, 28058, 25055],
+                      frac=[5.8E-2, 0.9175, 2.1E-2, 2.8E-3, 1.7E-3, 1E-4, 3.3E-5])
+FEEDS = (None, [27059, 25055], [1.5E10, 2.0E9])
+
+def _read(name):
+    with open(os.path.join(DATA, name), 'r', encoding='utf-8') as infile:
+        return infile.read()
+
+def _options(**changes):
+    "Options of a campaign without any of the optional features"
+    options = {'-decay_times': None, '-decay_outs': None, '-apypa_verge': 0.95, '-nuc_lib': 'eaf',
+               '-id_Egroup': 'vitj', '-sce_file': None, '-save': False, '-passive_sector': None}
+    options.update(changes)
+    return options
+
+def _reqs(outp):
+    return {'-outpfile': str(outp), '-part': 'n', '-tally_num': 4, '-st': 1E17, '-irr_time': 3.6E6}
+
+def test_render_inp_automatic():
+    template = MCNPACAB.inp_template(MCNPACAB.compile_scenario(3.6E6))
+    assert MCNPACAB.render_inp(template, 2.345E12, MAT, 12.5) == _read('inp_auto.5')
+    assert MCNPACAB.render_inp(template, 0, MAT, 12.5, FEEDS) == _read('inp_fed.5')
+
+def test_campaign_without_options(tmp_path):
+    reqs = _reqs(tmp_path/'outp')
+    (tmp_path/'outp').write_text('outp\n')
+    template = MCNPACAB.map_kwargs(reqs, _options())['template']
+    assert MCNPACAB.render_inp(template, 2.345E12, MAT, 12.5) == _read('inp_auto.5')
+    # Options left unset do not change the campaign
+    unset = {'-resolution': None, '-prune': None, '-collapse_templates': None, '-rebinned': False,
+             '-meshtal': None, '-voxel_mat': None, '-history': None}
+    assert MCNPACAB.campaign_key(reqs, _options()) == MCNPACAB.campaign_key(reqs, _options(**unset))
+    assert MCNPACAB.campaign_key(reqs, _options()) != MCNPACAB.campaign_key(reqs, _options(**{'-resolution': 60.0}))
@@ -0,0 +1,20 @@
+''' Stage metrics of a cell'''
+
+import subprocess
+import sys
+from mc2acab import metrics
+
+def test_cell_metrics(tmp_path):
+    cell = metrics.CellMetrics(10)
+    with cell.stage('acab'):
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+    with cell.stage('parse'):
+        pass
+    metrics_dir = str(tmp_path/'metrics')
+    cell.write(metrics_dir)
+    records = metrics.load(metrics_dir)
+    assert len(records) == 1 and records[0]['cell'] == 10
+    # The peak RSS of the children is a running maximum of the worker, not a stage figure
+    assert records[0]['children_peak_rss_kb'] > 0
+    assert set(records[0]['stages']['acab']) == {'wall', 'cpu', 'child_utime', 'child_stime'}
+    assert 'acab' in metrics.report(records)
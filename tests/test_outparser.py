@@ -0,0 +1,26 @@
+''' Native reading of the last F4 tally dump of an outp, on the synthetic benchmark outp'''
+
+import os
+import sys
+import numpy as np
+from mc2acab import MCNP_outparser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'benchmarks'))
+import synthetic  # pylint: disable=wrong-import-position
+
+def test_read_f4(tmp_path, monkeypatch):
+    outp = tmp_path/'outp'
+    cells, volumes, flux = synthetic.write_outp(str(outp), 40, 3, ndumps=3, seed=1)
+    # Non ASCII text ahead of the tally: the offsets are in bytes, not characters
+    text = outp.read_bytes()
+    outp.write_bytes('          Título del modelo: ñ\n'.encode() + text)
+    monkeypatch.setattr(MCNP_outparser, 'TALLY_CHUNK', 4096)  # The dump spans several blocks
+    got_cells, got_volumes, ebins, got_flux, got_error = MCNP_outparser.read_f4(str(outp), 4)
+    assert got_cells.tolist() == cells.tolist()
+    np.testing.assert_allclose(got_volumes, volumes, rtol=1E-5)
+    np.testing.assert_allclose(ebins, synthetic.ENERGY_BINS, rtol=1E-4)
+    np.testing.assert_allclose(got_flux[:, :-1], flux, rtol=1E-5)
+    np.testing.assert_allclose(got_flux[:, -1], flux.sum(axis=1), rtol=1E-5)
+    assert got_error.shape == got_flux.shape
+    tally0 = MCNP_outparser.f4_tally(str(outp), 4)
+    assert tally0.ncells == 40 and tally0.value.shape == (40, 1, 1, 1, len(ebins) + 1)
@@ -0,0 +1,50 @@
+''' Staged prepare/execute/parse run of the cells, with stand-in stages'''
+
+import multiprocessing
+from types import SimpleNamespace
+import pytest
+
+for module in ['tqdm', 'apypa', 'tally']:  # Needed by MCNP_ACAB_library
+    pytest.importorskip(module)
+
+from mc2acab import MCNP_ACAB_library as MCNPACAB
+from mc2acab import pipeline
+from mc2acab import sharedflux
+
+def test_stage_workers():
+    assert pipeline.stage_workers(None, 16) == [2, 12, 2]
+    assert all(sum(pipeline.stage_workers(None, nproc)) == nproc for nproc in range(3, 65))
+    assert pipeline.stage_workers('1,3,2', 16) == [1, 3, 2]
+    with pytest.raises(ValueError):
+        pipeline.stage_workers('1,0,2', 16)
+
+def _prepare(n):
+    "Cell 3 has nothing to run, cell 5 fails"
+    if n == 5:
+        raise RuntimeError('no material')
+    return SimpleNamespace(n=n, finished=n == 3, outputs='void' if n == 3 else None, executed=False)
+
+def _execute(job):
+    job.executed = True
+
+def _parse(job):
+    assert job.executed
+    return ('parsed', job.n)
+
+def test_pipeline(monkeypatch):
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        pytest.skip('The stand-in stages reach the workers by fork')
+    # The workers are forked, so they run the stand-ins
+    monkeypatch.setattr(sharedflux, 'init_worker', lambda *args: None)
+    monkeypatch.setattr(sharedflux, 'prepare', _prepare)
+    monkeypatch.setattr(sharedflux, 'finish', lambda n, outputs: (n, outputs, True))
+    monkeypatch.setattr(sharedflux, 'cell_number', lambda n: 100 + n)
+    monkeypatch.setattr(MCNPACAB, 'execute_cell', _execute)
+    monkeypatch.setattr(MCNPACAB, 'parse_cell', _parse)
+    pending = list(range(12))
+    with pipeline.Pipeline([2, 3, 2], 2, multiprocessing.get_context('fork'), ()) as staged:
+        results = {n: (outputs, done) for n, outputs, done in staged.run(pending)}
+        assert 'prepare 2, execute 3, parse 2' in staged.report()
+    assert sorted(results) == pending
+    assert results[3] == ('void', True) and results[5] == (None, False)
+    assert all(results[n] == (('parsed', n), True) for n in pending if n not in (3, 5))
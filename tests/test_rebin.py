@@ -0,0 +1,22 @@
+''' Overlap matrix of the rebinning onto other groups'''
+
+import numpy as np
+from mc2acab import rebin
+
+def test_overlap_matrix():
+    source = [1.0, 4.0, 100.0, 300.0]
+    target = [2.0, 10.0, 200.0]
+    lethargy = rebin.overlap_matrix(source, target).toarray()
+    # Every column adds up to 1, what is out of range goes to the edge groups
+    np.testing.assert_allclose(lethargy.sum(axis=0), 1.0)
+    np.testing.assert_allclose(lethargy[:, 0], [1, 0])
+    np.testing.assert_allclose(lethargy[:, 1], [np.log(10/4), np.log(100/10)]/np.log(100/4))
+    np.testing.assert_allclose(lethargy[:, 2], [0, 1])
+    flat = rebin.overlap_matrix(source, target, 'flat').toarray()
+    np.testing.assert_allclose(flat[:, 1], [6/96, 90/96])
+
+def test_rebin():
+    matrix = rebin.overlap_matrix([0.5, 1.0, 4.0], [0.5, 2.0, 4.0], 'flat')
+    spectra = rebin.rebin([[1.0, 3.0, 4.0], [0.0, 6.0, 6.0]], matrix)
+    np.testing.assert_allclose(spectra, [[2.0, 2.0, 4.0], [2.0, 4.0, 6.0]])
+    assert rebin.tally_bounds([1.0, 2.0], 2).tolist() == [0.0, 1.0, 2.0]
@@ -0,0 +1,57 @@
+''' Decay-only re-evaluation of stored inventories'''
+
+import numpy as np
+import pandas as pd
+import pytest
+from mc2acab import bateman
+from mc2acab import redecay
+
+HALF_LIFE = 5.27*365.25*86400.0  # Co60, s
+
+def _decay():
+    return {270600: {'lambda': np.log(2)/HALF_LIFE, 'daughters': {280600: 1.0}, 'heat': 2.6E6, 'gamma': 2.5E6},
+            280600: {'lambda': 0.0, 'daughters': {}, 'heat': 0.0, 'gamma': 0.0}}
+
+def test_label_zai():
+    assert redecay.label_zai('Co60') == redecay.label_zai('CO 60') == redecay.label_zai('Co-60') == 270600
+    assert redecay.label_zai('Co60m') == 270601
+    assert redecay.label_zai('Total') is None and redecay.label_zai(1.5) is None
+
+def test_evaluate():
+    lam = np.log(2)/HALF_LIFE
+    times = [0.0, 3600.0]
+    mol = pd.DataFrame({'Co60': [1E-3, 0.9E-3], 'Total': [1E-3, 0.9E-3]}, index=times)
+    activity = mol*redecay.AVOGADRO*lam
+    dose = activity*2E-9
+    inventories, dose_per_bq = redecay.shutdown_inventories([(activity, None, None, dose, mol), None])
+    assert inventories[1] == {} and dose_per_bq[0] == {270600: 2E-9}
+    cooling = [0.0, HALF_LIFE, 2*HALF_LIFE]
+    bq, heat, gamma, mSv = redecay.evaluate(_decay(), inventories, dose_per_bq, [2.0, 1.0], cooling)
+    expected = 1E-3*redecay.AVOGADRO*lam*np.array([1.0, 0.5, 0.25])
+    np.testing.assert_allclose(bq[0], expected)
+    np.testing.assert_allclose(heat[0], expected*2.6E6*bateman.EV/2.0)
+    np.testing.assert_allclose(gamma[0], expected*2.5E6*bateman.EV/2.0)
+    np.testing.assert_allclose(mSv[0], expected*2E-9)
+    np.testing.assert_allclose(bq[1], 0.0)
+
+def test_evaluate_chain():
+    # Mo99 -> Tc99m -> Tc99 from pure Mo99, against the analytic Bateman solution
+    zai = [420990, 430991, 430990]
+    half_lives = [65.94*3600, 6.0067*3600]
+    lambdas = np.log(2)/np.array(half_lives)
+    decay = {zai[0]: {'lambda': lambdas[0], 'daughters': {zai[1]: 1.0}, 'heat': 0.0, 'gamma': 0.0},
+             zai[1]: {'lambda': lambdas[1], 'daughters': {zai[2]: 1.0}, 'heat': 1.4E5, 'gamma': 1.3E5},
+             zai[2]: {'lambda': 0.0, 'daughters': {}, 'heat': 0.0, 'gamma': 0.0}}
+    cooling = np.array([0.0, 3600.0, 86400.0, 10*86400.0])
+    bq, heat, _, _ = redecay.evaluate(decay, [{zai[0]: 1E18}], [{}], [1.0], cooling)
+    atoms = bateman.chain(np.append(lambdas, 0.0), 1E18, cooling)
+    np.testing.assert_allclose(bq[0], atoms[:, :2] @ lambdas, rtol=1E-8)
+    np.testing.assert_allclose(heat[0], atoms[:, 1]*lambdas[1]*1.4E5*bateman.EV, rtol=1E-8)
+
+def test_from_time():
+    mol = pd.DataFrame({'Co60': [1E-3, 0.9E-3], 'Total': [1E-3, 0.9E-3]}, index=[0.0, 3600.0])
+    outputs = (mol, None, None, mol, mol)
+    inventories, _ = redecay.shutdown_inventories([outputs], 3600.0*(1 + 1E-5))
+    assert inventories[0][270600] == 0.9E-3*redecay.AVOGADRO
+    with pytest.raises(ValueError):  # Not one of the output times
+        redecay.shutdown_inventories([outputs], 1800.0)
@@ -0,0 +1,53 @@
+''' Unit responses superposed for other irradiation times'''
+
+import numpy as np
+import pytest
+
+for module in ['tqdm', 'apypa', 'tally']:  # Needed by MCNP_ACAB_library
+    pytest.importorskip(module)
+
+from mc2acab import bateman
+from mc2acab import response
+
+def test_superpose_constant():
+    # A stable product: every pulse adds the same, a fractional pulse its fraction
+    times = [0.0, 10.0, 100.0, 1000.0]
+    values = np.ones((4, 2))*[1.0, 3.0]
+    result = response.superpose(times, values, 100.0, 250.0, [0.0, 50.0])
+    np.testing.assert_allclose(result, [[2.5, 7.5], [2.5, 7.5]])
+    with pytest.raises(ValueError):
+        response.superpose(times, values, 100.0, 50.0, [0.0])
+    with pytest.raises(ValueError):  # Beyond the grid
+        response.superpose(times, values, 100.0, 1000.0, [500.0])
+
+def _activity(rate, lam, irr_time, cooling_times):
+    "Activity of a product made at rate from a target, as bateman.chain gives it"
+    lambdas = np.array([rate, lam, 0.0])
+    shutdown = bateman.chain(lambdas, 1.0, [irr_time])[0]
+    return lam*shutdown[1]*np.exp(-lam*np.asarray(cooling_times))
+
+def test_superpose_analytic():
+    rate, lam, ref = 1E-12, np.log(2)/(8*86400), 86400.0
+    grid = np.concatenate([[0.0], np.geomspace(10, 1E8, 60)])
+    values = np.column_stack([_activity(rate, lam, ref, grid), 2*_activity(rate, lam, ref, grid)])
+    cooling = np.array([0.0, 37.0, 3600.0, 5E5, 2.2E6])
+    # Whole pulses, between the points of the grid
+    derived = response.superpose(grid, values, ref, 7*ref, cooling)
+    expected = _activity(rate, lam, 7*ref, cooling)
+    np.testing.assert_allclose(derived[:, 0], expected, rtol=1E-6)
+    np.testing.assert_allclose(derived[:, 1], 2*expected, rtol=1E-6)
+    # The fractional first pulse in proportion: exact but for its own growth, lam*ref/2 at most
+    derived = response.superpose(grid, values, ref, 7.5*ref, cooling)
+    expected = _activity(rate, lam, 7.5*ref, cooling)
+    np.testing.assert_allclose(derived[:, 0], expected, rtol=lam*ref/2*(0.5/7.5))
+
+def test_flag_cells():
+    # The target is removed as exp(-rate*t): cells burning more than tol of it run again
+    rates = np.array([1E-12, 1E-9, 5E-9, 1E-12])
+    reference = {'removal': rates, 'radioactive': np.array([False, False, False, True]), 'source': 1E15}
+    irr_time = 1E6
+    burnt = np.array([1 - bateman.chain([rate, 0.0], 1.0, [irr_time])[0, 0] for rate in rates])
+    flagged = response.flag_cells(reference, 1E15, irr_time, tol=5E-4)
+    assert list(flagged) == [1, 2, 3] and burnt[1] > 5E-4 > burnt[0]
+    # A fifth of the source burns five times slower
+    assert list(response.flag_cells(reference, 0.2E15, irr_time, tol=5E-4)) == [2, 3]
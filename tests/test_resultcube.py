@@ -0,0 +1,109 @@
+''' Result cube round trip, queries over it and waste index sums'''
+
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+import pytest
+from mc2acab import resultcube
+from mc2acab import query
+from mc2acab import waste
+
+TIMES = [0.0, 3600.0]
+NAMES = ['Bq', 'gamma_W/cm3', 'W/cm3', 'mSv/h', 'mol']
+
+def _table(values, name):
+    "Times by rows table of nuclides values, with their Total"
+    table = pd.DataFrame(values, index=TIMES)
+    table['Total'] = table.sum(axis=1)
+    table.columns.name = name
+    return table
+
+def _outputs(scale):
+    "MCNP_ACAB_Map outputs of a cell, gamma by groups"
+    decay = _table({'Co60': [2.0*scale, 1.9*scale], 'Mn54': [1.0*scale, 0.5*scale],
+                    'Fe55': [0.1*scale, 0.1*scale]}, NAMES[0])
+    gamma = _table({1.0: [0.5*scale, 0.4*scale], 2.0: [0.2*scale, 0.1*scale]}, NAMES[1]).T
+    gamma.columns.name = NAMES[1]
+    return (decay, gamma, _table({'Co60': [scale, scale]}, NAMES[2]),
+            _table({'Co60': [3.0*scale, 2.9*scale]}, NAMES[3]), _table({'Co60': [1E-9, 1E-9]}, NAMES[4]))
+
+def _cube(tmp_path, nslots=3):
+    tally0 = SimpleNamespace(cells=[10, 20, 30], ncells=3, mass=np.array([[1.0], [2.0], [4.0]]))
+    irr_cell = [SimpleNamespace(density=-7.8, mat=1), SimpleNamespace(density=-7.8, mat=1),
+                SimpleNamespace(density=-2.3, mat=2)]
+    cube = resultcube.create(str(tmp_path/'cube'), 'key', tally0, irr_cell, nslots=nslots, ntimes=4)
+    cube.write_cell(0, _outputs(1.0))
+    cube.write_cell(1, None)
+    cube.write_cell(2, _outputs(2.0))
+    return cube
+
+def test_write_read(tmp_path):
+    cube = _cube(tmp_path)
+    assert resultcube.open_cube(cube.cube_dir, 'other') is None
+    cube = resultcube.open_cube(cube.cube_dir, 'key')
+    assert list(cube.status) == [resultcube.DONE, resultcube.NULL, resultcube.DONE]
+    assert cube.cell_tables(1) is None
+    for got, expected in zip(cube.cell_tables(2), _outputs(2.0)):
+        pd.testing.assert_frame_equal(got, expected, check_names=False)
+        assert got.columns.name == expected.columns.name
+    assert cube.cell_totals(0)['Total_Bq'].tolist() == [3.1, 2.5]
+
+def test_truncated(tmp_path):
+    cube = _cube(tmp_path, nslots=2)
+    # The largest ones are kept, the total is exact
+    decay = cube.cell_tables(0)[0]
+    assert list(decay.columns) == ['Co60', 'Mn54', 'Total'] and decay['Total'].tolist() == [3.1, 2.5]
+    assert cube.truncated[0, 0] == 1 and cube.truncated[1, 0] == 0
+
+def test_campaign(tmp_path):
+    campaign = query.Campaign.from_cube(_cube(tmp_path))
+    totals = campaign.nuclide_totals('decay', 0.0)
+    assert totals['Co60'] == 6.0 and totals['Mn54'] == 3.0
+    # Per cm3, volume weighted
+    assert campaign.nuclide_totals('heat', 3600.0)['Co60'] == 1.0 + 2.0*4.0
+    assert list(campaign.top('decay', 0.0, 1).index) == ['Co60']
+    names, values = campaign.top_per_cell('dose', 3600.0, 1)
+    assert names[2, 0] == 'Co60' and values[2, 0] == 5.8
+    groups = campaign.group_totals('decay', 'material', 0.0)
+    assert groups.loc[1, 0.0] == 3.1 and groups.loc[2, 0.0] == 6.2 and groups.loc[2, 'vol'] == 4.0
+    heat = campaign.group_totals('heat', 'density', 0.0)
+    assert heat.loc[-2.3, (0.0, 'mean')] == 2.0
+
+def test_index_sums(tmp_path):
+    campaign = query.Campaign.from_cube(_cube(tmp_path))
+    names, _ = campaign.index('decay')
+    inverse, missing = waste.limit_matrix(names, ['Co-60', 'Mn54'], np.array([[0.1, 1.0], [10.0, 100.0]]))
+    assert missing == ['Fe55']
+    sums = waste.index_sums(campaign, [2.0, 1.0, 8.0], inverse, [0, 1])
+    # Cell by cell, times within: Bq/g over the limit of every class
+    np.testing.assert_allclose(sums[:2], [[1.0/0.1 + 0.5/10, 1.0 + 0.005], [0.95/0.1 + 0.25/10, 0.95 + 0.0025]])
+    np.testing.assert_allclose(sums[2:4], 0.0)
+    np.testing.assert_allclose(sums[4], [0.5/0.1 + 0.25/10, 0.5 + 0.0025])
+
+def _apypas():
+    "summary_apypas.npy records of the cells of _cube"
+    apypas = np.zeros(3, dtype=[('cell', int), ('vol', float), ('decay', object), ('gamma', object),
+                                ('heat', object), ('dose', object), ('mol', object)])
+    apypas[0] = (10, 1.0) + _outputs(1.0)
+    apypas[1] = (20, 2.0, 0, 0, 0, 0, 0)
+    apypas[2] = (30, 4.0) + _outputs(2.0)
+    return apypas
+
+def test_campaign_apypas(tmp_path):
+    cube = query.Campaign.from_cube(_cube(tmp_path, nslots=2))
+    apypas = query.Campaign.from_apypas(_apypas(), [-7.8, -7.8, -2.3], [1, 1, 2])
+    assert isinstance(apypas.values['decay'], query.Entries)
+    assert apypas.index('decay')[0] == ['Co60', 'Fe55', 'Mn54']
+    pd.testing.assert_series_equal(apypas.nuclide_totals('heat', 0.0), cube.nuclide_totals('heat', 0.0))
+    pd.testing.assert_frame_equal(apypas.nuclide('decay', 'Mn54'), cube.nuclide('decay', 'Mn54'))
+    names, values = apypas.top_per_cell('decay', 3600.0, 4)
+    assert names[0].tolist() == ['Co60', 'Mn54', 'Fe55', ''] and values[2].tolist() == [3.8, 1.0, 0.2, 0.0]
+    assert names[1].tolist() == [''] * 4
+    # The cube of two slots dropped Fe55 of both cells, and says so
+    assert 'Fe55' not in cube.nuclide_totals('decay', 0.0)
+    assert cube.nuclide_totals('decay', 0.0).attrs['truncated'] == (2, 2)
+    assert cube.top('decay', 0.0, 1, cells=[0]).attrs['truncated'] == (1, 1)
+    assert apypas.nuclide('decay', 'Fe55').attrs['truncated'] == (0, 0)
+    pd.testing.assert_frame_equal(apypas.group_totals('dose', 'material'), cube.group_totals('dose', 'material'))
+    with pytest.raises(ValueError):
+        apypas.group_totals('dose', 'materials')
@@ -0,0 +1,49 @@
+''' Planning, claiming, requeueing and gathering the tasks of a campaign'''
+
+import os
+import pickle
+from types import SimpleNamespace
+import numpy as np
+import pytest
+
+for module in ['tqdm', 'apypa', 'tally']:  # Needed by MCNP_ACAB_library
+    pytest.importorskip(module)
+
+from mc2acab import taskqueue
+from mc2acab import material
+from mc2acab import cell as cel
+from mc2acab import MCNP_ACAB_library as MCNPACAB
+
+def _campaign(ncells=3):
+    "Tally, materials and cells of a small campaign, the last cell without material"
+    tally0 = SimpleNamespace(cells=[10*(n + 1) for n in range(ncells)], ncells=ncells,
+                             mass=np.ones((ncells, 1)), value=np.ones((ncells, 1, 1, 1, 4)))
+    mater = material.Mat(1)
+    mater.zaid, mater.frac = [26056], [1.0]
+    mat = [mater]*(ncells - 1) + [None]
+    irr_cell = []
+    for ncell in tally0.cells:
+        irr_cell.append(cel.Cell(ncell))
+        irr_cell[-1].mat, irr_cell[-1].density = 1, -7.8
+    return tally0, mat, irr_cell
+
+def test_plan_claim_gather(tmp_path, monkeypatch):
+    monkeypatch.setattr(MCNPACAB, 'map_kwargs', lambda reqs, options: {})
+    monkeypatch.chdir(tmp_path)
+    tally0, mat, irr_cell = _campaign()
+    taskqueue.plan('queue', tally0, mat, irr_cell, {}, {}, key='k', cells=[0, 2], skipped=[1])
+    assert sorted(os.listdir('queue/pending')) == ['cell_10.task', 'cell_30.task']
+    with open('queue/pending/cell_30.task', 'rb') as infile:
+        assert pickle.load(infile)['mat'] == (-1, [], [])  # Missing material, an empty one
+    claimed = [taskqueue.claim('queue'), taskqueue.claim('queue')]
+    assert taskqueue.claim('queue') is None
+    assert len({os.path.basename(name).split('.task')[0] for name in claimed}) == 2
+    # A failed task goes back to pending
+    os.rename(claimed[1], os.path.join('queue', 'failed', os.path.basename(claimed[1])))
+    assert taskqueue.requeue('queue') == 1
+    assert taskqueue.requeue('queue', stale_hours=0) == 1  # The running one, as if its worker died
+    assert len(os.listdir('queue/pending')) == 2
+    MCNPACAB.journal_write('queue/done', 10, 'k', 'outputs of 10')
+    campaign, totaldata = taskqueue.gather('queue')
+    assert campaign['key'] == 'k' and campaign['cells'] == [10, 20, 30]
+    assert totaldata == ['outputs of 10', None, None]
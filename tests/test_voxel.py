@@ -0,0 +1,45 @@
+''' Column format meshtal parsed into the voxel spectra'''
+
+import numpy as np
+from mc2acab import voxel
+
+X, Y, Z, E = [0.0, 1.0, 2.0], [0.0, 1.0], [0.0, 1.0, 3.0], [0.0, 1.0, 20.0]
+
+def _meshtal(filename, flux):
+    "Meshtal with mesh tally 14 of flux (x, y, z, groups) and a decoy tally 24 ahead"
+    lines = [' mcnp   version 6     ld=05/08/13  probid =  05/01/23 10:00:00', '']
+    for ntal, scale in [(24, 100.0), (14, 1.0)]:
+        lines += [f' Mesh Tally Number        {ntal}', ' neutron   mesh tally.', '', ' Tally bin boundaries:',
+                  '    X direction:  ' + ' '.join(f'{x:8.2f}' for x in X),
+                  '    Y direction:  ' + ' '.join(f'{y:8.2f}' for y in Y),
+                  '    Z direction:  ' + ' '.join(f'{z:8.2f}' for z in Z),
+                  '    Energy bin boundaries: ' + ' '.join(f'{e:.2E}' for e in E), '',
+                  '   Energy         X         Y         Z     Result     Rel Error     Volume    Rslt * Vol']
+        for g, energy in enumerate([f'{e:10.3E}' for e in E[1:]] + ['   Total  ']):
+            for i, j, k in np.ndindex(flux.shape[:3]):
+                value = scale*(flux[i, j, k, g] if g < flux.shape[3] else flux[i, j, k].sum())
+                center = [(X[i] + X[i+1])/2, (Y[j] + Y[j+1])/2, (Z[k] + Z[k+1])/2]
+                lines.append(f'{energy} ' + ' '.join(f'{c:9.3f}' for c in center) +
+                             f' {value:.5E} {0.05:.5E} {1.0:.5E} {value:.5E}')
+        lines.append('')
+    with open(filename, 'w', encoding='utf-8') as outfile:
+        outfile.write('\n'.join(lines) + '\n')
+
+def test_parse_meshtal(tmp_path):
+    flux = np.arange(1, 17, dtype=float).reshape(2, 1, 2, 4)[..., :2]*1E-3
+    flux[1, 0, 1] = 0.0
+    meshtal = tmp_path/'meshtal'
+    _meshtal(meshtal, flux)
+    bounds, spectra, error = voxel.load_meshtal(str(meshtal), 14, str(tmp_path/'cache'))
+    np.testing.assert_allclose(bounds['X'], X)
+    np.testing.assert_allclose(bounds['E'], E)
+    # Voxels flattened in (X, Y, Z) C order, total last
+    expected = np.concatenate([flux.reshape(4, 2), flux.reshape(4, 2).sum(axis=1)[:, None]], axis=1)
+    np.testing.assert_allclose(spectra, expected, rtol=1E-5)
+    np.testing.assert_allclose(error, 0.05)
+    assert isinstance(spectra, np.memmap)
+    # Only the used voxels are copied, memory-mapped
+    used = np.flatnonzero(spectra[:, -1] > 0)
+    gathered = voxel.gather(spectra, used, str(tmp_path/'used.npy'))
+    assert isinstance(gathered, np.memmap)
+    np.testing.assert_allclose(gathered, expected[[0, 1, 2]], rtol=1E-5)
@@ -0,0 +1,29 @@
+''' Cell masses and waste classes'''
+
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from mc2acab import query
+from mc2acab import waste
+from test_resultcube import _cube
+
+def test_mass_density():
+    iron = SimpleNamespace(number=1, zaid=[26000], frac=[1.0])
+    assert waste.mass_density(iron, -7.8) == 7.8
+    assert waste.mass_density(iron, 0.0848) == pytest.approx(7.86, rel=1E-2)
+    unknown = SimpleNamespace(number=2, zaid=[150000, 26056], frac=[0.5, 0.5])
+    with pytest.raises(ValueError):
+        waste.mass_density(unknown, 0.08)
+
+def test_classify_missing(tmp_path):
+    # The cube of two slots drops Fe55, whose activity makes the index sums lower bounds
+    campaign = query.Campaign.from_cube(_cube(tmp_path, nslots=2))
+    limits = tmp_path/'limits.txt'
+    limits.write_text('nuclide clearance waste\nCo60 100 1000\nMn54 100 1000\nFe55 1 1000\n')
+    table = waste.classify(campaign, [1.0, 1.0, 1.0], str(limits), done=[True, False, True],
+                           outfile=str(tmp_path/'summary_waste.csv'))
+    assert list(table.index.get_level_values('cell')) == [10, 10, 30, 30]
+    np.testing.assert_allclose(table['missing_Bq/g'], [0.1, 0.1, 0.2, 0.2])
+    np.testing.assert_allclose(table['index_clearance'], [0.03, 0.024, 0.06, 0.048])
+    np.testing.assert_allclose(table['max_index_clearance'], [0.13, 0.124, 0.26, 0.248])
+    assert (table['class'] == 'clearance').all()